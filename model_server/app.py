@@ -1,8 +1,31 @@
 from fastapi import FastAPI
-from routes import dzi_routes, detection_routes
+from config import MODEL_SHARE_MODE, INFERENCE_PRECISION
+from models.model_loader import preload
+from services.quantization import model_name
+from routes import dzi_routes, detection_routes, model_routes, metrics_routes
+from services.job_queue import job_queue
+from services.scene_parallel import shutdown_pools
 
 app = FastAPI()
 
+# Load the weights once here so that forked workers share them, e.g.
+#   MODEL_SHARE_MODE=preload gunicorn --preload -k uvicorn.workers.UvicornWorker -w 4 app:app
+if MODEL_SHARE_MODE == "preload":
+    preload([model_name(name, INFERENCE_PRECISION) for name in ("ship", "oilspill")])
+
 # Register routes
 app.include_router(dzi_routes.router)
 app.include_router(detection_routes.router)
+app.include_router(model_routes.router)
+app.include_router(metrics_routes.router)
+
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start_workers()
+
+
+@app.on_event("shutdown")
+def stop_job_workers():
+    job_queue.stop_workers()
+    shutdown_pools()
@@ -0,0 +1,202 @@
+"""
+Recall-vs-speed report for coarse-to-fine ship detection, to tune its thresholds.
+
+Builds the ship DZI pyramid of a reference scene (a synthetic SAR scene, or --scene),
+runs detect_ships on every deepest-level tile as the reference, then once per
+combination of the swept settings with coarse-to-fine enabled. Per setting it reports:
+    tiles_selected   deepest-level tiles the detector ran on, and their fraction
+    speedup          reference time / coarse-to-fine time (candidate search included)
+    recall_vs_full   fraction of the reference detections found again (IoU >= --iou)
+    tile_recall      synthetic scenes only: fraction of true ships whose tile was selected,
+                     independent of the model, so meaningful with the tiny models too
+    recall_vs_truth  synthetic scenes only: fraction of true ships detected (needs --models real)
+
+--models tiny uses randomly initialised models (no weights needed); use --models real
+with the configured weights to measure detection recall.
+
+Run from model_server/:
+    python -m benchmarks.bench_coarse_recall --size 8192 --cfar-k 3 4 5 6 --levels 1 2 3
+    python -m benchmarks.bench_coarse_recall --scene reference.tiff --models real --method model \\
+        --score-threshold 0.1 0.2 0.3 --out coarse.json
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+# reference rows compared against all found boxes at once
+MATCH_CHUNK = 1024
+
+
+def _boxes(detections):
+    return np.array([[d["x"], d["y"], d["w"], d["h"]] for d in detections], dtype=np.float64).reshape(-1, 4)
+
+
+def recall(reference, found, iou):
+    """Fraction of reference boxes (rows of x, y, w, h) overlapping some found box with IoU >= iou."""
+    if not len(reference):
+        return None
+    if not len(found):
+        return 0.0
+    bx0, by0 = found[:, 0], found[:, 1]
+    bx1, by1 = bx0 + found[:, 2], by0 + found[:, 3]
+    matched = 0
+    for start in range(0, len(reference), MATCH_CHUNK):
+        a = reference[start:start + MATCH_CHUNK]
+        ax0, ay0 = a[:, :1], a[:, 1:2]
+        ax1, ay1 = ax0 + a[:, 2:3], ay0 + a[:, 3:4]
+        inter = (np.clip(np.minimum(ax1, bx1) - np.maximum(ax0, bx0), 0, None)
+                 * np.clip(np.minimum(ay1, by1) - np.maximum(ay0, by0), 0, None))
+        union = a[:, 2:3] * a[:, 3:4] + found[:, 2] * found[:, 3] - inter
+        matched += int(np.count_nonzero((inter >= iou * np.maximum(union, 1e-9)).any(axis=1)))
+    return matched / len(reference)
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _fmt(value, spec=".3f"):
+    return "-" if value is None else format(value, spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scene", help="reference TIFF (default: a synthetic scene)")
+    parser.add_argument("--size", type=int, nargs="+", default=[8192], help="synthetic scene width [height]")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", choices=("tiny", "real"), default="tiny")
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 = default")
+    parser.add_argument("--method", nargs="+", default=["cfar", "model"])
+    parser.add_argument("--levels", type=int, nargs="+", help="pyramid levels below the deepest")
+    parser.add_argument("--cfar-k", type=float, nargs="+")
+    parser.add_argument("--cfar-window", type=int, nargs="+")
+    parser.add_argument("--score-threshold", type=float, nargs="+")
+    parser.add_argument("--margin", type=int, nargs="+")
+    parser.add_argument("--iou", type=float, default=0.5, help="IoU for a detection to count as found")
+    parser.add_argument("--workdir", help="directory for the scene and outputs (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    parser.add_argument("--out", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="sar-coarse-"))
+    for name in ("UPLOADS_DIR", "TILES_DIR", "OUTPUTS_DIR"):
+        os.environ[name] = str(workdir / name.split("_")[0].lower())
+    # imported only now: config reads the directories above at import time
+    import torch
+    from config import UPLOADS_DIR, TILES_DIR
+    from services import ship_detector
+    from services.coarse_to_fine import tile_of
+    from services.dzi_service import generate_dzi
+    from services.tile_loader import open_level, pyramid_levels
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    if args.models == "tiny":
+        from benchmarks.tiny_models import register_tiny_models
+        register_tiny_models(args.seed)
+
+    scene_id = "coarse"
+    tiff_path = UPLOADS_DIR / f"{scene_id}.tiff"
+    tiff_path.parent.mkdir(parents=True, exist_ok=True)
+    truth = None
+    if args.scene:
+        shutil.copyfile(args.scene, tiff_path)
+    else:
+        from benchmarks.synthetic_sar import synthetic_sar, write_tiff
+        scene, truth = synthetic_sar(args.size[0], args.size[-1], seed=args.seed)
+        write_tiff(scene, tiff_path)
+        del scene
+
+    dzi = TILES_DIR / "ship" / scene_id
+    dzi.parent.mkdir(parents=True, exist_ok=True)
+    generate_dzi(tiff_path, dzi, tile_size=ship_detector.TILE_SIZE)
+    folder = Path(f"{dzi}_files")
+    level = str(max(pyramid_levels(folder)))
+    source = open_level(folder, level, ship_detector.TILE_SIZE, ship_detector.OVERLAP, exts=(".jpeg",))
+
+    ship_detector.warmup()
+    reference, full_seconds = _timed(lambda: ship_detector.detect_ships(str(folder), level, coarse=False))
+    reference = _boxes(reference)
+    truth_boxes = np.array(truth["ships"], dtype=np.float64).reshape(-1, 4) if truth else None
+    print(f"Full run: {len(source.tiles)} tiles, {len(reference)} detections in {full_seconds:.2f} s")
+
+    base = ship_detector.coarse_settings()
+    swept = {
+        "levels": args.levels or [base["levels"]],
+        "margin": args.margin or [base["margin"]],
+    }
+    per_method = {
+        "cfar": {"cfar_k": args.cfar_k or [base["cfar_k"]], "cfar_window": args.cfar_window or [base["cfar_window"]]},
+        "model": {"score_threshold": args.score_threshold or [base["score_threshold"]]},
+    }
+
+    rows = []
+    print(f"\n{'method':>6} {'settings':>36} {'tiles':>7} {'frac':>6} {'speedup':>8} {'rec_full':>8} "
+          f"{'tile_rec':>8} {'rec_true':>8}")
+    for method in args.method:
+        grid = {**swept, **per_method[method]}
+        for values in itertools.product(*grid.values()):
+            overrides = dict(zip(grid, values))
+            settings = ship_detector.coarse_settings(method=method, **overrides)
+            report = {}
+            found, seconds = _timed(lambda: ship_detector.detect_ships(str(folder), level, coarse=settings,
+                                                                       report=report))
+            coarse = report["coarse"]
+            if coarse.get("skipped"):
+                print(f"{method:>6} {json.dumps(overrides):>36}  level {coarse['level']} not in the pyramid")
+                continue
+            found = _boxes(found)
+            row = {
+                "method": method, **overrides,
+                "candidates": coarse["candidates"],
+                "tiles_selected": coarse["tiles_selected"],
+                "tiles_fraction": coarse["tiles_selected"] / max(1, coarse["tiles_total"]),
+                "seconds": seconds,
+                "speedup": full_seconds / seconds if seconds else None,
+                "recall_vs_full": recall(reference, found, args.iou),
+                "tile_recall": None,
+                "recall_vs_truth": None,
+            }
+            if truth_boxes is not None and len(truth_boxes):
+                # the tile list is not in the report, so select it again for the truth check
+                tiles, _ = ship_detector.propose_tiles(source, str(folder), level, settings)
+                selected = {(col, row_) for col, row_, _ in tiles}
+                centres = truth_boxes[:, :2] + truth_boxes[:, 2:] / 2
+                hits = sum(tile_of(x, y, ship_detector.TILE_SIZE) in selected for x, y in centres)
+                row["tile_recall"] = hits / len(truth_boxes)
+                row["recall_vs_truth"] = recall(truth_boxes, found, args.iou)
+            rows.append(row)
+            print(f"{method:>6} {json.dumps(overrides):>36} {row['tiles_selected']:>7} {row['tiles_fraction']:6.2f} "
+                  f"{_fmt(row['speedup'], '8.2f')} {_fmt(row['recall_vs_full'], '8.3f')} "
+                  f"{_fmt(row['tile_recall'], '8.3f')} {_fmt(row['recall_vs_truth'], '8.3f')}")
+
+    if args.out:
+        results = {
+            "scene": args.scene or {"synthetic": args.size, "seed": args.seed},
+            "models": args.models,
+            "tiles": len(source.tiles),
+            "full": {
+                "seconds": full_seconds,
+                "detections": len(reference),
+                "recall_vs_truth": recall(truth_boxes, reference, args.iou) if truth_boxes is not None else None,
+            },
+            "settings": rows,
+        }
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.out}")
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Scaling benchmark for the ship detection merge stage.
+
+Compares the reference per-box-dict NMS (detection_merge.nms_records, what
+ship_detector.apply_nms used to do) with the columnar grid_nms on synthetic scenes
+with a growing number of detections. Each ship gets a few jittered duplicate boxes,
+like neighbouring tiles and DETR queries produce.
+
+Run from model_server/:
+    python -m benchmarks.bench_nms --counts 1000 10000 50000 100000
+"""
+import argparse
+import json
+import time
+import numpy as np
+from services.detection_merge import nms_records, grid_nms, columns_to_records
+
+IOU_THRESHOLD = 0.5
+
+
+def synthetic_columns(n_boxes, scene_size, dup_per_ship=3, seed=0):
+    rng = np.random.default_rng(seed)
+    n_ships = max(1, n_boxes // dup_per_ship)
+    cx = rng.uniform(0, scene_size, n_ships).repeat(dup_per_ship)[:n_boxes]
+    cy = rng.uniform(0, scene_size, n_ships).repeat(dup_per_ship)[:n_boxes]
+    w = rng.uniform(8, 80, n_ships).repeat(dup_per_ship)[:n_boxes]
+    h = rng.uniform(8, 80, n_ships).repeat(dup_per_ship)[:n_boxes]
+    jitter = rng.normal(0, 2, (4, n_boxes))
+    return {
+        "x": cx - w / 2 + jitter[0],
+        "y": cy - h / 2 + jitter[1],
+        "w": np.maximum(w + jitter[2], 1),
+        "h": np.maximum(h + jitter[3], 1),
+        "score": rng.uniform(0.5, 1.0, n_boxes),
+        "label": np.zeros(n_boxes, dtype=np.int64),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 5000, 20000, 50000, 100000])
+    parser.add_argument("--scene-size", type=int, default=40000)
+    parser.add_argument("--cell-size", type=int, default=2048)
+    parser.add_argument("--max-reference", type=int, default=50000,
+                        help="skip the reference path above this many boxes")
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    rows = []
+    print(f"{'boxes':>8} {'reference_s':>12} {'grid_s':>10} {'speedup':>8} {'kept':>8} {'agreement':>10}")
+    for n in args.counts:
+        cols = synthetic_columns(n, args.scene_size)
+
+        start = time.perf_counter()
+        kept = grid_nms(cols, IOU_THRESHOLD, cell_size=args.cell_size)
+        grid_s = time.perf_counter() - start
+
+        row = {"boxes": n, "grid_s": grid_s, "kept": len(kept["score"]), "reference_s": None, "agreement": None}
+        if n <= args.max_reference:
+            records = columns_to_records(cols, {0: "ship"})
+            start = time.perf_counter()
+            reference = nms_records(records, IOU_THRESHOLD)
+            row["reference_s"] = time.perf_counter() - start
+            ref_keys = {(round(d["x"], 3), round(d["y"], 3)) for d in reference}
+            grid_keys = {(round(float(x), 3), round(float(y), 3)) for x, y in zip(kept["x"], kept["y"])}
+            row["agreement"] = len(ref_keys & grid_keys) / max(1, len(ref_keys | grid_keys))
+        rows.append(row)
+
+        ref = f"{row['reference_s']:.4f}" if row["reference_s"] is not None else "-"
+        speedup = f"{row['reference_s'] / grid_s:.1f}x" if row["reference_s"] is not None else "-"
+        agreement = f"{row['agreement']:.4f}" if row["agreement"] is not None else "-"
+        print(f"{n:>8} {ref:>12} {grid_s:>10.4f} {speedup:>8} {row['kept']:>8} {agreement:>10}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
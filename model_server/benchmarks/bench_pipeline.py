@@ -0,0 +1,225 @@
+"""
+Offline end-to-end benchmark of the detection pipeline on a synthetic SAR scene.
+
+Generates a SAR-like TIFF (speckled sea, land, ships, slicks, no-data border), then
+times every stage with randomly initialised tiny models, so no network access or
+real weights are needed:
+    generate_dzi_ship / generate_dzi_oilspill   pyramids at each detector's tile size
+    detect_ships / detect_ships_tiff            from the DZI level / straight from the TIFF
+    detect_ships_coarse                         coarse-to-fine, candidates from a lower level
+    detect_oilspill                             segmentation, stitching and mask pyramid
+    detect_oilspill_coarse                      coarse-to-fine, boundary tiles refined
+    stitch_predicted_folder / stitch_tile_folder  legacy and streaming stitching of tile masks
+Each stage reports the median latency over --repeats, tiles/s where it processes
+tiles, and the process' peak RSS after it ran. Results are written as JSON;
+--compare prints the change per stage against an earlier result file.
+
+The upload, tile and output directories are redirected into --workdir.
+
+Run from model_server/:
+    python -m benchmarks.bench_pipeline --size 4096 --out before.json
+    python -m benchmarks.bench_pipeline --size 4096 --out after.json --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_stage(results, name, fn, repeats, tiles=None, setup=None):
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    seconds = statistics.median(times)
+    stage = {"seconds": seconds, "min_s": min(times), "peak_rss_mb": _peak_rss_mb()}
+    if tiles:
+        stage["tiles"] = tiles
+        stage["tiles_per_s"] = tiles / seconds if seconds else None
+    results[name] = stage
+    print(f"{name:>24}: {seconds:8.3f} s" + (f"  {stage['tiles_per_s']:8.1f} tiles/s" if tiles else ""))
+
+
+def compare(results, baseline, tolerance):
+    """Print per-stage latency ratios against a baseline run; returns the names of regressed stages."""
+    regressed = []
+    print(f"\n{'stage':>24}  {'before':>9}  {'after':>9}  {'ratio':>6}")
+    for name, stage in results["stages"].items():
+        before = baseline.get("stages", {}).get(name)
+        if before is None:
+            continue
+        ratio = stage["seconds"] / before["seconds"] if before["seconds"] else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  REGRESSION"
+            regressed.append(name)
+        print(f"{name:>24}  {before['seconds']:9.3f}  {stage['seconds']:9.3f}  {ratio:6.2f}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, nargs="+", default=[4096], help="scene width [height] in pixels")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 = default")
+    parser.add_argument("--stages", nargs="+", help="only run these stages")
+    parser.add_argument("--workdir", help="directory for the scene and outputs (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the working directory")
+    parser.add_argument("--out", help="write results to this JSON file")
+    parser.add_argument("--compare", help="earlier result file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="slowdown ratio flagged as a regression")
+    args = parser.parse_args()
+
+    width, height = args.size[0], args.size[-1]
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="sar-bench-"))
+    for name in ("UPLOADS_DIR", "TILES_DIR", "OUTPUTS_DIR"):
+        os.environ[name] = str(workdir / name.split("_")[0].lower())
+    # every repeat must do the full work
+    os.environ["OILSPILL_RESUMABLE"] = "0"
+
+    # imported only now: config reads the directories above at import time
+    import torch
+    from config import UPLOADS_DIR, TILES_DIR, OUTPUTS_DIR
+    from benchmarks.synthetic_sar import synthetic_sar, write_tiff
+    from benchmarks.tiny_models import register_tiny_models
+    from services import ship_detector, oilspill_detector
+    from services.dzi_service import generate_dzi
+    from services.tile_loader import TiffTileSource, open_level, pyramid_levels
+    from services.tile_container import container_path
+    from services.stitch import stitch_predicted_folder, stitch_tile_folder
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    register_tiny_models(args.seed)
+
+    scene_id = "bench"
+    start = time.perf_counter()
+    scene, truth = synthetic_sar(width, height, seed=args.seed)
+    tiff_path = UPLOADS_DIR / f"{scene_id}.tiff"
+    tiff_path.parent.mkdir(parents=True, exist_ok=True)
+    write_tiff(scene, tiff_path)
+    del scene
+    print(f"Synthetic {width}x{height} scene with {len(truth['ships'])} ships in {time.perf_counter() - start:.1f} s")
+
+    dzi = {kind: TILES_DIR / kind / scene_id for kind in ("ship", "oilspill")}
+    tile_sizes = {"ship": ship_detector.TILE_SIZE, "oilspill": oilspill_detector.TILE_SIZE}
+
+    def clear_dzi(kind):
+        def setup():
+            shutil.rmtree(f"{dzi[kind]}_files", ignore_errors=True)
+            container_path(dzi[kind]).unlink(missing_ok=True)
+            dzi[kind].parent.mkdir(parents=True, exist_ok=True)
+        return setup
+
+    def level_source(kind, **kwargs):
+        folder = Path(f"{dzi[kind]}_files")
+        level = str(max(pyramid_levels(folder)))
+        return folder, level, open_level(folder, level, tile_sizes[kind], **kwargs)
+
+    stages = {}
+    wanted = set(args.stages) if args.stages else None
+
+    def stage(name, fn, **kwargs):
+        if wanted is None or name in wanted:
+            run_stage(stages, name, fn, args.repeats, **kwargs)
+
+    # pyramids are always built, later stages read them
+    for kind in ("ship", "oilspill"):
+        clear_dzi(kind)()
+        generate_dzi(tiff_path, dzi[kind], tile_size=tile_sizes[kind])
+        stage(f"generate_dzi_{kind}", lambda kind=kind: generate_dzi(tiff_path, dzi[kind], tile_size=tile_sizes[kind]),
+              setup=clear_dzi(kind))
+
+    run_stage(stages, "model_load_warmup", lambda: (ship_detector.warmup(), oilspill_detector.warmup()), 1)
+
+    ship_folder, ship_level, ship_source = level_source("ship", exts=(".jpeg",))
+    stage("detect_ships", lambda: ship_detector.detect_ships(str(ship_folder), ship_level, coarse=False),
+          tiles=len(ship_source.tiles))
+    tiff_source = TiffTileSource(tiff_path, ship_detector.TILE_SIZE, ship_detector.OVERLAP)
+    stage("detect_ships_tiff", lambda: ship_detector.detect_ships(str(ship_folder), ship_level, source=tiff_source,
+                                                                  coarse=False),
+          tiles=len(tiff_source.tiles))
+    stage("detect_ships_coarse", lambda: ship_detector.detect_ships(
+        str(ship_folder), ship_level, coarse=ship_detector.coarse_settings()), tiles=len(ship_source.tiles))
+
+    oil_folder, oil_level, oil_source = level_source("oilspill")
+    stage("detect_oilspill", lambda: oilspill_detector.detect_oilspill(
+        str(oil_folder), oil_level, image_id=scene_id, save_tile_masks=False, coarse=False),
+        tiles=len(oil_source.tiles))
+    stage("detect_oilspill_coarse", lambda: oilspill_detector.detect_oilspill(
+        str(oil_folder), oil_level, image_id=scene_id, save_tile_masks=False,
+        coarse=oilspill_detector.coarse_settings()), tiles=len(oil_source.tiles))
+
+    if wanted is None or wanted & {"stitch_predicted_folder", "stitch_tile_folder"}:
+        # per-tile masks to stitch, written once outside the timed stages
+        oilspill_detector.detect_oilspill(str(oil_folder), oil_level, image_id=scene_id, save_tile_masks=True,
+                                          coarse=False)
+        pred_tiles = OUTPUTS_DIR / "oilspill" / scene_id / "pred_tiles" / oil_level
+        n_masks = sum(1 for _ in pred_tiles.glob("*_mask.png"))
+        stitched = OUTPUTS_DIR / "bench_stitched.png"
+        stage("stitch_predicted_folder", lambda: stitch_predicted_folder(
+            str(pred_tiles), str(stitched), xml_path=str(oil_folder / "vips-properties.xml")), tiles=n_masks)
+        stage("stitch_tile_folder", lambda: stitch_tile_folder(
+            str(pred_tiles), str(stitched), full_size=oil_source.size, tile_size=oilspill_detector.TILE_SIZE,
+            overlap=oilspill_detector.OVERLAP), tiles=n_masks)
+
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "python": sys.version.split()[0],
+            "torch": torch.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "threads": torch.get_num_threads(),
+            "scene": [width, height],
+            "seed": args.seed,
+            "repeats": args.repeats,
+        },
+        "stages": stages,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.out}")
+
+    regressed = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressed = compare(results, json.load(f), args.tolerance)
+
+    if not args.keep and not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    if regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+CPU benchmark of the oil-spill TransUNet inference path.
+
+Builds a randomly initialised VisionTransformer, runs it as-is (weights
+re-standardised every call, manual attention) and after prepare_for_inference()
+(standardised weights cached, fused scaled-dot-product attention), checks the
+outputs agree within tolerance and reports the speedup.
+
+Run from model_server/:
+    python -m benchmarks.bench_transunet --batch-size 8 --threads 8
+    python -m benchmarks.bench_transunet --tiny
+"""
+import argparse
+import copy
+import json
+import time
+import torch
+from services.oilspill_util import VisionTransformer, get_r50_b16_config
+from benchmarks.tiny_models import tiny_transunet_config
+
+
+def time_forward(model, x, repeats, warmup=2):
+    with torch.no_grad():
+        for _ in range(warmup):
+            model(x)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            out = model(x)
+    return (time.perf_counter() - start) / repeats, out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads, 0 = default")
+    parser.add_argument("--tiny", action="store_true", help="use the tiny config instead of R50-B16")
+    parser.add_argument("--atol", type=float, default=1e-3)
+    parser.add_argument("--json", help="also write results to this file")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+
+    config = tiny_transunet_config() if args.tiny else get_r50_b16_config()
+    baseline = VisionTransformer(config, img_size=(224, 224), num_classes=config.n_classes).eval()
+    fast = copy.deepcopy(baseline).prepare_for_inference()
+    x = torch.rand(args.batch_size, 3, 224, 224)
+
+    base_s, base_out = time_forward(baseline, x, args.repeats)
+    fast_s, fast_out = time_forward(fast, x, args.repeats)
+
+    max_diff = (base_out - fast_out).abs().max().item()
+    mask_agreement = (base_out.argmax(1) == fast_out.argmax(1)).float().mean().item()
+    result = {
+        "config": "tiny" if args.tiny else "r50_b16",
+        "batch_size": args.batch_size,
+        "threads": torch.get_num_threads(),
+        "baseline_s_per_batch": base_s,
+        "inference_s_per_batch": fast_s,
+        "speedup": base_s / fast_s,
+        "max_abs_diff": max_diff,
+        "mask_agreement": mask_agreement,
+        "within_tolerance": max_diff <= args.atol,
+    }
+    for k, v in result.items():
+        print(f"{k:>22}: {v:.4f}" if isinstance(v, float) else f"{k:>22}: {v}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Equivalence check for batched ship detection.
+
+Runs ship_detector.detect_columns over a scene whose size is not a multiple of the
+tile size, so it has first, interior and cut-off last tiles, and compares its raw
+detections (before NMS) with those of every tile detected on its own, one
+detect_on_batch call per tile. Batching must not change what a tile yields: the
+check fails (exit status 1) if the detection counts differ or any box or score
+differs by more than --tolerance. Tiles are read from the TIFF as dzsave would cut
+them (TiffTileSource), so no pyramid is written.
+
+--models tiny uses randomly initialised models (no weights needed); use --models real
+with the configured weights.
+
+Run from model_server/:
+    python -m benchmarks.check_ship_batching --size 2600 1800 --batch-size 8
+"""
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+import numpy as np
+
+FIELDS = ("x", "y", "w", "h", "score")
+
+
+def _sorted(columns):
+    order = np.lexsort([np.round(columns[f], 2) for f in reversed(("x", "y", "w", "h"))])
+    return {name: values[order] for name, values in columns.items()}
+
+
+def max_difference(a, b):
+    """Largest absolute difference between matching detections, None if the counts differ."""
+    if len(a["score"]) != len(b["score"]):
+        return None
+    if not len(a["score"]):
+        return 0.0
+    a, b = _sorted(a), _sorted(b)
+    if not np.array_equal(a["label"], b["label"]):
+        return float("inf")
+    return max(float(np.max(np.abs(a[f] - b[f]))) for f in FIELDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scene", help="TIFF to check on (default: a synthetic scene)")
+    parser.add_argument("--size", type=int, nargs="+", default=[2600, 1800], help="synthetic scene width [height]")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--models", choices=("tiny", "real"), default="tiny")
+    parser.add_argument("--precision", choices=("fp32", "int8"), default="fp32")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--threshold", type=float, default=None,
+                        help="score threshold (default: SCORE_THRESHOLD; the tiny models need a low one)")
+    parser.add_argument("--tolerance", type=float, default=1e-3)
+    args = parser.parse_args()
+
+    from services import ship_detector
+    from services.detection_merge import concat_columns
+    from services.tile_loader import TiffTileSource
+    from services.tile_triage import TriageStats, select_tiles
+
+    if args.models == "tiny":
+        from benchmarks.tiny_models import register_tiny_models
+        register_tiny_models(args.seed)
+    threshold = args.threshold
+    if threshold is None and args.models == "tiny":
+        threshold = 0.0
+
+    workdir = Path(tempfile.mkdtemp(prefix="sar-batching-"))
+    try:
+        scene_path = args.scene
+        if not scene_path:
+            from benchmarks.synthetic_sar import synthetic_sar, write_tiff
+            scene, _ = synthetic_sar(args.size[0], args.size[-1], seed=args.seed)
+            scene_path = workdir / "scene.tiff"
+            write_tiff(scene, scene_path)
+            del scene
+        source = TiffTileSource(scene_path, ship_detector.TILE_SIZE, ship_detector.OVERLAP)
+        ship_detector.warmup(args.precision)
+
+        start = time.perf_counter()
+        batched = ship_detector.detect_columns(source, args.batch_size, args.precision, TriageStats(), threshold)
+        batched_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        parts, sizes = [], set()
+        for tile in source.tiles:
+            img = source.load(tile)
+            if not select_tiles([img])[0]:
+                continue
+            sizes.add(img.size)
+            offset, content_size = ship_detector.tile_geometry(tile, img)
+            parts.append(ship_detector.detect_on_batch([img], [offset], [content_size], precision=args.precision,
+                                                       threshold=threshold))
+        single = concat_columns(parts)
+        single_seconds = time.perf_counter() - start
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    diff = max_difference(batched, single)
+    print(f"{len(parts)} tiles of sizes {sorted(sizes)}")
+    print(f"batched:  {len(batched['score'])} detections in {batched_seconds:.2f} s")
+    print(f"per tile: {len(single['score'])} detections in {single_seconds:.2f} s")
+    if diff is None or diff > args.tolerance:
+        print(f"FAIL: batched detections differ from per-tile ones (max difference {diff})")
+        sys.exit(1)
+    print(f"OK: max difference {diff:.2e} <= {args.tolerance}")
+
+
+if __name__ == "__main__":
+    main()
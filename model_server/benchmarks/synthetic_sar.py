@@ -0,0 +1,77 @@
+"""Synthetic SAR-like scenes so benchmarks run without real imagery."""
+import numpy as np
+import pyvips
+
+SEA_LEVEL = 40.0
+LAND_LEVEL = 110.0
+SHIP_LEVEL = 240.0
+SLICK_FACTOR = 0.35
+LOOKS = 4
+STRIP_ROWS = 512
+
+
+def synthetic_sar(width, height, seed=0, ships_per_mpix=20, slicks_per_mpix=0.5, land_fraction=0.15,
+                  nodata_fraction=0.05):
+    """
+    Single-band uint8 scene: multiplicative gamma speckle over dark sea, a land mass
+    with a ragged coast along the right edge, small bright ships, dark low-backscatter
+    slick ellipses and a slanted zero no-data border on the left like a projected swath.
+    Generated in row strips so large scenes only need the output array.
+    Returns (scene, truth) with truth = {"ships": [(x, y, w, h)], "slicks": [(cx, cy, rx, ry)]}.
+    """
+    rng = np.random.default_rng(seed)
+    mpix = width * height / 1e6
+    land_w = int(width * land_fraction)
+
+    # coastline as a smoothed random walk around the land edge
+    coast = np.full(height, width, dtype=np.int64)
+    if land_w:
+        walk = np.cumsum(rng.normal(0, 3, height))
+        coast = (width - land_w + walk - walk.mean()).astype(np.int64)
+
+    # keep targets on the water
+    sea_w = max(1, width - land_w - 64)
+    ships = []
+    for _ in range(int(ships_per_mpix * mpix)):
+        w, h = int(rng.integers(4, 24)), int(rng.integers(4, 24))
+        ships.append((int(rng.integers(0, max(1, sea_w - w))), int(rng.integers(0, max(1, height - h))), w, h))
+    slicks = []
+    for _ in range(max(1, int(slicks_per_mpix * mpix))):
+        rx, ry = float(rng.uniform(40, 400)), float(rng.uniform(20, 200))
+        slicks.append((float(rng.uniform(0, sea_w)), float(rng.uniform(0, height)), rx, ry))
+
+    scene = np.empty((height, width), dtype=np.uint8)
+    cols = np.arange(width)
+    for y0 in range(0, height, STRIP_ROWS):
+        y1 = min(height, y0 + STRIP_ROWS)
+        rows = np.arange(y0, y1)
+        strip = np.where(cols[None, :] >= coast[y0:y1, None], LAND_LEVEL, SEA_LEVEL).astype(np.float32)
+
+        for cx, cy, rx, ry in slicks:
+            if cy + ry < y0 or cy - ry >= y1:
+                continue
+            x_lo, x_hi = max(0, int(cx - rx)), min(width, int(cx + rx) + 1)
+            dy = ((rows - cy) / ry)[:, None]
+            dx = ((cols[x_lo:x_hi] - cx) / rx)[None, :]
+            inside = dx ** 2 + dy ** 2 <= 1.0
+            strip[:, x_lo:x_hi][inside] *= SLICK_FACTOR
+
+        for x, y, w, h in ships:
+            if y + h <= y0 or y >= y1:
+                continue
+            strip[max(y, y0) - y0:min(y + h, y1) - y0, x:x + w] = SHIP_LEVEL
+
+        strip *= rng.gamma(LOOKS, 1.0 / LOOKS, strip.shape).astype(np.float32)
+        nodata_w = (width * nodata_fraction * (1.0 - rows / max(1, height))).astype(np.int64)
+        strip[cols[None, :] < nodata_w[:, None]] = 0
+        scene[y0:y1] = np.clip(strip, 0, 255)
+
+    return scene, {"ships": ships, "slicks": slicks}
+
+
+def write_tiff(scene, path):
+    """Save a uint8 scene as a tiled, deflate-compressed TIFF like the uploads the server receives."""
+    height, width = scene.shape
+    image = pyvips.Image.new_from_memory(np.ascontiguousarray(scene).data, width, height, 1, "uchar")
+    image.tiffsave(str(path), tile=True, compression="deflate", bigtiff=width * height > 2 ** 31)
+    return path
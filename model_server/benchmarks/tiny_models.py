@@ -0,0 +1,78 @@
+"""Small randomly initialised model configs so benchmarks run without real weights."""
+from services.oilspill_util import get_r50_b16_config
+
+
+def tiny_transunet_config():
+    """R50-B16 TransUNet layout shrunk to a few blocks and a 64-wide transformer."""
+    config = get_r50_b16_config()
+    config.hidden_size = 64
+    config.transformer = {
+        "num_heads": 4,
+        "num_layers": 2,
+        "attention_dropout_rate": 0.0,
+        "dropout_rate": 0.1,
+        "mlp_dim": 128,
+    }
+    config.resnet.num_layers = [1, 1, 1]
+    config.resnet.width_factor = 0.5
+    # skip features come from the ResNet stages: width*8, width*4, width
+    config.skip_channels = [256, 128, 32, 16]
+    config.decoder_channels = [64, 32, 16, 16]
+    return config
+
+
+def tiny_deformable_detr():
+    """Deformable DETR with a small randomly initialised ResNet backbone and a 64-wide transformer."""
+    from transformers import DeformableDetrConfig, DeformableDetrForObjectDetection, ResNetConfig
+
+    backbone_config = ResNetConfig(
+        embedding_size=16, hidden_sizes=[16, 32, 64, 128], depths=[1, 1, 1, 1],
+        out_features=["stage2", "stage3", "stage4"],
+    )
+    config = DeformableDetrConfig(
+        use_timm_backbone=False, backbone=None, use_pretrained_backbone=False, backbone_config=backbone_config,
+        d_model=64, encoder_layers=1, decoder_layers=1, encoder_attention_heads=4, decoder_attention_heads=4,
+        encoder_ffn_dim=128, decoder_ffn_dim=128, num_queries=50, num_labels=1,
+    )
+    return DeformableDetrForObjectDetection(config).eval()
+
+
+def register_tiny_models(seed=0):
+    """
+    Replace the "ship" and "oilspill" registry loaders (and their int8 variants) with
+    tiny randomly initialised models.
+    """
+    import torch
+    from models.model_loader import register
+    from services.inference_backend import load_backend
+    from services.quantization import quantize_dynamic_int8
+    from services.oilspill_util import VisionTransformer
+    from services.ship_detector import ShipGraph
+
+    def load_ship(quantize=False):
+        from transformers import DeformableDetrImageProcessor
+
+        torch.manual_seed(seed)
+        model = tiny_deformable_detr()
+        if quantize:
+            model = quantize_dynamic_int8(model)
+        return {
+            "model": model,
+            "run": load_backend("ship", "eager", ShipGraph(model).eval(), torch.device("cpu"), None),
+            "processor": DeformableDetrImageProcessor(),
+            "id2label": model.config.id2label,
+        }
+
+    def load_oilspill(quantize=False):
+        torch.manual_seed(seed)
+        config = tiny_transunet_config()
+        model = VisionTransformer(config, img_size=(224, 224), num_classes=config.n_classes).eval()
+        model.prepare_for_inference()
+        if quantize:
+            model = quantize_dynamic_int8(model)
+        return {"model": model, "run": load_backend("oilspill", "eager", model, torch.device("cpu"), None)}
+
+    register("ship", load_ship)
+    register("oilspill", load_oilspill)
+    register("ship:int8", lambda: load_ship(quantize=True))
+    register("oilspill:int8", lambda: load_oilspill(quantize=True))
@@ -6,7 +6,122 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOADS_DIR = Path(os.getenv('UPLOADS_DIR', BASE_DIR / "shared/uploads"))
 TILES_DIR = Path(os.getenv('TILES_DIR', BASE_DIR / "shared/tiles"))
 OUTPUTS_DIR = Path(os.getenv('OUTPUTS_DIR', BASE_DIR / "shared/outputs"))
+# Pyramid layout written by /api/generate_dzi: "fs" (a JPEG file per tile, served to the viewer)
+# or "zip" (one {image_id}.zip per scene, tiles read by the detectors from a memory map).
+# zip is for detector input only: the viewer cannot open it, so the response has no dzi_url
+DZI_CONTAINER = os.getenv('DZI_CONTAINER', 'fs')
 
 # Paths to models
 SHIP_MODEL_PATH = Path(os.getenv('SHIP_MODEL_PATH', BASE_DIR / "model_server/models"))
 OILSPILL_MODEL_PATH = Path(os.getenv('OILSPILL_MODEL_PATH', BASE_DIR / "model_server/models/oil_spill.pth"))
+# torch-format state dict of the ship model, written by tools/export_mmap_checkpoint.py
+SHIP_MMAP_CHECKPOINT = Path(os.getenv('SHIP_MMAP_CHECKPOINT', SHIP_MODEL_PATH / "model_state.pt"))
+
+# How worker processes hold model weights:
+#   private - every process loads its own copy (default)
+#   mmap    - parameters are views into memory-mapped checkpoints, shared through the page cache
+#   preload - the parent process loads all models before forking workers, which share them copy-on-write
+MODEL_SHARE_MODE = os.getenv('MODEL_SHARE_MODE', 'private')
+
+# Inference precision for both detectors: "fp32" or "int8" (dynamic int8 Linear layers, CPU only)
+INFERENCE_PRECISION = os.getenv('INFERENCE_PRECISION', 'fp32')
+# Exported int8 models and their accuracy reports (tools/quantize_models.py)
+QUANTIZED_MODEL_DIR = Path(os.getenv('QUANTIZED_MODEL_DIR', OUTPUTS_DIR / "quantized"))
+
+# Inference backend per detector: eager, torchscript, compile or onnx (ONNX Runtime, CPU).
+# torchscript and onnx need a graph from tools/export_models.py that matched eager on every checked input
+# shape, and fall back to eager without one.
+SHIP_BACKEND = os.getenv('SHIP_BACKEND', 'eager')
+OILSPILL_BACKEND = os.getenv('OILSPILL_BACKEND', 'eager')
+EXPORTED_MODEL_DIR = Path(os.getenv('EXPORTED_MODEL_DIR', OUTPUTS_DIR / "exported"))
+
+# Parallel scene mode: shard the tiles of one scene across this many worker processes
+# (0 or 1 = run in the calling process). Each worker gets SCENE_WORKER_THREADS torch
+# threads (0 = an equal share of the available cores) and, with SCENE_PIN_CORES, its
+# own slice of cores. Scenes with fewer than SCENE_MIN_TILES tiles always run serially.
+SCENE_WORKERS = int(os.getenv('SCENE_WORKERS', 0))
+SCENE_WORKER_THREADS = int(os.getenv('SCENE_WORKER_THREADS', 0))
+SCENE_PIN_CORES = os.getenv('SCENE_PIN_CORES', '1') == '1'
+SCENE_MIN_TILES = int(os.getenv('SCENE_MIN_TILES', 64))
+SCENE_WORKER_START_METHOD = os.getenv('SCENE_WORKER_START_METHOD', 'spawn')
+
+# Per-stage timing histograms served on /metrics. Worker processes write their
+# numbers to METRICS_DIR for the API process to aggregate.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+METRICS_DIR = Path(os.getenv('METRICS_DIR', OUTPUTS_DIR / "metrics"))
+
+# On-demand profiling (profile flag on /detect/dzi and /start_detection): artefacts go to
+# PROFILES_DIR/{job_id}; a flag of "1"/"true" uses PROFILE_DEFAULT_MODE (cprofile, torch or both)
+PROFILES_DIR = Path(os.getenv('PROFILES_DIR', OUTPUTS_DIR / "profiles"))
+PROFILE_DEFAULT_MODE = os.getenv('PROFILE_DEFAULT_MODE', 'cprofile')
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', 50))  # rows in the text summaries
+
+# Resumable oil-spill runs (opt-in): finished tiles are logged next to the outputs so a
+# crashed or repeated run continues where it stopped. The log is committed at most every
+# CHECKPOINT_INTERVAL seconds.
+OILSPILL_RESUMABLE = os.getenv('OILSPILL_RESUMABLE', '0') == '1'
+CHECKPOINT_INTERVAL = float(os.getenv('CHECKPOINT_INTERVAL', 10))
+
+# Number of tiles sent through the ship model per forward pass
+SHIP_BATCH_SIZE = int(os.getenv('SHIP_BATCH_SIZE', 8))
+
+# Number of tiles sent through the oil-spill model per forward pass
+OILSPILL_BATCH_SIZE = int(os.getenv('OILSPILL_BATCH_SIZE', 16))
+# Freeze StdConv2d weight standardisation and use fused attention in the oil-spill model
+# (weights memory-mapped with MODEL_SHARE_MODE=mmap stay shared and are standardised per call)
+OILSPILL_FAST_INFERENCE = os.getenv('OILSPILL_FAST_INFERENCE', '1') == '1'
+# Also write every predicted tile mask as a PNG under pred_tiles (debug output)
+OILSPILL_SAVE_TILE_MASKS = os.getenv('OILSPILL_SAVE_TILE_MASKS', '0') == '1'
+# Also save the full-size mask as one PNG; the mask pyramid is written directly either way
+OILSPILL_STITCHED_PNG = os.getenv('OILSPILL_STITCHED_PNG', '1') == '1'
+# Coarse-to-fine oil-spill segmentation: segment the pyramid level OILSPILL_COARSE_LEVELS below the deepest
+# one, upsample that mask, and segment again at full resolution only the deepest-level tiles within
+# OILSPILL_COARSE_MARGIN px of a predicted spill boundary
+OILSPILL_COARSE_TO_FINE = os.getenv('OILSPILL_COARSE_TO_FINE', '0') == '1'
+OILSPILL_COARSE_LEVELS = int(os.getenv('OILSPILL_COARSE_LEVELS', 2))
+OILSPILL_COARSE_MARGIN = int(os.getenv('OILSPILL_COARSE_MARGIN', 32))
+
+# Tile prefetching: decode threads and how many batches to keep queued ahead of the model
+TILE_LOADER_WORKERS = int(os.getenv('TILE_LOADER_WORKERS', 4))
+TILE_PREFETCH_DEPTH = int(os.getenv('TILE_PREFETCH_DEPTH', 2))
+
+# Tile triage: skip tiles that are no-data padding or uniform open water before the models run
+TRIAGE_ENABLED = os.getenv('TRIAGE_ENABLED', '1') == '1'
+TRIAGE_NODATA_VALUE = int(os.getenv('TRIAGE_NODATA_VALUE', 0))
+TRIAGE_MAX_NODATA_FRACTION = float(os.getenv('TRIAGE_MAX_NODATA_FRACTION', 0.99))
+TRIAGE_MIN_VARIANCE = float(os.getenv('TRIAGE_MIN_VARIANCE', 1.0))
+TRIAGE_MIN_MEAN = float(os.getenv('TRIAGE_MIN_MEAN', 0.0))
+
+# Detection result cache (keyed by scene content, model weights and detector parameters)
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', '1') == '1'
+RESULT_CACHE_DIR = Path(os.getenv('RESULT_CACHE_DIR', OUTPUTS_DIR / "cache"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv('RESULT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Coarse-to-fine ship detection: find candidates on the pyramid level SHIP_COARSE_LEVELS below the
+# deepest one and run the detector only on deepest-level tiles within SHIP_COARSE_MARGIN px of them.
+# SHIP_COARSE_METHOD "cfar": pixels SHIP_COARSE_CFAR_K local standard deviations brighter than their
+# SHIP_COARSE_CFAR_WINDOW px neighbourhood; "model": the ship model itself at SHIP_COARSE_SCORE_THRESHOLD
+SHIP_COARSE_TO_FINE = os.getenv('SHIP_COARSE_TO_FINE', '0') == '1'
+SHIP_COARSE_LEVELS = int(os.getenv('SHIP_COARSE_LEVELS', 2))
+SHIP_COARSE_METHOD = os.getenv('SHIP_COARSE_METHOD', 'cfar')
+SHIP_COARSE_CFAR_K = float(os.getenv('SHIP_COARSE_CFAR_K', 5.0))
+SHIP_COARSE_CFAR_WINDOW = int(os.getenv('SHIP_COARSE_CFAR_WINDOW', 31))
+SHIP_COARSE_SCORE_THRESHOLD = float(os.getenv('SHIP_COARSE_SCORE_THRESHOLD', 0.2))
+SHIP_COARSE_MARGIN = int(os.getenv('SHIP_COARSE_MARGIN', 64))
+
+# Ship detection merge: grid cell size (px) for the seam-aware NMS, and whether NMS runs per label
+NMS_CELL_SIZE = int(os.getenv('NMS_CELL_SIZE', 2048))
+NMS_PER_LABEL = os.getenv('NMS_PER_LABEL', '0') == '1'
+
+# Detection job execution: persistent queue and pool of model worker processes
+JOB_DB_PATH = Path(os.getenv('JOB_DB_PATH', OUTPUTS_DIR / "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+JOB_QUEUE_MAX_PENDING = int(os.getenv('JOB_QUEUE_MAX_PENDING', 32))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', 0))  # torch threads per worker, 0 = torch default
+JOB_WORKER_START_METHOD = os.getenv('JOB_WORKER_START_METHOD', 'fork' if MODEL_SHARE_MODE == 'preload' else 'spawn')
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))
+# Seconds between checks that restart dead job workers and requeue the jobs they were running
+JOB_SUPERVISE_INTERVAL = float(os.getenv('JOB_SUPERVISE_INTERVAL', 5))
+# Comma-separated models ("ship", "oilspill") each job worker loads and warms before taking jobs
+JOB_WORKER_WARMUP = [m for m in os.getenv('JOB_WORKER_WARMUP', '').split(',') if m]
@@ -0,0 +1,98 @@
+import gc
+import itertools
+import os
+import threading
+import time
+
+# name -> zero-argument callable returning the loaded model bundle
+_loaders = {}
+# name -> loaded bundle
+_models = {}
+_lock = threading.Lock()
+
+
+def register(name, loader):
+    """Register (or replace) the loader for a model; an already loaded instance is dropped."""
+    with _lock:
+        _loaders[name] = loader
+        _models.pop(name, None)
+
+
+def get_model(name):
+    """Return the model bundle registered as name, loading it on first use."""
+    bundle = _models.get(name)
+    if bundle is not None:
+        return bundle
+    with _lock:
+        if name not in _models:
+            if name not in _loaders:
+                raise KeyError(f"No model registered as '{name}'")
+            start = time.perf_counter()
+            _models[name] = _loaders[name]()
+            print(f"[models] Loaded '{name}' in {time.perf_counter() - start:.2f}s")
+        return _models[name]
+
+
+def is_loaded(name):
+    return name in _models
+
+
+def unload(name):
+    with _lock:
+        _models.pop(name, None)
+
+
+def registered_models():
+    return {name: is_loaded(name) for name in _loaders}
+
+
+def preload(names=None):
+    """
+    Load the named models (default: every registered model) now. Used in MODEL_SHARE_MODE=preload before worker
+    processes are forked, so they share the weights copy-on-write. gc.freeze() keeps
+    the collector from touching (and so copying) the pages of these long-lived objects.
+    No forward pass is run here: starting the intra-op thread pool before fork can
+    hang the children.
+    """
+    for name in names or list(_loaders):
+        get_model(name)
+    gc.collect()
+    gc.freeze()
+
+
+def build_from_mmap(factory, checkpoint_path):
+    """
+    Build a model whose parameters are views into a memory-mapped torch checkpoint
+    rather than private copies, so every process using the same file shares one copy
+    of the weights through the page cache.
+    factory() is called on the meta device so no weights are allocated beforehand.
+    Returns None if the checkpoint is missing, not in torch's zip format, or does not
+    cover every parameter and buffer.
+    """
+    import torch
+
+    if not os.path.exists(checkpoint_path):
+        return None
+    try:
+        state_dict = torch.load(str(checkpoint_path), map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError as e:
+        print(f"[models] Cannot memory-map {checkpoint_path}: {e}")
+        return None
+
+    with torch.device("meta"):
+        model = factory()
+    missing = model.state_dict().keys() - state_dict.keys()
+    if missing:
+        print(f"[models] {checkpoint_path} lacks {len(missing)} tensors (e.g. {min(missing)}), not using it")
+        return None
+    try:
+        model.load_state_dict(state_dict, assign=True)
+    except RuntimeError as e:
+        # unexpected keys or shape mismatches: a checkpoint of some other model
+        print(f"[models] Cannot load {checkpoint_path}: {e}")
+        return None
+    # non-persistent buffers are not in any checkpoint and would stay on the meta device
+    if any(t.is_meta for t in itertools.chain(model.parameters(), model.buffers())):
+        print(f"[models] {checkpoint_path} does not cover every tensor, not using it")
+        return None
+    return model.eval()
@@ -1,62 +1,220 @@
-from fastapi import APIRouter, HTTPException, BackgroundTasks
-from config import TILES_DIR
-from services.ship_detector import detect_ships
-from services.oilspill_detector import detect_oilspill
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+import config
+from config import TILES_DIR, UPLOADS_DIR, SHIP_MODEL_PATH, OILSPILL_MODEL_PATH
+from services import ship_detector, oilspill_detector
+from services.ship_detector import detect_ships, TILE_SIZE as SHIP_TILE_SIZE, OVERLAP as SHIP_OVERLAP
+from services.oilspill_detector import detect_oilspill, TILE_SIZE as OILSPILL_TILE_SIZE, OVERLAP as OILSPILL_OVERLAP
+from services.tile_loader import TiffTileSource, pyramid_levels
+from services.tile_triage import triage_params
+from services.result_cache import ResultCache, cache_key, file_fingerprint, model_fingerprint, level_fingerprint
+from services.tile_container import container_path_for_folder
+from services.result_format import FORMATS, MEDIA_TYPES, iter_encoded, as_records, result_count, jsonable
+from services.job_queue import job_queue, QueueFull
+from services.metrics import timed, job_timings, dump as dump_metrics
+from services.profiling import profiled, profile_mode
 from pathlib import Path
+import uuid
 import requests
 import traceback
 
 router = APIRouter()
 
+# "dzi": deepest level of the pyramid written by /api/generate_dzi
+# "tiff": windows read straight from the uploaded image, no pyramid needed
+ALLOWED_SOURCES = {"dzi", "tiff"}
+
+
+def _tiff_source(type_: str, image_id: str):
+    input_path = UPLOADS_DIR / type_ / f"{image_id}.tiff"
+    if not input_path.exists():
+        return None
+    if type_ == "ship":
+        return TiffTileSource(input_path, SHIP_TILE_SIZE, SHIP_OVERLAP)
+    return TiffTileSource(input_path, OILSPILL_TILE_SIZE, OILSPILL_OVERLAP)
+
+
+def _pyramid_exists(dzi_folder: Path):
+    """Whether the pyramid is on disk, as a tile folder or a single-file container."""
+    return dzi_folder.exists() or container_path_for_folder(dzi_folder).is_file()
+
+
+result_cache = ResultCache()
+
+
+def _result_cache_key(type_: str, dzi_folder: Path, zoom_level: str, source=None):
+    if source is not None:
+        scene = file_fingerprint(source.image_path)
+    else:
+        scene = level_fingerprint(dzi_folder, zoom_level)
+
+    if type_ == "ship":
+        model_hash = model_fingerprint(SHIP_MODEL_PATH)
+        params = {
+            "score_threshold": ship_detector.SCORE_THRESHOLD,
+            "iou_threshold": ship_detector.IOU_THRESHOLD,
+            "tile_size": SHIP_TILE_SIZE,
+            "overlap": SHIP_OVERLAP,
+            "nms_per_label": config.NMS_PER_LABEL,
+            "nms_cell_size": config.NMS_CELL_SIZE,
+            "backend": config.SHIP_BACKEND,
+            "coarse": ship_detector.coarse_settings() if config.SHIP_COARSE_TO_FINE else False,
+        }
+    else:
+        model_hash = model_fingerprint(OILSPILL_MODEL_PATH)
+        params = {
+            "tile_size": OILSPILL_TILE_SIZE,
+            "overlap": OILSPILL_OVERLAP,
+            "backend": config.OILSPILL_BACKEND,
+            "coarse": oilspill_detector.coarse_settings() if config.OILSPILL_COARSE_TO_FINE else False,
+        }
+    params["triage"] = triage_params()
+    params["precision"] = config.INFERENCE_PRECISION
+    return cache_key(type=type_, scene=scene, model=model_hash, zoom_level=zoom_level,
+                     source="tiff" if source is not None else "dzi", params=params)
+
+
+def _detect(type_: str, dzi_folder: Path, zoom_level: str, source=None, report: dict = None,
+            profile: str = None, job_id: str = None):
+    """
+    Run the detector, answering repeat requests for an unchanged scene and model from the result cache.
+    report["timings"] receives the per-stage time breakdown of this run.
+    profile: a profile_mode(); the run is then profiled (bypassing the cache lookup) and
+    report["profile"] points at the artefacts under PROFILES_DIR/{job_id}.
+    """
+    report = report if report is not None else {}
+    with profiled(job_id, profile) as artefacts:
+        with job_timings() as timings:
+            with timed("detection"):
+                results = _detect_cached(type_, dzi_folder, zoom_level, source, report, use_cache=artefacts is None)
+    report["timings"] = timings.as_dict()
+    if artefacts is not None:
+        report["profile"] = artefacts
+    # other API processes serve /metrics too
+    dump_metrics()
+    return results
+
+
+def _detect_cached(type_: str, dzi_folder: Path, zoom_level: str, source, report: dict, use_cache=True):
+    key = _result_cache_key(type_, dzi_folder, zoom_level, source=source)
+    cached = None
+    if use_cache:
+        with timed("cache_lookup"):
+            cached = result_cache.get(key)
+    if cached is not None:
+        report.update(cached["report"])
+        report["cached"] = True
+        return cached["results"]
+
+    if type_ == "ship":
+        # kept as columns: the columnar format encodes them directly, the JSON formats expand them
+        results = detect_ships(str(dzi_folder), zoom_level, source=source, report=report, as_columns=True)
+        files = ()
+    else:
+        results = detect_oilspill(str(dzi_folder), zoom_level, source=source, report=report)
+        # oil-spill results point at files that a later run may overwrite
+        files = [p for p in (results["stitched_mask"], f"{results['dzi_path']}.dzi") if p]
+
+    result_cache.put(key, {"results": jsonable(results), "report": report}, files=files)
+    return results
+
+
+def _response(message: str, results, report: dict, fmt: str):
+    if fmt == "json":
+        return {
+            "message": message,
+            "count": result_count(results),
+            "detections": as_records(results),
+            **report
+        }
+    header = {"message": message, **report}
+    return StreamingResponse(iter_encoded(fmt, header, results), media_type=MEDIA_TYPES[fmt])
+
+
+def _post_results(callback_url: str, payload: dict, fmt: str):
+    with timed("callback_post"):
+        return _send_results(callback_url, payload, fmt)
+
+
+def _send_results(callback_url: str, payload: dict, fmt: str):
+    if fmt == "json":
+        return requests.post(callback_url, json=dict(payload, detections=as_records(payload["detections"])),
+                             timeout=30)
+    # streamed formats go out as a chunked upload, detections are never held as one JSON body
+    header = {k: v for k, v in payload.items() if k != "detections"}
+    return requests.post(callback_url, data=iter_encoded(fmt, header, payload["detections"]),
+                         headers={"Content-Type": MEDIA_TYPES[fmt]}, timeout=30)
+
+
 @router.post("/detect/dzi/{type}/{image_id}")
-def detect_from_dzi(type: str, image_id: str):
+def detect_from_dzi(type: str, image_id: str, source: str = "dzi", format: str = "json", profile: str = None):
     # existing synchronous synchronous detection for clients that want it
+    # profile: "cprofile" | "torch" | "both" | "true" to profile this run (see services/profiling.py)
     if type not in {"ship", "oilspill"}:
         raise HTTPException(status_code=400, detail="Invalid type. Use 'ship' or 'oilspill'.")
+    if source not in ALLOWED_SOURCES:
+        raise HTTPException(status_code=400, detail="Invalid source. Use 'dzi' or 'tiff'.")
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(FORMATS)}.")
+    try:
+        profile = profile_mode(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    # synchronous runs have no job id; profiles are stored under a generated one
+    job_id = f"{type}-{image_id}-{uuid.uuid4().hex[:8]}"
 
     dzi_folder = TILES_DIR / type / f"{image_id}_files"
-    if not dzi_folder.exists():
+    if source == "tiff":
+        tile_source = _tiff_source(type, image_id)
+        if tile_source is None:
+            raise HTTPException(status_code=404, detail=f"Uploaded image not found: {UPLOADS_DIR / type / f'{image_id}.tiff'}")
+        try:
+            report = {}
+            results = _detect(type, dzi_folder, tile_source.zoom_level, source=tile_source, report=report,
+                              profile=profile, job_id=job_id)
+            return _response(f"{type.capitalize()} TIFF detection complete.", results, report, format)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+
+    if not _pyramid_exists(dzi_folder):
         raise HTTPException(status_code=404, detail=f"Tile folder not found: {dzi_folder}")
 
     # Find deepest zoom
     try:
-        zoom_levels = [
-            int(folder.name) for folder in dzi_folder.iterdir() if folder.is_dir() and folder.name.isdigit()
-        ]
+        zoom_levels = pyramid_levels(dzi_folder)
         if not zoom_levels:
             raise HTTPException(status_code=500, detail="No zoom level folders found inside tile folder.")
         max_zoom_level = str(max(zoom_levels))
         deepest_tile_path = dzi_folder / max_zoom_level
-        if not deepest_tile_path.exists():
+        if dzi_folder.exists() and not deepest_tile_path.exists():
             raise HTTPException(status_code=404, detail=f"Deepest zoom level folder not found: {deepest_tile_path}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading zoom levels: {str(e)}")
 
     try:
-        if type == "ship":
-            results = detect_ships(str(dzi_folder), max_zoom_level)
-        else:
-            results = detect_oilspill(str(dzi_folder), max_zoom_level)
+        report = {}
+        results = _detect(type, dzi_folder, max_zoom_level, report=report, profile=profile, job_id=job_id)
 
-        return {
-            "message": f"{type.capitalize()} DZI detection complete.",
-            "count": len(results),
-            "detections": results
-        }
+        return _response(f"{type.capitalize()} DZI detection complete.", results, report, format)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # New endpoint to start background detection and callback when finished
 @router.post("/start_detection")
-def start_detection(payload: dict, background_tasks: BackgroundTasks):
+def start_detection(payload: dict):
     """
+    Queues the job for the detection worker pool; answers 429 when the queue is full.
     Expects JSON payload:
     {
       "type": "ship" | "oilspill",
       "image_id": "<id>",
       "job_id": "<uuid>",
-      "callback_url": "http://node-server/.../webhook"
+      "callback_url": "http://node-server/.../webhook",
+      "source": "dzi" | "tiff"   (optional, default "dzi"),
+      "format": "json" | "ndjson" | "columnar"   (optional, default "json"),
+      "profile": "cprofile" | "torch" | "both" | true   (optional, profiles the run;
+                 the callback payload's "profile" points at the artefacts)
     }
     """
     try:
@@ -64,29 +222,58 @@ def start_detection(payload: dict, background_tasks: BackgroundTasks):
         image_id = payload.get('image_id')
         job_id = payload.get('job_id')
         callback_url = payload.get('callback_url')
+        source = payload.get('source', 'dzi')
+        fmt = payload.get('format', 'json')
+        profile = payload.get('profile')
 
         if not type_ or type_ not in {"ship", "oilspill"}:
             raise HTTPException(status_code=400, detail="Invalid type. Use 'ship' or 'oilspill'.")
         if not image_id or not job_id or not callback_url:
             raise HTTPException(status_code=400, detail="Missing one of required fields: image_id, job_id, callback_url")
+        if source not in ALLOWED_SOURCES:
+            raise HTTPException(status_code=400, detail="Invalid source. Use 'dzi' or 'tiff'.")
+        if fmt not in FORMATS:
+            raise HTTPException(status_code=400, detail=f"Invalid format. Use one of: {', '.join(FORMATS)}.")
+        try:
+            profile = profile_mode(profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
 
-        # schedule background task
-        background_tasks.add_task(_run_detection_and_callback, type_, image_id, job_id, callback_url)
-        return {"started": True, "job_id": job_id}
+        # persist the job, a worker process picks it up
+        options = {"source": source, "fmt": fmt, "profile": profile}
+        status = job_queue.submit(job_id, type_, image_id, callback_url, options)
+        return {"started": True, "job_id": job_id, "status": status}
+    except QueueFull as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "30"})
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def _run_detection_and_callback(type_: str, image_id: str, job_id: str, callback_url: str):
+def _run_detection_and_callback(type_: str, image_id: str, job_id: str, callback_url: str, source: str = "dzi",
+                                fmt: str = "json", profile: str = None):
     """
-    This function runs in background (FastAPI BackgroundTasks).
+    This function runs in a detection worker process (see services/job_queue.py).
     It runs the detection and then POSTs results to callback_url.
+    Returns None on success, otherwise the error reported for the job.
     """
     try:
         dzi_folder = TILES_DIR / type_ / f"{image_id}_files"
-        if not dzi_folder.exists():
+        tile_source = None
+        if source == "tiff":
+            tile_source = _tiff_source(type_, image_id)
+            if tile_source is None:
+                payload = {
+                    "job_id": job_id,
+                    "type": type_,
+                    "image_id": image_id,
+                    "error": f"Uploaded image not found: {UPLOADS_DIR / type_ / f'{image_id}.tiff'}"
+                }
+                requests.post(callback_url, json=payload, timeout=15)
+                return payload["error"]
+            max_zoom_level = tile_source.zoom_level
+        elif not _pyramid_exists(dzi_folder):
             # send error back to callback anyway
             payload = {
                 "job_id": job_id,
@@ -95,45 +282,44 @@ def _run_detection_and_callback(type_: str, image_id: str, job_id: str, callback
                 "error": f"Tile folder not found: {dzi_folder}"
             }
             requests.post(callback_url, json=payload, timeout=15)
-            return
-
-        # Find deepest zoom level
-        zoom_levels = [
-            int(folder.name) for folder in dzi_folder.iterdir() if folder.is_dir() and folder.name.isdigit()
-        ]
-        if not zoom_levels:
-            payload = {
-                "job_id": job_id,
-                "type": type_,
-                "image_id": image_id,
-                "error": "No zoom level folders found"
-            }
-            requests.post(callback_url, json=payload, timeout=15)
-            return
+            return payload["error"]
+        else:
+            # Find deepest zoom level
+            zoom_levels = pyramid_levels(dzi_folder)
+            if not zoom_levels:
+                payload = {
+                    "job_id": job_id,
+                    "type": type_,
+                    "image_id": image_id,
+                    "error": "No zoom level folders found"
+                }
+                requests.post(callback_url, json=payload, timeout=15)
+                return payload["error"]
 
-        max_zoom_level = str(max(zoom_levels))
+            max_zoom_level = str(max(zoom_levels))
 
         # Run detection
-        if type_ == "ship":
-            results = detect_ships(str(dzi_folder), max_zoom_level)
-        else:
-            results = detect_oilspill(str(dzi_folder), max_zoom_level)
+        report = {}
+        results = _detect(type_, dzi_folder, max_zoom_level, source=tile_source, report=report,
+                          profile=profile, job_id=job_id)
 
         # Prepare payload
         payload = {
             "job_id": job_id,
             "type": type_,
             "image_id": image_id,
-            "detections": results
+            "detections": results,
+            **report
         }
 
         # Post results to callback_url
         try:
-            requests.post(callback_url, json=payload, timeout=30)
+            _post_results(callback_url, payload, fmt)
         except Exception as post_err:
             # If callback fails, log it (FastAPI logs) and optionally retry logic can be added
             print(f"Failed to post results to callback {callback_url}: {post_err}")
-            # Optionally write to file or DB for later retries
+            return f"Failed to post results to callback: {post_err}"
+        return None
     except Exception as e:
         # Unexpected error: send error info to callback
         try:
@@ -148,3 +334,17 @@ def _run_detection_and_callback(type_: str, image_id: str, job_id: str, callback
             requests.post(callback_url, json=payload, timeout=15)
         except Exception:
             print("Failed to send error callback; original exception:", traceback.format_exc())
+        return f"Exception during detection: {e}"
+
+
+@router.get("/jobs")
+def job_queue_stats():
+    return job_queue.stats()
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
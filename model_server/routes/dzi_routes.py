@@ -23,12 +23,18 @@ def dzi_endpoint(type: str, image_id: str):
         # Use tile_size 512 for ship, 256 otherwise
         tile_size = 512 if type == "ship" else 256
 
-        # Save as tiles/type/imageId/imageId.dzi
-        generate_dzi(input_path, output_dir / image_id, tile_size=tile_size)
-
+        # Save as tiles/type/imageId.dzi, or tiles/type/imageId.zip with DZI_CONTAINER=zip
+        written = generate_dzi(input_path, output_dir / image_id, tile_size=tile_size)
+
+        if Path(written).suffix == ".zip":
+            # /tiles is served as plain files and the viewer cannot open a zip, so there is no dzi_url
+            return {
+                "message": "DZI container generated for the detectors only; it has no viewer URL",
+                "container": f"{type}/{Path(written).name}"
+            }
         return {
             "message": "DZI generated successfully",
-            "dzi_url": f"/tiles/{type}/{image_id}.dzi"
+            "dzi_url": f"/tiles/{type}/{Path(written).name}"
         }
 
     except Exception as e:
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from services.metrics import collect, render_prometheus
+from services.job_queue import job_queue
+
+router = APIRouter()
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Per-stage duration histograms of this process and the worker processes, in Prometheus text format."""
+    stats = job_queue.stats()
+    gauges = {
+        "sar_jobs": ("Jobs in the queue database by status.",
+                     {status: stats[status] for status in ("queued", "running", "completed", "failed")}, "status"),
+        "sar_job_workers": ("Live detection worker processes.", {"api": stats["workers"]}, "process"),
+    }
+    return PlainTextResponse(render_prometheus(collect(), gauges), media_type=PROMETHEUS_CONTENT_TYPE)
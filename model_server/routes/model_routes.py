@@ -0,0 +1,30 @@
+import time
+from fastapi import APIRouter, HTTPException
+from models.model_loader import registered_models
+from services import ship_detector, oilspill_detector
+
+router = APIRouter()
+
+WARMUPS = {
+    "ship": ship_detector.warmup,
+    "oilspill": oilspill_detector.warmup,
+}
+
+
+@router.get("/models")
+def list_models():
+    """Registered models and whether this worker has loaded them yet."""
+    return registered_models()
+
+
+@router.post("/warmup/{name}")
+def warmup_model(name: str):
+    """Load a model (if needed) and run one forward pass so the first real request is not slowed down."""
+    if name not in WARMUPS:
+        raise HTTPException(status_code=400, detail=f"Invalid model. Use one of: {', '.join(WARMUPS)}.")
+    start = time.perf_counter()
+    try:
+        WARMUPS[name]()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {"model": name, "warm": True, "seconds": round(time.perf_counter() - start, 3)}
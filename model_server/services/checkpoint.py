@@ -0,0 +1,110 @@
+import json
+import os
+import time
+from pathlib import Path
+from config import CHECKPOINT_INTERVAL
+
+# Stages of a scene run, in order; "coarse" only in coarse-to-fine runs
+STAGES = ("coarse", "tiles", "stitched", "dzi")
+
+
+class TileLog:
+    """
+    Append-only log of finished tiles, one "col,row" line each. Tiles are buffered and
+    committed at most every CHECKPOINT_INTERVAL seconds: the canvas is flushed first,
+    then the lines are appended and fsynced, so a logged tile's mask is always on disk.
+    Several processes may append to the same log (one O_APPEND write per commit).
+    """
+    def __init__(self, path, interval=None):
+        self.path = str(path)
+        self.interval = CHECKPOINT_INTERVAL if interval is None else interval
+        self._pending = []
+        self._last_commit = time.monotonic()
+
+    def record(self, canvas, tiles):
+        self._pending.extend((col, row) for col, row, _ in tiles)
+        if time.monotonic() - self._last_commit >= self.interval:
+            self.commit(canvas)
+
+    def commit(self, canvas):
+        if not self._pending:
+            return
+        canvas.flush()
+        data = "".join(f"{col},{row}\n" for col, row in self._pending).encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._pending = []
+        self._last_commit = time.monotonic()
+
+    def read(self):
+        done = set()
+        try:
+            f = open(self.path)
+        except FileNotFoundError:
+            return done
+        with f:
+            for line in f:
+                # a line torn by a crash is not a finished tile
+                if line.endswith("\n"):
+                    col, row = line.split(",")
+                    done.add((int(col), int(row)))
+        return done
+
+    def remove(self):
+        self._pending = []
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class SceneCheckpoint:
+    """
+    Progress of one scene run, kept next to its outputs: {prefix}.checkpoint.json holds
+    a tag identifying the inputs (model, parameters, scene) and the last completed
+    stage, {prefix}.tiles.log the tiles finished so far. A checkpoint whose tag does
+    not match the current inputs is discarded.
+    """
+    def __init__(self, prefix, tag):
+        self.meta_path = Path(f"{prefix}.checkpoint.json")
+        self.log = TileLog(f"{prefix}.tiles.log")
+        self.tag = tag
+        self.stage = None
+        self.done = set()
+        meta = self._read_meta()
+        if meta is not None and meta.get("tag") == tag:
+            self.stage = meta.get("stage")
+            self.done = self.log.read()
+        else:
+            self.reset()
+
+    @property
+    def resumed(self):
+        return self.stage is not None or bool(self.done)
+
+    def reached(self, stage):
+        return self.stage is not None and STAGES.index(self.stage) >= STAGES.index(stage)
+
+    def complete(self, stage):
+        self.stage = stage
+        self._write_meta()
+
+    def reset(self):
+        self.stage = None
+        self.done = set()
+        self.log.remove()
+        self._write_meta()
+
+    def _read_meta(self):
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self):
+        self.meta_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"tag": self.tag, "stage": self.stage}))
+        os.replace(tmp, self.meta_path)
@@ -0,0 +1,142 @@
+import math
+import numpy as np
+from services.tile_loader import open_level, iter_tile_batches, TILE_EXTS
+from services.tile_triage import select_tiles
+
+# Tiles decoded per batch while scanning a coarse level
+SCAN_BATCH_SIZE = 16
+# Floor on the local standard deviation, so flat water or JPEG-smoothed areas do not fire on tiny bumps
+MIN_LOCAL_STD = 2.0
+
+
+def coarse_level_source(tile_folder, deep_level, levels, tile_size, overlap=1, exts=TILE_EXTS):
+    """
+    The pyramid level `levels` below deep_level and its scale to the deep level
+    (dzsave halves every level), or (None, 1) when the pyramid does not have that level.
+    """
+    level = int(deep_level) - levels
+    if levels < 1 or level < 0:
+        return None, 1
+    try:
+        return open_level(tile_folder, level, tile_size, overlap, exts=exts), 2 ** levels
+    except FileNotFoundError:
+        return None, 1
+
+
+def tile_origin(col, row, tile_size, overlap):
+    """Level coordinates of a dzsave tile's top-left pixel, overlap border included."""
+    return col * tile_size - (overlap if col > 0 else 0), row * tile_size - (overlap if row > 0 else 0)
+
+
+def _window_sum(a, radius):
+    """Sum over the (2 * radius + 1)^2 window around every pixel, edges replicated, via an integral image."""
+    n = 2 * radius + 1
+    h, w = a.shape
+    integral = np.zeros((h + n, w + n), dtype=np.float64)
+    integral[1:, 1:] = np.pad(a, radius, mode="edge").cumsum(0).cumsum(1)
+    return integral[n:n + h, n:n + w] - integral[:h, n:n + w] - integral[n:n + h, :w] + integral[:h, :w]
+
+
+def bright_targets(img, k, window):
+    """
+    CFAR-style detection of small bright targets: pixels more than k local standard
+    deviations above the mean of their window x window neighbourhood.
+    Returns the (xs, ys) of the hits in tile pixels.
+    """
+    grey = np.asarray(img.convert("L"), dtype=np.float64)
+    radius = window // 2
+    n = (2 * radius + 1) ** 2
+    mean = _window_sum(grey, radius) / n
+    std = np.sqrt(np.maximum(_window_sum(grey * grey, radius) / n - mean ** 2, 0.0))
+    ys, xs = np.nonzero(grey > mean + k * np.maximum(std, MIN_LOCAL_STD))
+    return xs, ys
+
+
+def scan_bright_targets(source, k, window):
+    """
+    bright_targets over every tile of source that passes triage.
+    Returns one-pixel boxes (x0, y0, x1, y1) in level coordinates.
+    """
+    xs, ys = [], []
+    for batch, tile_imgs in iter_tile_batches(source.tiles, SCAN_BATCH_SIZE, load_fn=source.load):
+        keep = select_tiles(tile_imgs)
+        for (col, row, _), img, kept in zip(batch, tile_imgs, keep):
+            if not kept:
+                continue
+            left, top = tile_origin(col, row, source.tile_size, source.overlap)
+            hit_x, hit_y = bright_targets(img, k, window)
+            xs.append(hit_x + left)
+            ys.append(hit_y + top)
+    x = np.concatenate(xs) if xs else np.empty(0, dtype=np.int64)
+    y = np.concatenate(ys) if ys else np.empty(0, dtype=np.int64)
+    return x, y, x + 1, y + 1
+
+
+def touched_tiles(tiles, boxes, tile_size, margin=0):
+    """
+    The tiles whose content area lies within `margin` px of any box (x0, y0, x1, y1),
+    boxes given as arrays in the tiles' level coordinates, x1/y1 exclusive. Keeps the order of tiles.
+    """
+    if not tiles:
+        return []
+    x0, y0, x1, y1 = (np.asarray(b, dtype=np.float64) for b in boxes)
+    n_cols = max(col for col, _, _ in tiles) + 1
+    n_rows = max(row for _, row, _ in tiles) + 1
+    grid = np.zeros((n_rows, n_cols), dtype=bool)
+    if x0.size:
+        c0 = np.clip(np.floor((x0 - margin) / tile_size), 0, n_cols - 1).astype(np.int64)
+        c1 = np.clip(np.ceil((x1 + margin) / tile_size) - 1, 0, n_cols - 1).astype(np.int64)
+        r0 = np.clip(np.floor((y0 - margin) / tile_size), 0, n_rows - 1).astype(np.int64)
+        r1 = np.clip(np.ceil((y1 + margin) / tile_size) - 1, 0, n_rows - 1).astype(np.int64)
+        # boxes span few tiles, so mark them by offset from their first tile
+        for dr in range(int((r1 - r0).max()) + 1):
+            for dc in range(int((c1 - c0).max()) + 1):
+                inside = (r0 + dr <= r1) & (c0 + dc <= c1)
+                grid[(r0 + dr)[inside], (c0 + dc)[inside]] = True
+    return [tile for tile in tiles if grid[tile[1], tile[0]]]
+
+
+def tile_of(x, y, tile_size):
+    """(col, row) of the tile whose content area holds level pixel (x, y)."""
+    return math.floor(x / tile_size), math.floor(y / tile_size)
+
+
+def upsample_canvas(coarse, canvas, scale, strip_rows=512):
+    """Fill canvas with the mask of the coarse canvas scaled up by `scale` (nearest neighbour), strip by strip."""
+    for y0 in range(0, canvas.height, strip_rows):
+        y1 = min(canvas.height, y0 + strip_rows)
+        c0 = y0 // scale
+        block = np.repeat(np.repeat(coarse.array[c0:-(-y1 // scale)], scale, axis=0), scale, axis=1)
+        block = block[y0 - c0 * scale:y1 - c0 * scale, :canvas.width]
+        # dzsave may round a level's size down, leaving the last row or column short
+        pad = ((0, y1 - y0 - block.shape[0]), (0, canvas.width - block.shape[1]))
+        if any(after for _, after in pad):
+            block = np.pad(block, pad, mode="edge")
+        canvas.array[y0:y1] = block
+        canvas.release_rows(y0, y1)
+
+
+def mask_edges(mask, strip_rows=1024):
+    """
+    Where a mask changes value, as boxes (x0, y0, x1, y1) covering the two pixels of
+    each change. Scanned in row strips so only one strip's comparisons are in memory.
+    """
+    x0, y0, x1, y1 = [], [], [], []
+    height = mask.shape[0]
+    for top in range(0, height, strip_rows):
+        bottom = min(height, top + strip_rows)
+        # one extra row catches changes across the strip boundary
+        strip = mask[top:min(height, bottom + 1)]
+        ys, xs = np.nonzero(strip[:bottom - top, 1:] != strip[:bottom - top, :-1])
+        x0 += [xs]
+        y0 += [ys + top]
+        x1 += [xs + 2]
+        y1 += [ys + top + 1]
+        ys, xs = np.nonzero(strip[1:] != strip[:-1])
+        x0 += [xs]
+        y0 += [ys + top]
+        x1 += [xs + 1]
+        y1 += [ys + top + 2]
+    if not x0:
+        return tuple(np.empty(0, dtype=np.int64) for _ in range(4))
+    return tuple(np.concatenate(parts) for parts in (x0, y0, x1, y1))
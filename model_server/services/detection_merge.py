@@ -0,0 +1,108 @@
+import numpy as np
+import torch
+import torchvision.ops as ops
+
+# Detections are kept as a dict of equal-length numpy columns until they are returned
+COLUMNS = ("x", "y", "w", "h", "score", "label")
+
+
+def empty_columns():
+    return {k: np.empty(0, dtype=np.int64 if k == "label" else np.float64) for k in COLUMNS}
+
+
+def concat_columns(parts):
+    parts = [p for p in parts if len(p["score"])]
+    if not parts:
+        return empty_columns()
+    return {k: np.concatenate([p[k] for p in parts]) for k in COLUMNS}
+
+
+def take_columns(cols, idx):
+    return {k: cols[k][idx] for k in COLUMNS}
+
+
+def columns_to_records(cols, id2label):
+    """Per-box dicts in the shape the API returns."""
+    return [
+        {
+            "x": float(x), "y": float(y), "w": float(w), "h": float(h),
+            "label": id2label.get(int(label), str(label)),
+            "score": float(score),
+        }
+        for x, y, w, h, score, label in zip(*(cols[k] for k in COLUMNS))
+    ]
+
+
+def named_columns(cols, id2label):
+    """Columns with label ids replaced by their names, the form ship results are served in (see result_format)."""
+    ids, inverse = np.unique(cols["label"], return_inverse=True)
+    names = np.array([id2label.get(int(i), str(i)) for i in ids], dtype=object)
+    return {**{k: cols[k] for k in COLUMNS if k != "label"}, "label": names[inverse.reshape(-1)]}
+
+
+def nms_records(detections, iou_threshold):
+    """Reference path: one class-agnostic NMS over a list of per-box dicts."""
+    if not detections:
+        return []
+
+    boxes = torch.tensor([[d["x"], d["y"], d["x"] + d["w"], d["y"] + d["h"]] for d in detections])
+    scores = torch.tensor([d["score"] for d in detections])
+    keep = ops.nms(boxes, scores, iou_threshold)
+    return [detections[i] for i in keep]
+
+
+def grid_nms(cols, iou_threshold, cell_size=2048, per_label=False):
+    """
+    Greedy NMS that only compares boxes which can actually overlap.
+    1. Boxes are bucketed by the grid cell holding their centre and NMS runs
+       independently per cell (and per label if per_label).
+    2. Boxes from different cells can only overlap near a cell border, so the
+       survivors that reach within the largest box extent of their cell's border
+       go through one more NMS together.
+    Returns the kept columns sorted by descending score. Only suppression chains
+    spanning a cell border can differ from one global NMS.
+    """
+    n = len(cols["score"])
+    if n == 0:
+        return empty_columns()
+
+    boxes = np.stack([cols["x"], cols["y"], cols["x"] + cols["w"], cols["y"] + cols["h"]], axis=1)
+    scores = cols["score"]
+    labels = cols["label"] if per_label else np.zeros(n, dtype=np.int64)
+
+    cx = np.maximum((boxes[:, 0] + boxes[:, 2]) / 2 // cell_size, 0).astype(np.int64)
+    cy = np.maximum((boxes[:, 1] + boxes[:, 3]) / 2 // cell_size, 0).astype(np.int64)
+    n_labels = int(labels.max()) + 1
+    cells = (cy * (int(cx.max()) + 1) + cx) * n_labels + labels
+    keep = _grouped_nms(boxes, scores, cells, iou_threshold)
+
+    margin = max(float(cols["w"].max()), float(cols["h"].max()))
+    x0, y0 = cx[keep] * cell_size, cy[keep] * cell_size
+    kb = boxes[keep]
+    near_seam = (
+        (kb[:, 0] < x0 + margin) | (kb[:, 1] < y0 + margin)
+        | (kb[:, 2] > x0 + cell_size - margin) | (kb[:, 3] > y0 + cell_size - margin)
+    )
+    seam = keep[near_seam]
+    if len(seam) > 1:
+        seam = _grouped_nms(boxes, scores, labels, iou_threshold, subset=seam)
+    keep = np.concatenate([keep[~near_seam], seam])
+
+    keep = keep[np.argsort(-scores[keep], kind="stable")]
+    return take_columns(cols, keep)
+
+
+def _grouped_nms(boxes, scores, groups, iou_threshold, subset=None):
+    """Run ops.nms separately for every group id; returns kept indices into boxes."""
+    idx = np.arange(len(scores)) if subset is None else subset
+    order = idx[np.argsort(groups[idx], kind="stable")]
+    bounds = np.flatnonzero(np.diff(groups[order])) + 1
+
+    keep = []
+    for group in np.split(order, bounds):
+        if len(group) == 1:
+            keep.append(group)
+            continue
+        k = ops.nms(torch.from_numpy(boxes[group]), torch.from_numpy(scores[group]), iou_threshold).numpy()
+        keep.append(group[k])
+    return np.concatenate(keep)
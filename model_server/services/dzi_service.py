@@ -1,5 +1,86 @@
+import math
+import os
+import shutil
+import numpy as np
 import pyvips
+from config import DZI_CONTAINER, TRIAGE_NODATA_VALUE
+from services.metrics import timed
+from services.tile_loader import as_rgb8
+from services.tile_manifest import manifest_path, write_manifest
+from services.tile_container import container_path, zip_tile_index
 
-def generate_dzi(input_path, output_prefix, tile_size=256):
-    image = pyvips.Image.new_from_file(str(input_path), access='sequential')
-    image.dzsave(str(output_prefix), tile_size=tile_size)
+# dzsave's tile format and overlap, recorded in the manifest
+DZI_SUFFIX = ".jpeg"
+DZI_OVERLAP = 1
+CONTAINERS = ("fs", "zip")
+
+
+def generate_dzi(input_path, output_prefix, tile_size=256, manifest=True, container=None):
+    """
+    Write the dzsave pyramid of input_path and, unless manifest=False, its tile manifest (see tile_manifest).
+    container: "fs" writes {prefix}.dzi and {prefix}_files; "zip" writes the single file {prefix}.zip
+    with stored entries (see tile_container). Defaults to DZI_CONTAINER. Returns the written path.
+    """
+    container = container or DZI_CONTAINER
+    if container not in CONTAINERS:
+        raise ValueError(f"Unknown DZI container: {container}. Must be one of {CONTAINERS}")
+    # a manifest of an earlier pyramid must never describe this one, nor may the other layout linger
+    manifest_path(output_prefix).unlink(missing_ok=True)
+    zip_path = container_path(output_prefix)
+    zip_path.unlink(missing_ok=True)
+    if container == "zip":
+        if os.path.exists(f"{output_prefix}.dzi"):
+            os.remove(f"{output_prefix}.dzi")
+        shutil.rmtree(f"{output_prefix}_files", ignore_errors=True)
+
+    with timed("dzsave"):
+        # random access: the manifest statistics read the same image again after dzsave
+        image = pyvips.Image.new_from_file(str(input_path), access='random' if manifest else 'sequential')
+        if container == "zip":
+            # compression=0 stores tiles uncompressed, so each one is a contiguous range of the file
+            image.dzsave(str(zip_path), tile_size=tile_size, overlap=DZI_OVERLAP, container="zip", compression=0)
+        else:
+            image.dzsave(str(output_prefix), tile_size=tile_size, overlap=DZI_OVERLAP)
+    if manifest:
+        with timed("tile_manifest"):
+            stats = tile_statistics(image, tile_size, DZI_OVERLAP)
+            tile_index = zip_tile_index(zip_path) if container == "zip" else None
+            write_manifest(output_prefix, image.width, image.height, tile_size, DZI_OVERLAP, DZI_SUFFIX, stats,
+                           tile_index=tile_index)
+    return zip_path if container == "zip" else f"{output_prefix}.dzi"
+
+
+def tile_statistics(image, tile_size, overlap):
+    """
+    Grey mean, variance and no-data fraction of every deepest-level tile, overlap border
+    included, as (rows, cols) arrays, measured on the pyvips image dzsave tiled rather
+    than by decoding the written tiles again. The image is read one row of tiles at a
+    time; grey is PIL's "L" conversion, as in tile_triage.tile_stats, so only the JPEG
+    round trip separates these from what runtime triage would measure.
+    """
+    image = as_rgb8(image)
+    width, height = image.width, image.height
+    cols, rows = math.ceil(width / tile_size), math.ceil(height / tile_size)
+    lefts = np.maximum(np.arange(cols) * tile_size - overlap, 0)
+    rights = np.minimum(np.arange(1, cols + 1) * tile_size + overlap, width)
+
+    stats = np.zeros((3, rows, cols))
+    for row in range(rows):
+        top = max(row * tile_size - overlap, 0)
+        bottom = min((row + 1) * tile_size + overlap, height)
+        rgb = np.ndarray(buffer=image.crop(0, top, width, bottom - top).write_to_memory(),
+                         dtype=np.uint8, shape=(bottom - top, width, 3)).astype(np.uint32)
+        # PIL's fixed-point ITU-R 601-2 luma
+        grey = (rgb[..., 0] * 19595 + rgb[..., 1] * 38470 + rgb[..., 2] * 7471 + 0x8000) >> 16
+        grey_f = grey.astype(np.float64)
+        # per-column sums, then each tile's overlapping window from their running total
+        columns = np.stack([grey_f.sum(axis=0), (grey_f * grey_f).sum(axis=0),
+                            (grey == TRIAGE_NODATA_VALUE).sum(axis=0)])
+        running = np.concatenate([np.zeros((3, 1)), np.cumsum(columns, axis=1)], axis=1)
+        sums = running[:, rights] - running[:, lefts]
+        area = (rights - lefts) * (bottom - top)
+        mean = sums[0] / area
+        stats[0, row] = mean
+        stats[1, row] = sums[1] / area - mean ** 2
+        stats[2, row] = sums[2] / area
+    return stats[0], stats[1], stats[2]
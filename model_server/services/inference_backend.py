@@ -0,0 +1,151 @@
+import json
+from pathlib import Path
+import numpy as np
+import torch
+from config import EXPORTED_MODEL_DIR
+from services.result_cache import model_fingerprint
+
+# eager       - the PyTorch module as loaded
+# torchscript - a graph traced by tools/export_models.py
+# compile     - torch.compile of the eager module (compiled on the first batch)
+# onnx        - a graph exported by tools/export_models.py, run by ONNX Runtime on CPU
+BACKENDS = ("eager", "torchscript", "compile", "onnx")
+_SUFFIXES = {"torchscript": ".ts", "onnx": ".onnx"}
+# largest difference from eager allowed on the check inputs before an export is refused
+CHECK_TOLERANCE = 1e-3
+
+
+def graph_path(name, backend):
+    return Path(EXPORTED_MODEL_DIR) / f"{name}{_SUFFIXES[backend]}"
+
+
+class EagerBackend:
+    """Calls a torch module; also used for torch.compile and TorchScript modules."""
+
+    def __init__(self, module, device):
+        self.module = module
+        self.device = device
+
+    def __call__(self, *inputs):
+        with torch.no_grad():
+            return self.module(*[x.to(self.device) for x in inputs])
+
+
+class OnnxBackend:
+    """Runs an exported graph with ONNX Runtime on CPU; returns torch tensors like the module would."""
+
+    def __init__(self, path):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        # follow the torch thread setting, so JOB_WORKER_THREADS also pins ONNX Runtime
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.device = torch.device("cpu")
+
+    def __call__(self, *inputs):
+        feed = {name: np.ascontiguousarray(x.cpu().numpy()) for name, x in zip(self.input_names, inputs)}
+        outputs = [torch.from_numpy(out) for out in self.session.run(None, feed)]
+        return outputs[0] if len(outputs) == 1 else tuple(outputs)
+
+
+def _current_export(name, backend, source_path):
+    """
+    Path of the exported graph; raises if it is missing, was built from other weights
+    or did not match eager on the check inputs it was exported with.
+    """
+    path = graph_path(name, backend)
+    meta_path = Path(f"{path}.json")
+    if not path.exists() or not meta_path.exists():
+        raise FileNotFoundError(f"no {backend} export for {name} ({path})")
+    meta = json.loads(meta_path.read_text())
+    if meta.get("source_fingerprint") != model_fingerprint(source_path):
+        raise FileNotFoundError(f"{path} was exported from other weights")
+    if not meta.get("verified"):
+        raise FileNotFoundError(f"{path} did not match eager on other input shapes (see {meta_path})")
+    return path
+
+
+def _load_graph(backend, path, device):
+    if backend == "torchscript":
+        return EagerBackend(torch.jit.load(str(path), map_location=device), device)
+    return OnnxBackend(path)
+
+
+def load_backend(name, backend, module, device, source_path, fallback=True):
+    """
+    Wrap `module` (eval mode, on `device`) in the requested backend. Exported backends
+    fall back to eager when the graph is missing, stale, unverified (see export_graph)
+    or its runtime is not installed, so a misconfigured host keeps serving; with
+    fallback=False those cases raise.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, use one of: {', '.join(BACKENDS)}")
+    if backend == "compile":
+        return EagerBackend(torch.compile(module), device)
+    if backend == "eager":
+        return EagerBackend(module, device)
+    try:
+        return _load_graph(backend, _current_export(name, backend, source_path), device)
+    except (FileNotFoundError, ImportError) as e:
+        if not fallback:
+            raise
+        print(f"[models] {backend} backend unavailable for {name} ({e}), using eager")
+        return EagerBackend(module, device)
+
+
+def export_graph(name, backend, module, example_inputs, source_path, input_names, output_names, dynamic_axes,
+                 check_inputs=()):
+    """
+    Export `module` (CPU, eval mode) as a TorchScript trace or an ONNX graph, next to a
+    sidecar recording the fingerprint of the weights it was built from.
+    A graph is traced on the shapes of example_inputs and may have them baked in, so
+    the exported graph is run on example_inputs and on every tuple of check_inputs
+    (other batch sizes and image shapes it will be fed) and compared with the module.
+    The sidecar records whether every output stayed within CHECK_TOLERANCE; load_backend
+    only uses verified graphs.
+    """
+    path = graph_path(name, backend)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with torch.no_grad():
+        if backend == "torchscript":
+            torch.jit.save(torch.jit.trace(module, example_inputs, strict=False), str(path))
+        elif backend == "onnx":
+            torch.onnx.export(module, example_inputs, str(path), input_names=input_names,
+                              output_names=output_names, dynamic_axes=dynamic_axes, opset_version=17)
+        else:
+            raise ValueError(f"Backend {backend!r} has nothing to export")
+    checks = check_export(backend, path, module, [example_inputs, *check_inputs])
+    verified = all(check.get("max_abs_diff", float("inf")) <= CHECK_TOLERANCE for check in checks)
+    if not verified:
+        print(f"[models] {backend} export of {name} does not match eager: {checks}")
+    Path(f"{path}.json").write_text(json.dumps({
+        "source_fingerprint": model_fingerprint(source_path),
+        "verified": verified,
+        "checks": checks,
+    }))
+    return path
+
+
+def check_export(backend, path, module, inputs_list):
+    """Largest difference from `module` of the graph at path, per tuple of inputs."""
+    cpu = torch.device("cpu")
+    graph = _load_graph(backend, path, cpu)
+    reference = EagerBackend(module, cpu)
+    checks = []
+    for inputs in inputs_list:
+        check = {"shapes": [list(x.shape) for x in inputs]}
+        try:
+            expected, outputs = _as_tuple(reference(*inputs)), _as_tuple(graph(*inputs))
+            check["max_abs_diff"] = max(float((a - b).abs().max()) if a.shape == b.shape else float("inf")
+                                        for a, b in zip(expected, outputs))
+        except Exception as e:
+            # a graph with a shape baked in raises on any other one
+            check["error"] = str(e)
+        checks.append(check)
+    return checks
+
+
+def _as_tuple(outputs):
+    return outputs if isinstance(outputs, tuple) else (outputs,)
@@ -0,0 +1,266 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import threading
+import multiprocessing as mp
+from config import (
+    JOB_DB_PATH, JOB_WORKERS, JOB_QUEUE_MAX_PENDING, JOB_MAX_ATTEMPTS, JOB_WORKER_THREADS,
+    JOB_WORKER_START_METHOD, JOB_POLL_INTERVAL, JOB_WORKER_WARMUP, JOB_SUPERVISE_INTERVAL
+)
+from services.metrics import dump as dump_metrics, pid_alive
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id       TEXT PRIMARY KEY,
+    type         TEXT NOT NULL,
+    image_id     TEXT NOT NULL,
+    callback_url TEXT NOT NULL,
+    options      TEXT NOT NULL DEFAULT '{}',
+    status       TEXT NOT NULL,
+    error        TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    worker_pid   INTEGER,
+    created_at   REAL NOT NULL,
+    started_at   REAL,
+    finished_at  REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);
+"""
+
+PENDING = ("queued", "running")
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """
+    Detection jobs persisted in a local SQLite database and executed by a pool of
+    worker processes. There is one pool per host: every API process (e.g. each uvicorn
+    worker) runs a supervisor thread, but only the one holding the lock file next to
+    the database starts workers; another takes over if that process exits. Every
+    JOB_SUPERVISE_INTERVAL seconds the pool owner restarts workers that died and
+    queues again the jobs left "running" by a worker that no longer exists (up to
+    JOB_MAX_ATTEMPTS), so a crash never leaves a job counting against the limit.
+    """
+    def __init__(self, db_path=JOB_DB_PATH, max_pending=JOB_QUEUE_MAX_PENDING):
+        self.db_path = str(db_path)
+        self.max_pending = max_pending
+        self._workers = []
+        self._stop = None
+        self._ctx = None
+        self._supervisor = None
+        self._lock_file = None
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        return conn
+
+    def submit(self, job_id, type_, image_id, callback_url, options=None):
+        """Queue a job; raises QueueFull when max_pending jobs are already queued or running."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            existing = conn.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+            if existing is not None:
+                conn.execute("COMMIT")
+                return existing["status"]
+            pending = conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)", PENDING
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                conn.execute("ROLLBACK")
+                raise QueueFull(f"{pending} detection jobs pending (limit {self.max_pending})")
+            conn.execute(
+                "INSERT INTO jobs (job_id, type, image_id, callback_url, options, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, 'queued', ?)",
+                (job_id, type_, image_id, callback_url, json.dumps(options or {}), time.time()),
+            )
+            conn.execute("COMMIT")
+            return "queued"
+        finally:
+            conn.close()
+
+    def claim(self, worker_pid):
+        """Atomically move the oldest queued job to running and return it, or None."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT job_id FROM jobs WHERE status = 'queued' ORDER BY created_at LIMIT 1"
+            ).fetchone()
+            job = None
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', worker_pid = ?, started_at = ?, attempts = attempts + 1 "
+                    "WHERE job_id = ?",
+                    (worker_pid, time.time(), row["job_id"]),
+                )
+                job = dict(conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row["job_id"],)).fetchone())
+            conn.execute("COMMIT")
+            return job
+        finally:
+            conn.close()
+
+    def finish(self, job_id, status, error=None):
+        conn = self._connect()
+        try:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE job_id = ?",
+                (status, error, time.time(), job_id),
+            )
+        finally:
+            conn.close()
+
+    def get(self, job_id):
+        conn = self._connect()
+        try:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        job = dict(row)
+        job["options"] = json.loads(job["options"])
+        return job
+
+    def stats(self):
+        conn = self._connect()
+        try:
+            counts = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+        finally:
+            conn.close()
+        return {
+            "queued": counts.get("queued", 0),
+            "running": counts.get("running", 0),
+            "completed": counts.get("completed", 0),
+            "failed": counts.get("failed", 0),
+            "max_pending": self.max_pending,
+            # 0 in API processes that do not own the worker pool
+            "workers": sum(1 for w in self._workers if w is not None and w.is_alive()),
+        }
+
+    def requeue_orphans(self):
+        """Queue again the running jobs whose worker process is gone."""
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT job_id, worker_pid, attempts FROM jobs WHERE status = 'running'").fetchall()
+            for row in rows:
+                if row["worker_pid"] and pid_alive(row["worker_pid"]):
+                    continue
+                if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE job_id = ?",
+                        (f"Worker lost {row['attempts']} times", time.time(), row["job_id"]),
+                    )
+                else:
+                    conn.execute("UPDATE jobs SET status = 'queued', worker_pid = NULL WHERE job_id = ?", (row["job_id"],))
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def start_workers(self, n_workers=JOB_WORKERS):
+        """Start the supervisor thread, which starts the worker pool once this process owns it."""
+        self._ctx = mp.get_context(JOB_WORKER_START_METHOD)
+        self._stop = self._ctx.Event()
+        self._n_workers = n_workers
+        self.supervise()
+        self._supervisor = threading.Thread(target=self._supervise_loop, name="job-supervisor", daemon=True)
+        self._supervisor.start()
+
+    def _supervise_loop(self):
+        while not self._stop.wait(JOB_SUPERVISE_INTERVAL):
+            try:
+                self.supervise()
+            except Exception as e:
+                print(f"[jobs] Supervisor check failed: {e}")
+
+    def supervise(self):
+        """Take the pool over if no other process on this host runs it, restart dead workers, requeue orphans."""
+        if self._lock_file is None and not self._acquire_pool():
+            return
+        for i, worker in enumerate(self._workers):
+            # is_alive() also reaps an exited worker, so its pid no longer counts as alive below
+            if worker is not None and worker.is_alive():
+                continue
+            if worker is not None:
+                print(f"[jobs] {worker.name} exited with code {worker.exitcode}, restarting it")
+            self._workers[i] = self._start_worker(i)
+        self.requeue_orphans()
+
+    def _acquire_pool(self):
+        lock_file = open(f"{self.db_path}.workers.lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self._workers = [None] * self._n_workers
+        print(f"[jobs] Process {os.getpid()} runs the pool of {self._n_workers} detection workers")
+        return True
+
+    def _start_worker(self, i):
+        # not daemonic, so that parallel scene mode can start shard processes from a worker
+        worker = self._ctx.Process(target=_worker_main, args=(self.db_path, self._stop), name=f"detection-worker-{i}")
+        worker.start()
+        return worker
+
+    def stop_workers(self, timeout=10):
+        if self._stop is not None:
+            self._stop.set()
+        if self._supervisor is not None:
+            self._supervisor.join(timeout)
+            self._supervisor = None
+        for worker in self._workers:
+            if worker is None:
+                continue
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def _worker_main(db_path, stop):
+    """Worker process loop: claim a job, run it, record how it ended."""
+    if JOB_WORKER_THREADS > 0:
+        import torch
+        torch.set_num_threads(JOB_WORKER_THREADS)
+    # imported here so that the models are loaded in the worker, not in the API process
+    from routes.detection_routes import _run_detection_and_callback
+    from routes.model_routes import WARMUPS
+    for name in JOB_WORKER_WARMUP:
+        WARMUPS[name]()
+
+    queue = JobQueue(db_path)
+    pid = os.getpid()
+    parent = os.getppid()
+    # a worker whose API process died without stopping it exits, so the next pool owner starts from scratch
+    while not stop.is_set() and os.getppid() == parent:
+        job = queue.claim(pid)
+        if job is None:
+            stop.wait(JOB_POLL_INTERVAL)
+            continue
+        options = json.loads(job["options"])
+        try:
+            error = _run_detection_and_callback(
+                job["type"], job["image_id"], job["job_id"], job["callback_url"], **options
+            )
+        except Exception as e:
+            error = str(e)
+        queue.finish(job["job_id"], "failed" if error else "completed", error)
+        dump_metrics()
+
+
+job_queue = JobQueue()
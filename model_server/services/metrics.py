@@ -0,0 +1,192 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from pathlib import Path
+from config import METRICS_ENABLED, METRICS_DIR
+
+# Histogram bucket upper bounds in seconds, from one tile decode up to a whole scene
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 900.0)
+
+# stage -> {"buckets": [count per bucket, last = +Inf], "sum": seconds, "count": calls, "items": items}
+_histograms = {}
+_lock = threading.Lock()
+# per-job breakdown of the detection running in this context (see job_timings)
+_current = contextvars.ContextVar("stage_timings", default=None)
+
+
+def _empty():
+    return {"buckets": [0] * (len(BUCKETS) + 1), "sum": 0.0, "count": 0, "items": 0}
+
+
+def _merge_histogram(into, other):
+    into["buckets"] = [a + b for a, b in zip(into["buckets"], other["buckets"])]
+    into["sum"] += other["sum"]
+    into["count"] += other["count"]
+    into["items"] += other["items"]
+
+
+class StageTimings:
+    """Per-job breakdown: total seconds, calls and items per stage, filled from any thread."""
+    def __init__(self):
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds, calls=1, items=0):
+        with self._lock:
+            entry = self._stages.setdefault(stage, {"seconds": 0.0, "calls": 0, "items": 0})
+            entry["seconds"] += seconds
+            entry["calls"] += calls
+            entry["items"] += items
+
+    def merge(self, breakdown):
+        """Add a breakdown from as_dict(), e.g. one returned by a scene worker process."""
+        for stage, entry in breakdown.items():
+            self.add(stage, entry["seconds"], entry["calls"], entry["items"])
+
+    def as_dict(self):
+        with self._lock:
+            return {stage: {**entry, "seconds": round(entry["seconds"], 4)} for stage, entry in sorted(self._stages.items())}
+
+
+def observe(stage, seconds, items=0):
+    """Record one run of a stage in the process histograms and the current job's breakdown."""
+    if not METRICS_ENABLED:
+        return
+    index = bisect_left(BUCKETS, seconds)
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = _empty()
+        histogram["buckets"][index] += 1
+        histogram["sum"] += seconds
+        histogram["count"] += 1
+        histogram["items"] += items
+    timings = _current.get()
+    if timings is not None:
+        timings.add(stage, seconds, 1, items)
+
+
+@contextmanager
+def timed(stage, items=0):
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, items)
+
+
+@contextmanager
+def job_timings():
+    """Collect a per-stage breakdown of everything timed in this context, including loader threads."""
+    timings = StageTimings()
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+
+
+def merge_job_timings(breakdown):
+    timings = _current.get()
+    if timings is not None:
+        timings.merge(breakdown)
+
+
+def submit(pool, fn, *args):
+    """pool.submit that runs fn in a copy of the caller's context, so its stages count towards the same job."""
+    return pool.submit(contextvars.copy_context().run, fn, *args)
+
+
+def snapshot():
+    with _lock:
+        return {stage: {**h, "buckets": list(h["buckets"])} for stage, h in _histograms.items()}
+
+
+def dump():
+    """
+    Write this process' histograms to METRICS_DIR/{pid}.json. Every process that times
+    stages calls this after each task (job and scene workers, and API processes after a
+    detection or a scrape), so whichever API process answers /metrics serves them all.
+    """
+    if not METRICS_ENABLED:
+        return
+    path = Path(METRICS_DIR) / f"{os.getpid()}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(snapshot()))
+    os.replace(tmp, path)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """
+    Histograms of this process merged with the latest snapshots of every other live
+    process. Snapshots of processes that have exited are removed here rather than at
+    startup, so an API process starting next to others never wipes their numbers.
+    """
+    dump()
+    merged = snapshot()
+    own = f"{os.getpid()}.json"
+    for path in Path(METRICS_DIR).glob("*.json"):
+        if path.name == own:
+            continue
+        if path.stem.isdigit() and not pid_alive(int(path.stem)):
+            path.unlink(missing_ok=True)
+            continue
+        try:
+            other = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        for stage, histogram in other.items():
+            _merge_histogram(merged.setdefault(stage, _empty()), histogram)
+    return merged
+
+
+def _fmt(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(histograms, gauges=None):
+    """
+    Prometheus text exposition of the stage histograms, plus optional gauges given as
+    {name: (help, {label_value: value}, label_name)}.
+    """
+    lines = [
+        "# HELP sar_stage_duration_seconds Time spent per pipeline stage.",
+        "# TYPE sar_stage_duration_seconds histogram",
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), histogram["buckets"]):
+            cumulative += count
+            le = bound if bound == "+Inf" else _fmt(bound)
+            lines.append(f'sar_stage_duration_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+        lines.append(f'sar_stage_duration_seconds_sum{{stage="{stage}"}} {_fmt(histogram["sum"])}')
+        lines.append(f'sar_stage_duration_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+    lines += [
+        "# HELP sar_stage_items_total Items (tiles, detections, bytes) processed per stage.",
+        "# TYPE sar_stage_items_total counter",
+    ]
+    for stage, histogram in sorted(histograms.items()):
+        lines.append(f'sar_stage_items_total{{stage="{stage}"}} {histogram["items"]}')
+    for name, (help_text, values, label) in (gauges or {}).items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for label_value, value in values.items():
+            lines.append(f'{name}{{{label}="{label_value}"}} {_fmt(value)}')
+    return "\n".join(lines) + "\n"
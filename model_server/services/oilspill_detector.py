@@ -1,87 +1,363 @@
 import os
+import time
 from pathlib import Path
 import shutil
+import numpy as np
 from PIL import Image
 import torch
-from services.oilspill_util import VisionTransformer, get_r50_b16_config, ResizeToTensor, predict_single_image  # import your classes
-from services.stitch import stitch_predicted_folder
-from config import OILSPILL_MODEL_PATH, OUTPUTS_DIR, TILES_DIR
-from services.dzi_service import generate_dzi
+from services.oilspill_util import VisionTransformer, get_r50_b16_config, ResizeToTensor, predict_tensors  # import your classes
+from services.stitch import MaskCanvas
+from config import (
+    OILSPILL_MODEL_PATH, OUTPUTS_DIR, TILES_DIR, OILSPILL_BATCH_SIZE, OILSPILL_SAVE_TILE_MASKS, MODEL_SHARE_MODE,
+    OILSPILL_FAST_INFERENCE, INFERENCE_PRECISION, OILSPILL_BACKEND, OILSPILL_RESUMABLE, OILSPILL_COARSE_TO_FINE,
+    OILSPILL_COARSE_LEVELS, OILSPILL_COARSE_MARGIN, OILSPILL_STITCHED_PNG
+)
+from services.pyramid_writer import write_canvas_pyramid
+from services.tile_loader import open_level, iter_tile_batches, with_tiles
+from services.tile_triage import select_tiles, prefilter_tiles, TriageStats, triage_params
+from services.checkpoint import SceneCheckpoint, TileLog
+from services.result_cache import cache_key, model_fingerprint, source_fingerprint
+from services.quantization import model_name, load_int8
+from services.inference_backend import load_backend
+from services.scene_parallel import should_shard, run_sharded
+from services.coarse_to_fine import coarse_level_source, touched_tiles, upsample_canvas, mask_edges
+from services.metrics import timed, job_timings, merge_job_timings, dump as dump_metrics
+from models.model_loader import register, get_model, build_from_mmap
 TILE_SIZE = 256
 OVERLAP = 1
 
-# Set up model (load once)
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-# instantiate config, model
-config = get_r50_b16_config()
-model = VisionTransformer(config, img_size=(224, 224),  # or whatever your actual input size is
-                          num_classes=config.n_classes).to(device)
 
-# load weights
-model.load_state_dict(torch.load(str(OILSPILL_MODEL_PATH), map_location=device, weights_only=False))
-model.eval()
+
+def _load_fp32_network():
+    # instantiate config, model
+    config = get_r50_b16_config()
+
+    def build():
+        return VisionTransformer(config, img_size=(224, 224),  # or whatever your actual input size is
+                                 num_classes=config.n_classes)
+
+    model = None
+    if MODEL_SHARE_MODE == "mmap" and device.type == "cpu":
+        model = build_from_mmap(build, OILSPILL_MODEL_PATH)
+    mapped = model is not None
+    if model is None:
+        model = build().to(device)
+        # load weights
+        model.load_state_dict(torch.load(str(OILSPILL_MODEL_PATH), map_location=device, weights_only=False))
+    model.eval()
+    if OILSPILL_FAST_INFERENCE:
+        # standardised conv weights would be ~45 MiB of private memory per worker next to the shared mmap
+        model.prepare_for_inference(freeze_weights=not mapped)
+    return model
+
+
+def _load_oilspill_model():
+    model = _load_fp32_network()
+    run = load_backend("oilspill", OILSPILL_BACKEND, model, device, OILSPILL_MODEL_PATH)
+    return {"model": model, "run": run}
+
+
+def _load_oilspill_model_int8():
+    # the quantised modules only run eagerly
+    model = load_int8("oilspill", lambda: _load_fp32_network().cpu(), OILSPILL_MODEL_PATH)
+    return {"model": model, "run": load_backend("oilspill", "eager", model, torch.device("cpu"), OILSPILL_MODEL_PATH)}
+
+
+# Loaded lazily on first use
+register("oilspill", _load_oilspill_model)
+register("oilspill:int8", _load_oilspill_model_int8)
 
 # transform
 transform = ResizeToTensor(size=(224,224))
 
-def detect_oilspill(tile_folder: str, zoom_level: str = "15", image_id: str = None) -> str:
+
+def warmup(precision: str = None):
+    """Load the oil-spill model and run one forward pass on a blank tile."""
+    oilspill = get_model(model_name("oilspill", precision or INFERENCE_PRECISION))
+    tile = Image.new("RGB", (TILE_SIZE + 2 * OVERLAP, TILE_SIZE + 2 * OVERLAP))
+    predict_tensors([transform(tile)], [tile.size], oilspill["run"], oilspill["run"].device)
+
+
+def coarse_settings(**overrides):
+    """Coarse-to-fine settings from config, with some replaced."""
+    settings = {"levels": OILSPILL_COARSE_LEVELS, "margin": OILSPILL_COARSE_MARGIN}
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown coarse-to-fine settings: {', '.join(sorted(unknown))}")
+    settings.update(overrides)
+    return settings
+
+
+def detect_oilspill(tile_folder: str, zoom_level: str = "15", image_id: str = None,
+                    batch_size: int = None, save_tile_masks: bool = None, source=None,
+                    report: dict = None, precision: str = None, workers: int = None,
+                    resumable: bool = None, coarse=None, stitched_png: bool = None) -> dict:
     """
     tile_folder: path to dzi folder (e.g. .../image_id_files)
     zoom_level: subfolder name (e.g. "15")
     image_id: used to name output path under OUTPUTS_DIR
-    Returns: filepath to stitched mask image
+    batch_size: tiles per forward pass (defaults to OILSPILL_BATCH_SIZE)
+    save_tile_masks: also write per-tile PNG masks to pred_tiles (debug output)
+    source: tile source to read instead of the DZI level (e.g. a TiffTileSource)
+    report: optional dict; report["triage"] receives the tile triage skip counts
+            (skipped tiles get an empty mask)
+    precision: "fp32" or "int8" (defaults to INFERENCE_PRECISION)
+    workers: shard the scene across this many processes (defaults to SCENE_WORKERS);
+             each writes its tiles straight into the shared canvas file
+    resumable: checkpoint progress and continue an interrupted or repeated run of the
+               same scene, model and settings (defaults to OILSPILL_RESUMABLE);
+               report["resumed"] then tells what was already done
+    coarse: coarse-to-fine settings (see coarse_settings), or False to segment every tile;
+            defaults to coarse_settings() when OILSPILL_COARSE_TO_FINE is set. A lower
+            pyramid level is segmented and upsampled first, and only tiles near its spill
+            boundaries are segmented again; report["coarse"] receives the tile counts
+    stitched_png: also save the full-size mask as one PNG (defaults to OILSPILL_STITCHED_PNG);
+                  the mask pyramid is written straight from the segmentation canvas either way
+    Returns: {"stitched_mask": PNG path or None, "dzi_path": pyramid prefix, "dzi_folder": its tiles}
     """
-    zoom_path = Path(tile_folder) / zoom_level
-    if not zoom_path.exists():
-        raise FileNotFoundError(f"Zoom-level folder not found: {zoom_path}")
+    source = source or open_level(tile_folder, zoom_level, TILE_SIZE, OVERLAP)
+    if not source.tiles:
+        raise FileNotFoundError(f"No tile images found for {tile_folder} level {zoom_level}")
+    batch_size = batch_size or OILSPILL_BATCH_SIZE
+    precision = precision or INFERENCE_PRECISION
+    if save_tile_masks is None:
+        save_tile_masks = OILSPILL_SAVE_TILE_MASKS
+    if resumable is None:
+        resumable = OILSPILL_RESUMABLE
+    if coarse is None:
+        coarse = coarse_settings() if OILSPILL_COARSE_TO_FINE else False
+    if stitched_png is None:
+        stitched_png = OILSPILL_STITCHED_PNG
 
-    # Make directory to store per-tile predictions
-    # e.g. OUTPUTS_DIR / "oilspill" / image_id / "pred_tiles" / zoom_level
     if image_id is None:
         image_id = os.path.basename(tile_folder.rstrip('/\\'))
-    pred_tiles_dir = Path(OUTPUTS_DIR) / "oilspill" / image_id / "pred_tiles" / zoom_level
-    # Clean existing prediction tiles directory
-    if pred_tiles_dir.exists():
-        shutil.rmtree(pred_tiles_dir)
-    pred_tiles_dir.mkdir(parents=True, exist_ok=True)
-
-    valid_exts = (".jpeg", ".jpg", ".png", ".tiff", ".tif", ".bmp")
-    for tile_name in os.listdir(zoom_path):
-        if not tile_name.lower().endswith(valid_exts):
-            continue
-        tile_path = zoom_path / tile_name
-        # name without extension
-        name, _ = os.path.splitext(tile_name)
-        out_mask = pred_tiles_dir / f"{name}_mask.png"
-        # call your predict_single_image logic
-        predict_single_image(str(tile_path), str(out_mask), model, transform, device)
-
-    # Now stitch predicted tiles
-    # Optionally find xml for cropping
-    xml_path = None
-    # if there's a vips-properties.xml in parent folder
-    parent = Path(tile_folder)
-    xml_candidate = parent / "vips-properties.xml"
-    if xml_candidate.exists():
-        xml_path = str(xml_candidate)
 
     stitched_dir = Path(OUTPUTS_DIR) / "oilspill" / image_id
     stitched_dir.mkdir(parents=True, exist_ok=True)
     stitched_path = stitched_dir / f"{image_id}_oilspill_mask.png"
+    dzi_output_dir = Path(OUTPUTS_DIR) / "oilspill" / image_id
+    result = {
+        "stitched_mask": str(stitched_path) if stitched_png else None,
+        "dzi_path": str(dzi_output_dir),
+        "dzi_folder": str(dzi_output_dir / f"{Path(dzi_output_dir).stem}_files")
+    }
 
-    stitch_predicted_folder(str(pred_tiles_dir), str(stitched_path), xml_path=xml_path)
+    # A resumable run logs finished tiles and completed stages next to its outputs;
+    # the log only counts if model, settings and scene are unchanged
+    checkpoint = SceneCheckpoint(stitched_path, _run_tag(source, precision, coarse, save_tile_masks)) if resumable else None
+    if checkpoint is not None and checkpoint.resumed:
+        print(f"[resume] {image_id}: stage {checkpoint.stage}, {len(checkpoint.done)} tiles done")
+        if report is not None:
+            report["resumed"] = {"stage": checkpoint.stage, "tiles_done": len(checkpoint.done)}
+    if (checkpoint is not None and checkpoint.reached("dzi") and os.path.exists(f"{dzi_output_dir}.dzi")
+            and (not stitched_png or stitched_path.exists())):
+        return result
+
+    triage, coarse_report = _segment_scene(source, tile_folder, stitched_path, dzi_output_dir, zoom_level, image_id,
+                                           batch_size, precision, save_tile_masks, workers, checkpoint, coarse,
+                                           stitched_png)
+    if report is not None:
+        report["triage"] = triage.as_dict()
+        if coarse_report is not None:
+            report["coarse"] = coarse_report
+    return result
 
-    dzi_output_dir = Path(OUTPUTS_DIR) / "oilspill" / image_id
-    dzi_output_dir.mkdir(parents=True, exist_ok=True)
 
-    generate_dzi(
-        input_path=str(stitched_path),
-        output_prefix=str(dzi_output_dir),
-        tile_size=256
+def _run_tag(source, precision, coarse=False, save_tile_masks=False):
+    """
+    Identifies everything that decides the mask (model and its settings, tiling, triage and
+    the scene) and the per-tile debug output, which a run only writes for tiles it segments.
+    """
+    return cache_key(
+        model=model_fingerprint(OILSPILL_MODEL_PATH), precision=precision, backend=OILSPILL_BACKEND,
+        fast_inference=OILSPILL_FAST_INFERENCE, tile_size=TILE_SIZE, overlap=OVERLAP, triage=triage_params(),
+        scene=source_fingerprint(source), size=source.size, tiles=len(source.tiles), coarse=coarse,
+        tile_masks=bool(save_tile_masks),
     )
 
-    return {
-        "stitched_mask": str(stitched_path),
-        "dzi_path": str(dzi_output_dir),
-        "dzi_folder": str(dzi_output_dir / f"{Path(dzi_output_dir).stem}_files")
-    }
+
+def _segment_scene(source, tile_folder, stitched_path, dzi_output_dir, zoom_level, image_id, batch_size, precision,
+                   save_tile_masks, workers, checkpoint, coarse=False, stitched_png=True):
+    """
+    Segment every tile not yet logged by the checkpoint into the canvas, then write the
+    mask pyramid from the canvas (and the stitched PNG if asked for).
+    With coarse settings, the coarse pass fills the canvas first and only tiles near its
+    spill boundaries are segmented at full resolution.
+    Returns (triage stats of the full-resolution tiles, coarse-to-fine report or None).
+    """
+    canvas_path = f"{stitched_path}.canvas.raw"
+    coarse_path = f"{stitched_path}.coarse.raw"
+    # the full scene size, before the source is narrowed to the remaining tiles
+    size = source.size
+    coarse_source, scale, coarse_report = None, 1, None
+    if coarse:
+        deep_level = getattr(source, "zoom_level", zoom_level)
+        coarse_source, scale = coarse_level_source(tile_folder, deep_level, coarse["levels"], TILE_SIZE, OVERLAP)
+        coarse_report = {"level": int(deep_level) - coarse["levels"], "tiles_total": len(source.tiles)}
+        if coarse_source is None:
+            print(f"Coarse-to-fine: level {coarse_report['level']} not found under {tile_folder}, "
+                  f"segmenting every tile")
+            coarse_report["skipped"] = True
+
+    # logged tiles are only worth something together with the canvas holding their masks,
+    # and in a coarse-to-fine run with the upsampled coarse mask they were refined from
+    if coarse_source is not None:
+        resume = (checkpoint is not None and checkpoint.reached("coarse") and os.path.exists(canvas_path)
+                  and os.path.exists(coarse_path))
+    else:
+        resume = (checkpoint is not None and (checkpoint.reached("tiles") or bool(checkpoint.done))
+                  and os.path.exists(canvas_path))
+    if checkpoint is not None and checkpoint.resumed and not resume:
+        checkpoint.reset()
+    png_done = checkpoint is not None and checkpoint.reached("stitched") and stitched_path.exists()
+
+    # Per-tile PNGs are only a debug output; masks are written straight into the stitched canvas
+    # e.g. OUTPUTS_DIR / "oilspill" / image_id / "pred_tiles" / zoom_level
+    pred_tiles_dir = Path(OUTPUTS_DIR) / "oilspill" / image_id / "pred_tiles" / zoom_level
+    tile_masks_dir = pred_tiles_dir if save_tile_masks else None
+    if save_tile_masks:
+        if pred_tiles_dir.exists() and not resume:
+            shutil.rmtree(pred_tiles_dir)
+        pred_tiles_dir.mkdir(parents=True, exist_ok=True)
+
+    triage = TriageStats()
+    log = checkpoint.log if checkpoint is not None else None
+    # Masks go straight into a memory-mapped canvas, so nothing scene-sized is kept on the heap
+    canvas = MaskCanvas(canvas_path, *size, mode="r+" if resume else "w")
+    saved = False
+    try:
+        if coarse_source is not None:
+            source = _coarse_pass(canvas, coarse_source, coarse_path, scale, source, coarse["margin"], batch_size,
+                                  precision, workers, resume, checkpoint)
+            coarse_report.update(tiles_coarse=len(coarse_source.tiles), tiles_refined=len(source.tiles))
+        if resume:
+            source = with_tiles(source, [tile for tile in source.tiles if (tile[0], tile[1]) not in checkpoint.done])
+        _segment(canvas, source, batch_size, precision, triage, workers, tile_masks_dir, log)
+        if checkpoint is not None:
+            checkpoint.complete("tiles")
+
+        if stitched_png and not png_done:
+            with timed("stitch_save"):
+                canvas.save(str(stitched_path))
+            print(f"[done] Stitched image saved to: {stitched_path}")
+        if checkpoint is not None:
+            checkpoint.complete("stitched")
+
+        # one pass over the canvas writes every level; no giant image is encoded and decoded again
+        with timed("mask_pyramid"):
+            n_tiles = write_canvas_pyramid(canvas, dzi_output_dir, tile_size=TILE_SIZE)
+        print(f"[done] Mask pyramid with {n_tiles} tiles saved to: {dzi_output_dir}.dzi")
+        if checkpoint is not None:
+            checkpoint.complete("dzi")
+        saved = True
+    finally:
+        # a resumable run keeps its canvas until the mask pyramid is written
+        canvas.close(remove=saved or checkpoint is None)
+    if log is not None:
+        log.remove()
+    if saved and os.path.exists(coarse_path):
+        os.remove(coarse_path)
+    return triage, coarse_report
+
+
+def _coarse_pass(canvas, coarse_source, coarse_path, scale, source, margin, batch_size, precision, workers, resume,
+                 checkpoint):
+    """
+    Segment the coarse level and upsample its mask into canvas (a resumed run already
+    has), then return source narrowed to the tiles within margin px of a spill boundary.
+    The coarse mask is kept on disk until the scene is saved, so a resumed run can find
+    the same tiles again.
+    """
+    coarse_canvas = MaskCanvas(coarse_path, *coarse_source.size, mode="r+" if resume else "w")
+    try:
+        if not resume:
+            _segment(coarse_canvas, coarse_source, batch_size, precision, TriageStats(), workers)
+            with timed("coarse_upsample"):
+                upsample_canvas(coarse_canvas, canvas, scale)
+            if checkpoint is not None:
+                canvas.flush()
+                coarse_canvas.flush()
+                checkpoint.complete("coarse")
+        with timed("coarse_edges"):
+            boxes = mask_edges(coarse_canvas.array)
+    finally:
+        coarse_canvas.close(remove=checkpoint is None)
+    tiles = touched_tiles(source.tiles, [np.asarray(b) * scale for b in boxes], TILE_SIZE, margin)
+    return with_tiles(source, tiles)
+
+
+def _segment(canvas, source, batch_size, precision, triage, workers, tile_masks_dir=None, log=None):
+    """Segment source into canvas, sharded across the scene workers when it is large enough."""
+    if should_shard(source, workers):
+        canvas.flush()
+        for shard_triage, timings in run_sharded(_segment_shard, source, canvas.path, (canvas.width, canvas.height),
+                                                 batch_size, precision, tile_masks_dir, log and log.path,
+                                                 workers=workers):
+            triage.merge(shard_triage)
+            merge_job_timings(timings)
+    else:
+        segment_into(canvas, source, batch_size, precision, triage, tile_masks_dir, log)
+
+
+def _segment_shard(source, canvas_path, size, batch_size, precision, tile_masks_dir, log_path=None):
+    """Runs in a scene worker process: segment one shard into the shared canvas file."""
+    triage = TriageStats()
+    canvas = MaskCanvas(canvas_path, *size, mode="r+")
+    try:
+        with job_timings() as timings:
+            segment_into(canvas, source, batch_size, precision, triage, tile_masks_dir,
+                         TileLog(log_path) if log_path else None)
+        canvas.flush()
+    finally:
+        canvas.close()
+    dump_metrics()
+    return triage, timings.as_dict()
+
+
+def segment_into(canvas, source, batch_size, precision, triage, tile_masks_dir=None, log=None):
+    """
+    Segment every tile of source into canvas. Skipped tiles keep what the canvas holds
+    (an empty mask, or the upsampled coarse one); tile_masks_dir, if given, also receives per-tile PNG masks, and
+    log (a checkpoint TileLog), if given, records every finished tile.
+    """
+    oilspill = get_model(model_name("oilspill", precision))
+
+    def load_tile(tile):
+        image = source.load(tile)
+        with timed("oilspill_preprocess", items=1):
+            return image, transform(image)
+
+    # tiles the manifest already marks as skipped are never decoded, but count as finished
+    tiles = prefilter_tiles(source, triage)
+    if log is not None and len(tiles) < len(source.tiles):
+        kept = {(col, row) for col, row, _ in tiles}
+        log.record(canvas, [tile for tile in source.tiles if (tile[0], tile[1]) not in kept])
+    for batch, loaded in iter_tile_batches(tiles, batch_size, load_fn=load_tile):
+        with timed("triage", items=len(batch)):
+            keep = select_tiles([image for image, _ in loaded])
+        triage.record_batch(keep)
+        finished = batch
+        batch = [tile for tile, k in zip(batch, keep) if k]
+        loaded = [item for item, k in zip(loaded, keep) if k]
+        if not batch:
+            if log is not None:
+                log.record(canvas, finished)
+            continue
+
+        sizes = [image.size for image, _ in loaded]
+        tensors = [tensor for _, tensor in loaded]
+        start = time.perf_counter()
+        with timed("oilspill_forward", items=len(batch)):
+            masks = predict_tensors(tensors, sizes, oilspill["run"], oilspill["run"].device)
+        triage.record_model(time.perf_counter() - start, len(batch))
+        with timed("stitch_put", items=len(batch)):
+            for (col, row, _), mask in zip(batch, masks):
+                canvas.put(col, row, mask, TILE_SIZE, OVERLAP)
+        if tile_masks_dir is not None:
+            for (col, row, _), mask in zip(batch, masks):
+                Image.fromarray(mask).save(Path(tile_masks_dir) / f"{col}_{row}_mask.png")
+        if log is not None:
+            log.record(canvas, finished)
+    if log is not None:
+        log.commit(canvas)
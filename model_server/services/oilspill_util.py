@@ -12,10 +12,27 @@ import copy
 import math
 # ---------- model code (unchanged) ----------
 class StdConv2d(nn.Conv2d):
-    def forward(self, x):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # standardised weight cached by freeze(); only used in eval mode. A non-persistent
+        # buffer, so .to()/.cpu() move it with the weight but checkpoints never contain it
+        self.register_buffer("_frozen_weight", None, persistent=False)
+
+    def standardized_weight(self):
         w = self.weight
         v, m = torch.var_mean(w, dim=[1, 2, 3], keepdim=True, unbiased=False)
-        w = (w - m) / torch.sqrt(v + 1e-5)
+        return (w - m) / torch.sqrt(v + 1e-5)
+
+    def freeze(self):
+        """Standardise the weight once; call after the weights are loaded."""
+        with torch.no_grad():
+            self._frozen_weight = self.standardized_weight()
+
+    def forward(self, x):
+        if self._frozen_weight is not None and not self.training:
+            w = self._frozen_weight
+        else:
+            w = self.standardized_weight()
         return F.conv2d(x, w, self.bias, self.stride, self.padding, self.dilation, self.groups)
 
 def conv3x3(cin, cout, stride=1, groups=1, bias=False):
@@ -100,6 +117,7 @@ class ResNetV2(nn.Module):
             ('gn', nn.GroupNorm(32, width, eps=1e-6)),
             ('relu', nn.ReLU(inplace=True)),
         ]))
+        self.pool = nn.MaxPool2d(kernel_size=3, stride=2, padding=0)
 
         self.body = nn.Sequential(OrderedDict([
             ('block1', nn.Sequential(OrderedDict(
@@ -121,7 +139,7 @@ class ResNetV2(nn.Module):
         b, c, in_size, _ = x.size()
         x = self.root(x)
         features.append(x)
-        x = nn.MaxPool2d(kernel_size=3, stride=2, padding=0)(x)
+        x = self.pool(x)
         for i in range(len(self.body)-1):
             x = self.body[i](x)
             right_size = int(in_size / 4 / (i+1))
@@ -162,6 +180,8 @@ class Attention(nn.Module):
         self.proj_dropout = Dropout(config.transformer["attention_dropout_rate"])
 
         self.softmax = Softmax(dim=-1)
+        # set by VisionTransformer.prepare_for_inference(): use the fused attention kernel
+        self.fused = False
 
     def transpose_for_scores(self, x):
         new_x_shape = x.size()[:-1] + (self.num_attention_heads, self.attention_head_size)
@@ -177,13 +197,17 @@ class Attention(nn.Module):
         key_layer = self.transpose_for_scores(mixed_key_layer)
         value_layer = self.transpose_for_scores(mixed_value_layer)
 
-        attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
-        attention_scores = attention_scores / math.sqrt(self.attention_head_size)
-        attention_probs = self.softmax(attention_scores)
-        weights = attention_probs if self.vis else None
-        attention_probs = self.attn_dropout(attention_probs)
+        if self.fused and not self.vis and not self.training:
+            context_layer = F.scaled_dot_product_attention(query_layer, key_layer, value_layer)
+            weights = None
+        else:
+            attention_scores = torch.matmul(query_layer, key_layer.transpose(-1, -2))
+            attention_scores = attention_scores / math.sqrt(self.attention_head_size)
+            attention_probs = self.softmax(attention_scores)
+            weights = attention_probs if self.vis else None
+            attention_probs = self.attn_dropout(attention_probs)
 
-        context_layer = torch.matmul(attention_probs, value_layer)
+            context_layer = torch.matmul(attention_probs, value_layer)
         context_layer = context_layer.permute(0, 2, 1, 3).contiguous()
         new_context_layer_shape = context_layer.size()[:-2] + (self.all_head_size,)
         context_layer = context_layer.view(*new_context_layer_shape)
@@ -423,6 +447,23 @@ class VisionTransformer(nn.Module):
         logits = self.segmentation_head(x)
         return logits
 
+    def prepare_for_inference(self, freeze_weights=True):
+        """
+        Switch to eval mode and freeze per-call costs that never change at inference:
+        StdConv2d weights are standardised once and attention uses the fused
+        scaled-dot-product kernel. Call after loading weights; the cached weights follow later .to()/.cpu() moves.
+        freeze_weights=False keeps standardising on the fly: the cached weights are a
+        private copy, which memory-mapped weights shared between processes must avoid.
+        """
+        self.eval()
+        for module in self.modules():
+            if isinstance(module, StdConv2d):
+                if freeze_weights:
+                    module.freeze()
+            elif isinstance(module, Attention):
+                module.fused = hasattr(F, "scaled_dot_product_attention")
+        return self
+
     def load_from(self, weights):
         with torch.no_grad():
             res_weight = weights
@@ -512,21 +553,25 @@ class ResizeToTensor:
     def __call__(self, image):
         return self.transform(image)
 
-def predict_single_image(image_path, output_path, model, transform, device):
-    model.eval()
+def predict_tensors(tensors, sizes, model, device):
+    """
+    Segment already-transformed image tensors in one forward pass.
+    sizes: original (w, h) of each image; masks are resized back to it.
+    model: a torch module or any callable taking and returning tensors
+    (see services.inference_backend).
+    """
+    if isinstance(model, torch.nn.Module):
+        model.eval()
     with torch.no_grad():
-        image = Image.open(image_path).convert('RGB')
-        input_tensor = transform(image).unsqueeze(0).to(device)
-
-        output = model(input_tensor)                # (B, n_classes, H, W) where H/W are transformed size
-        # If model outputs logits with shape (B, C, H, W), softmax along channel dim 1
-        if output.dim() == 4:
-            probs = F.softmax(output, dim=1)
-            preds = torch.argmax(probs, dim=1).squeeze(0).cpu().numpy()
-        else:
-            # fallback if output shape is different
-            preds = output.squeeze(0).argmax(dim=0).cpu().numpy()
-
-        pred_mask = Image.fromarray((preds * 255).astype(np.uint8))
-        pred_mask.save(output_path)
-        print(f"Saved predicted mask to: {output_path}")
+        input_tensor = torch.stack(tensors).to(device)
+
+        output = model(input_tensor)
+        preds = output.argmax(dim=1).cpu().numpy()
+
+    masks = []
+    for size, pred in zip(sizes, preds):
+        mask = Image.fromarray((pred * 255).astype(np.uint8))
+        if mask.size != size:
+            mask = mask.resize(size, Image.NEAREST)
+        masks.append(np.asarray(mask))
+    return masks
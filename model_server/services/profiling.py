@@ -0,0 +1,81 @@
+import cProfile
+import io
+import pstats
+import re
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from config import PROFILES_DIR, PROFILE_DEFAULT_MODE, PROFILE_TOP_N
+
+# cprofile - Python call profile of the thread running the detection (pstats + text summary)
+# torch    - torch profiler: operator table and a Chrome trace (chrome://tracing, Perfetto)
+# both     - both of the above
+PROFILE_MODES = ("cprofile", "torch", "both")
+
+
+def profile_mode(value):
+    """
+    Normalise a request's profile flag: falsy values turn profiling off, "1"/"true"
+    select PROFILE_DEFAULT_MODE, anything else must be one of PROFILE_MODES.
+    """
+    if value in (None, False, "", "0", "false", "False"):
+        return None
+    if value in (True, "1", "true", "True"):
+        return PROFILE_DEFAULT_MODE
+    if value not in PROFILE_MODES:
+        raise ValueError(f"Invalid profile mode {value!r}. Use one of: {', '.join(PROFILE_MODES)}.")
+    return value
+
+
+def profile_dir(job_id):
+    return Path(PROFILES_DIR) / re.sub(r"[^A-Za-z0-9._-]", "_", str(job_id))
+
+
+def profiled(job_id, mode):
+    """
+    Context manager profiling the enclosed block when mode is set; yields a dict that
+    holds the artefact directory and files once the block is done, or None (and costs
+    nothing) when profiling is off.
+    """
+    if not mode:
+        return nullcontext(None)
+    return _capture(job_id, mode)
+
+
+@contextmanager
+def _capture(job_id, mode):
+    out_dir = profile_dir(job_id)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    artefacts = {"mode": mode, "dir": str(out_dir), "files": []}
+
+    torch_profile = None
+    if mode in ("torch", "both"):
+        import torch
+        from torch.profiler import profile, ProfilerActivity
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        torch_profile = profile(activities=activities, record_shapes=True)
+    python_profile = cProfile.Profile() if mode in ("cprofile", "both") else None
+
+    if torch_profile is not None:
+        torch_profile.__enter__()
+    if python_profile is not None:
+        python_profile.enable()
+    try:
+        yield artefacts
+    finally:
+        if python_profile is not None:
+            python_profile.disable()
+            python_profile.dump_stats(str(out_dir / "cprofile.pstats"))
+            summary = io.StringIO()
+            pstats.Stats(python_profile, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+            (out_dir / "cprofile.txt").write_text(summary.getvalue())
+            artefacts["files"] += ["cprofile.pstats", "cprofile.txt"]
+        if torch_profile is not None:
+            torch_profile.__exit__(None, None, None)
+            torch_profile.export_chrome_trace(str(out_dir / "torch_trace.json"))
+            table = torch_profile.key_averages().table(sort_by="self_cpu_time_total", row_limit=PROFILE_TOP_N)
+            (out_dir / "torch_ops.txt").write_text(table)
+            artefacts["files"] += ["torch_trace.json", "torch_ops.txt"]
+        print(f"[profile] {mode} profile of {job_id} saved to {out_dir}")
@@ -0,0 +1,132 @@
+import io
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+from PIL import Image
+from config import TILE_LOADER_WORKERS
+
+# zlib level for mask tiles: masks are mostly flat, so fast compression already shrinks them well
+PNG_COMPRESS_LEVEL = 1
+
+
+def level_sizes(width, height):
+    """(width, height) of every DZI level, level 0 (1 x 1) first; each level is the next one halved, rounded up."""
+    deepest = math.ceil(math.log2(max(width, height))) if max(width, height) > 1 else 0
+    return [(math.ceil(width / 2 ** (deepest - level)), math.ceil(height / 2 ** (deepest - level)))
+            for level in range(deepest + 1)]
+
+
+def _half(strip):
+    """2x2 box average; an odd last row or column is replicated, matching the rounded-up level size."""
+    h, w = strip.shape
+    if h % 2 or w % 2:
+        strip = np.pad(strip, ((0, h % 2), (0, w % 2)), mode="edge")
+    s = strip.astype(np.uint16)
+    return ((s[0::2, 0::2] + s[1::2, 0::2] + s[0::2, 1::2] + s[1::2, 1::2] + 2) // 4).astype(np.uint8)
+
+
+def _encode_png(tile):
+    buf = io.BytesIO()
+    Image.fromarray(tile).save(buf, "PNG", compress_level=PNG_COMPRESS_LEVEL)
+    return buf.getvalue()
+
+
+class PyramidWriter:
+    """
+    Writes a single-band DZI pyramid (PNG tiles, no overlap) from full-resolution rows
+    fed top to bottom with add_rows(). A level's tiles are written as soon as a strip of
+    tile_size rows is complete, and that strip is halved into the level below, so only
+    one strip per level is ever held in memory. close() writes {prefix}.dzi last, so
+    the descriptor only exists for a complete pyramid.
+    """
+    def __init__(self, prefix, width, height, tile_size=256, workers=None):
+        self.prefix = str(prefix)
+        self.files_dir = Path(f"{self.prefix}_files")
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.sizes = level_sizes(width, height)
+        self._pending = [None] * len(self.sizes)
+        self._rows_written = [0] * len(self.sizes)
+        # encoded empty tiles by shape: most of the sea has no spill
+        self._blank = {}
+        self.tiles_written = 0
+
+        # a previous pyramid of this scene may differ in size, tile size or format
+        if os.path.exists(f"{self.prefix}.dzi"):
+            os.remove(f"{self.prefix}.dzi")
+        shutil.rmtree(self.files_dir, ignore_errors=True)
+        for level in range(len(self.sizes)):
+            (self.files_dir / str(level)).mkdir(parents=True)
+        self._pool = ThreadPoolExecutor(max_workers=workers or TILE_LOADER_WORKERS, thread_name_prefix="pyramid")
+
+    def add_rows(self, rows):
+        """Append the next rows (a uint8 array, full width) of the full-resolution image."""
+        self._add(len(self.sizes) - 1, rows)
+
+    def _add(self, level, rows):
+        pending = self._pending[level]
+        if pending is not None:
+            rows = np.concatenate([pending, rows])
+        height = self.sizes[level][1]
+        while len(rows) >= self.tile_size or (len(rows) and self._rows_written[level] + len(rows) == height):
+            strip, rows = rows[:self.tile_size], rows[self.tile_size:]
+            self._write_strip(level, strip)
+            if level > 0:
+                self._add(level - 1, _half(strip))
+        self._pending[level] = rows if len(rows) else None
+
+    def _write_strip(self, level, strip):
+        row = self._rows_written[level] // self.tile_size
+        tiles = [(col, strip[:, x:x + self.tile_size]) for col, x in enumerate(range(0, strip.shape[1], self.tile_size))]
+        list(self._pool.map(lambda tile: self._write_tile(level, tile[0], row, tile[1]), tiles))
+        self._rows_written[level] += len(strip)
+        self.tiles_written += len(tiles)
+
+    def _write_tile(self, level, col, row, tile):
+        if tile.any():
+            data = _encode_png(np.ascontiguousarray(tile))
+        else:
+            data = self._blank.get(tile.shape)
+            if data is None:
+                data = self._blank[tile.shape] = _encode_png(np.zeros(tile.shape, dtype=np.uint8))
+        with open(self.files_dir / str(level) / f"{col}_{row}.png", "wb") as f:
+            f.write(data)
+
+    def abort(self):
+        """Stop without writing the descriptor; the partial tiles stay until the next writer clears them."""
+        self._pool.shutdown(cancel_futures=True)
+
+    def close(self):
+        self._pool.shutdown()
+        incomplete = [level for level, (_, h) in enumerate(self.sizes) if self._rows_written[level] != h]
+        if incomplete:
+            raise ValueError(f"Pyramid {self.prefix} is missing rows on levels {incomplete}")
+        tmp = f"{self.prefix}.dzi.tmp"
+        with open(tmp, "w") as f:
+            f.write(
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                f'<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="png" Overlap="0" '
+                f'TileSize="{self.tile_size}">\n'
+                f'  <Size Height="{self.height}" Width="{self.width}"/>\n'
+                '</Image>\n'
+            )
+        os.replace(tmp, f"{self.prefix}.dzi")
+        return f"{self.prefix}.dzi"
+
+
+def write_canvas_pyramid(canvas, prefix, tile_size=256):
+    """Write the DZI pyramid of a MaskCanvas in one pass over its rows, releasing each strip once written."""
+    writer = PyramidWriter(prefix, canvas.width, canvas.height, tile_size)
+    try:
+        for y0 in range(0, canvas.height, tile_size):
+            writer.add_rows(canvas.array[y0:y0 + tile_size])
+            canvas.release_rows(y0, y0 + tile_size)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+    return writer.tiles_written
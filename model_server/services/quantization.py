@@ -0,0 +1,47 @@
+from pathlib import Path
+import torch
+import torch.nn as nn
+from config import QUANTIZED_MODEL_DIR
+from services.result_cache import model_fingerprint
+
+PRECISIONS = ("fp32", "int8")
+
+
+def model_name(base, precision):
+    """Registry name of a model at a precision, e.g. "ship" / "ship:int8"."""
+    return base if precision == "fp32" else f"{base}:{precision}"
+
+
+def quantize_dynamic_int8(model):
+    """
+    Dynamic int8 quantisation of every nn.Linear: weights are stored as int8 and
+    activations are quantised per batch at run time, so no activation calibration
+    is needed. CPU only.
+    """
+    return torch.ao.quantization.quantize_dynamic(model.cpu().eval(), {nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_checkpoint_path(name):
+    return Path(QUANTIZED_MODEL_DIR) / f"{name}_int8.pt"
+
+
+def export_int8(name, model_int8, source_path):
+    """Save a quantised model together with the fingerprint of the fp32 weights it came from."""
+    path = quantized_checkpoint_path(name)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    torch.save({"model": model_int8, "source_fingerprint": model_fingerprint(source_path)}, str(path))
+    return path
+
+
+def load_int8(name, load_fp32, source_path):
+    """
+    int8 model for name: the exported checkpoint if it was built from the current
+    fp32 weights at source_path, otherwise load_fp32() quantised on the fly.
+    """
+    path = quantized_checkpoint_path(name)
+    if path.exists():
+        saved = torch.load(str(path), map_location="cpu", weights_only=False)
+        if saved.get("source_fingerprint") == model_fingerprint(source_path):
+            return saved["model"].eval()
+        print(f"[models] {path} was exported from other weights, quantising on the fly")
+    return quantize_dynamic_int8(load_fp32())
@@ -0,0 +1,150 @@
+import os
+import json
+import hashlib
+import tempfile
+from pathlib import Path
+from config import RESULT_CACHE_ENABLED, RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES
+from services.tile_manifest import manifest_path_for_folder
+from services.tile_container import container_path_for_folder
+
+HASH_CHUNK = 8 * 1024 * 1024
+# what transformers' from_pretrained reads from a model directory
+PRETRAINED_FILES = ("config.json", "preprocessor_config.json", "*.safetensors", "*.safetensors.index.json",
+                    "pytorch_model*.bin", "pytorch_model*.bin.index.json")
+
+
+def file_fingerprint(path):
+    """
+    sha256 of a file's content. The digest is memoised on disk under the cache
+    directory, keyed by (path, size, mtime), so unchanged files are only hashed once
+    and any rewrite of the file invalidates the memo.
+    """
+    st = os.stat(path)
+    memo_key = hashlib.sha1(f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}".encode()).hexdigest()
+    memo_path = Path(RESULT_CACHE_DIR) / "fingerprints" / memo_key
+    if memo_path.exists():
+        return memo_path.read_text()
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    _atomic_write(memo_path, digest)
+    return digest
+
+
+def model_fingerprint(path):
+    """
+    Content fingerprint of a model's weights: a checkpoint file, or the files
+    from_pretrained reads from a model directory (configs and weight shards).
+    Anything else kept alongside them, such as other models or loader code, is ignored.
+    """
+    path = Path(path)
+    if path.is_file():
+        return file_fingerprint(path)
+    h = hashlib.sha256()
+    for f in sorted(p for pattern in PRETRAINED_FILES for p in path.glob(pattern) if p.is_file()):
+        h.update(f"{f.name}:{file_fingerprint(f)}\n".encode())
+    return h.hexdigest()
+
+
+def listing_fingerprint(folder):
+    """Cheap fingerprint of a tile folder from names, sizes and mtimes (no content reads)."""
+    h = hashlib.sha256()
+    for entry in sorted(os.scandir(folder), key=lambda e: e.name):
+        st = entry.stat()
+        h.update(f"{entry.name}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def level_fingerprint(tile_folder, zoom_level):
+    """
+    Fingerprint of a DZI level: the pyramid's tile manifest when it has one, else the level's
+    listing, else the content of the pyramid's single-file container.
+    """
+    manifest = manifest_path_for_folder(tile_folder)
+    if manifest.exists():
+        return file_fingerprint(manifest)
+    zoom_path = Path(tile_folder) / str(zoom_level)
+    if zoom_path.is_dir():
+        return listing_fingerprint(zoom_path)
+    return file_fingerprint(container_path_for_folder(tile_folder))
+
+
+def source_fingerprint(source):
+    """Fingerprint of what a tile source reads: the image file of a TiffTileSource, else the DZI level."""
+    image_path = getattr(source, "image_path", None)
+    if image_path is not None:
+        return file_fingerprint(image_path)
+    return level_fingerprint(source.zoom_path.parent, source.zoom_path.name)
+
+
+def cache_key(**parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded JSON result store with LRU eviction.
+    Each entry is one file; reading an entry bumps its mtime, and writes evict the
+    least recently used entries until the store fits in max_bytes.
+    Entries may list output files they refer to; an entry whose files were removed
+    or rewritten since it was stored is treated as a miss.
+    """
+    def __init__(self, root=RESULT_CACHE_DIR, max_bytes=RESULT_CACHE_MAX_BYTES, enabled=RESULT_CACHE_ENABLED):
+        self.root = Path(root) / "results"
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        path = self.root / f"{key}.json"
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        for file_path, mtime_ns in entry.get("files", {}).items():
+            if not os.path.exists(file_path) or os.stat(file_path).st_mtime_ns != mtime_ns:
+                path.unlink(missing_ok=True)
+                return None
+
+        os.utime(path)
+        return entry["value"]
+
+    def put(self, key, value, files=()):
+        if not self.enabled:
+            return
+        entry = {
+            "value": value,
+            "files": {str(p): os.stat(p).st_mtime_ns for p in files},
+        }
+        _atomic_write(self.root / f"{key}.json", json.dumps(entry))
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.root):
+            if entry.name.endswith(".json"):
+                st = entry.stat()
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def _atomic_write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+    os.replace(tmp, path)
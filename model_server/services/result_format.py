@@ -0,0 +1,129 @@
+import json
+import struct
+import zlib
+import numpy as np
+
+# Output formats selectable per request:
+#   json     - one JSON document, detections as a list of per-box dicts (default)
+#   ndjson   - streamed; first line is the header object, then one detection per line
+#   columnar - streamed gzip of a struct-of-arrays binary (see iter_columnar)
+FORMATS = ("json", "ndjson", "columnar")
+MEDIA_TYPES = {
+    "json": "application/json",
+    "ndjson": "application/x-ndjson",
+    "columnar": "application/vnd.sar-detections+gzip",
+}
+
+COLUMNAR_MAGIC = b"SARD"
+COLUMNAR_VERSION = 1
+FLOAT_FIELDS = ("x", "y", "w", "h", "score")
+FIELDS = FLOAT_FIELDS + ("label",)
+CHUNK_BOXES = 65536
+
+
+def is_columns(detections):
+    """Ship detections as named columns ({field: array or list}, see detection_merge.named_columns)."""
+    return isinstance(detections, dict) and set(detections) == set(FIELDS)
+
+
+def result_count(detections):
+    if is_columns(detections):
+        return len(detections["score"])
+    return len(detections)
+
+
+def as_records(detections, start=0, stop=None):
+    """Per-box dicts (a slice of them) for the JSON formats; lists and other results pass through."""
+    if not is_columns(detections):
+        return detections if stop is None and start == 0 else detections[start:stop]
+    columns = [_as_list(detections[f][start:stop]) for f in FIELDS]
+    return [dict(zip(FIELDS, values)) for values in zip(*columns)]
+
+
+def jsonable(detections):
+    """Detections in a form json.dumps accepts: columns become lists, everything else is unchanged."""
+    if is_columns(detections):
+        return {f: _as_list(detections[f]) for f in FIELDS}
+    return detections
+
+
+def _as_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+def _split(header, detections):
+    """Only boxes are streamed; anything else (e.g. oil-spill output paths) rides in the header."""
+    if isinstance(detections, list) or is_columns(detections):
+        return dict(header), detections
+    return dict(header, detections=detections), []
+
+
+def iter_ndjson(header, detections):
+    header, boxes = _split(header, detections)
+    count = result_count(boxes)
+    header["count"] = count
+    yield (json.dumps(header) + "\n").encode()
+    for start in range(0, count, CHUNK_BOXES):
+        chunk = as_records(boxes, start, start + CHUNK_BOXES)
+        yield "".join(json.dumps(d) + "\n" for d in chunk).encode()
+
+
+def iter_columnar(header, detections):
+    """
+    Gzip stream of:
+        magic "SARD" | uint8 version | uint32 header_len | header JSON (utf-8)
+        | x, y, w, h, score as float32[count] | label as uint16[count]
+    All little-endian. header["labels"] maps the uint16 label codes to names.
+    """
+    header, boxes = _split(header, detections)
+    n = result_count(boxes)
+    if is_columns(boxes):
+        # columns from detect_ships are encoded as they are, never expanded into per-box records
+        floats = [np.asarray(boxes[field], dtype="<f4") for field in FLOAT_FIELDS]
+        labels, codes = np.unique(np.asarray(boxes["label"], dtype=object), return_inverse=True)
+        labels, codes = [str(label) for label in labels], codes.reshape(-1).astype("<u2")
+    else:
+        floats = [np.fromiter((d[field] for d in boxes), dtype="<f4", count=n) for field in FLOAT_FIELDS]
+        labels = sorted({d["label"] for d in boxes})
+        index = {label: i for i, label in enumerate(labels)}
+        codes = np.fromiter((index[d["label"]] for d in boxes), dtype="<u2", count=n)
+    header["count"] = n
+    header["labels"] = labels
+    header["fields"] = list(FIELDS)
+    header_bytes = json.dumps(header).encode()
+
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+    yield gz.compress(COLUMNAR_MAGIC + struct.pack("<BI", COLUMNAR_VERSION, len(header_bytes)) + header_bytes)
+    for values in floats:
+        yield gz.compress(values.tobytes())
+    yield gz.compress(codes.tobytes())
+    yield gz.flush()
+
+
+def decode_columnar(data):
+    """Inverse of iter_columnar for consumers: returns (header, {field: numpy array})."""
+    raw = zlib.decompress(data, 31)
+    if raw[:4] != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar detection payload")
+    version, header_len = struct.unpack_from("<BI", raw, 4)
+    if version != COLUMNAR_VERSION:
+        raise ValueError(f"Unsupported columnar version {version}")
+    offset = 9 + header_len
+    header = json.loads(raw[9:offset])
+
+    n = header["count"]
+    columns = {}
+    for field in FLOAT_FIELDS:
+        columns[field] = np.frombuffer(raw, dtype="<f4", count=n, offset=offset)
+        offset += 4 * n
+    codes = np.frombuffer(raw, dtype="<u2", count=n, offset=offset)
+    columns["label"] = np.asarray(header["labels"], dtype=object)[codes] if n else np.empty(0, dtype=object)
+    return header, columns
+
+
+def iter_encoded(fmt, header, detections):
+    if fmt == "ndjson":
+        return iter_ndjson(header, detections)
+    if fmt == "columnar":
+        return iter_columnar(header, detections)
+    raise ValueError(f"Unknown streamed format: {fmt}")
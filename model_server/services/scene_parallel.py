@@ -0,0 +1,88 @@
+import multiprocessing as mp
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from config import SCENE_WORKERS, SCENE_WORKER_THREADS, SCENE_PIN_CORES, SCENE_MIN_TILES, SCENE_WORKER_START_METHOD
+from services.tile_loader import with_tiles
+
+# Shards per worker: a few row bands each, so a band that is mostly land or no-data
+# (skipped by triage) does not leave its worker idle while the others finish
+SHARDS_PER_WORKER = 4
+
+# pool size -> executor; kept for the life of the process so shard workers keep their models loaded
+_pools = {}
+_lock = threading.Lock()
+
+
+def should_shard(source, workers=None):
+    workers = SCENE_WORKERS if workers is None else workers
+    return workers > 1 and len(source.tiles) >= SCENE_MIN_TILES
+
+
+def _available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _init_worker(counter, n_workers, threads, pin):
+    """Give this shard worker its torch thread count and, if pinning, its own slice of cores."""
+    import torch
+
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+    cores = _available_cores()
+    per_worker = max(1, len(cores) // n_workers)
+    if pin and hasattr(os, "sched_setaffinity") and len(cores) >= n_workers:
+        start = (index % n_workers) * per_worker
+        os.sched_setaffinity(0, cores[start:start + per_worker])
+    torch.set_num_threads(threads or per_worker)
+
+
+def _get_pool(workers):
+    with _lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            ctx = mp.get_context(SCENE_WORKER_START_METHOD)
+            pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=ctx, initializer=_init_worker,
+                initargs=(ctx.Value("i", 0), workers, SCENE_WORKER_THREADS, SCENE_PIN_CORES),
+            )
+            _pools[workers] = pool
+        return pool
+
+
+def shutdown_pools():
+    with _lock:
+        for pool in _pools.values():
+            pool.shutdown(cancel_futures=True)
+        _pools.clear()
+
+
+def shard_tiles(tiles, n_shards):
+    """Split tiles into up to n_shards bands of whole rows, in row order."""
+    rows = sorted({row for _, row, _ in tiles})
+    n_shards = max(1, min(n_shards, len(rows)))
+    band_of = {row: i * n_shards // len(rows) for i, row in enumerate(rows)}
+    shards = [[] for _ in range(n_shards)]
+    for tile in tiles:
+        shards[band_of[tile[1]]].append(tile)
+    return shards
+
+
+def run_sharded(fn, source, *args, workers=None):
+    """
+    Run fn(shard_source, *args) for row-band shards of source's tiles on the scene
+    worker pool and return the results in shard order. fn must be a module-level
+    function and source picklable (DziTileSource, ContainerTileSource, TiffTileSource).
+    """
+    workers = SCENE_WORKERS if workers is None else workers
+    pool = _get_pool(workers)
+    shards = shard_tiles(source.tiles, workers * SHARDS_PER_WORKER)
+    futures = [pool.submit(fn, with_tiles(source, tiles), *args) for tiles in shards]
+    try:
+        return [future.result() for future in futures]
+    finally:
+        for future in futures:
+            future.cancel()
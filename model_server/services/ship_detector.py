@@ -1,84 +1,288 @@
-import os
+import time
+from types import SimpleNamespace
+import numpy as np
 import torch
 from PIL import Image
-from transformers import DeformableDetrForObjectDetection, DeformableDetrImageProcessor
-import torchvision.ops as ops
-from config import SHIP_MODEL_PATH
+from config import (
+    SHIP_MODEL_PATH, SHIP_BATCH_SIZE, NMS_CELL_SIZE, NMS_PER_LABEL, SHIP_MMAP_CHECKPOINT, MODEL_SHARE_MODE,
+    INFERENCE_PRECISION, SHIP_BACKEND, SHIP_COARSE_TO_FINE, SHIP_COARSE_LEVELS, SHIP_COARSE_METHOD,
+    SHIP_COARSE_CFAR_K, SHIP_COARSE_CFAR_WINDOW, SHIP_COARSE_SCORE_THRESHOLD, SHIP_COARSE_MARGIN
+)
+from services.tile_loader import open_level, iter_tile_batches, with_tiles
+from services.tile_triage import select_tiles, prefilter_tiles, TriageStats
+from services.detection_merge import concat_columns, columns_to_records, named_columns, grid_nms
+from services.quantization import model_name, load_int8
+from services.inference_backend import load_backend
+from services.scene_parallel import should_shard, run_sharded
+from services.coarse_to_fine import coarse_level_source, scan_bright_targets, touched_tiles
+from services.metrics import timed, job_timings, merge_job_timings, dump as dump_metrics
+from models.model_loader import register, get_model, build_from_mmap
 
 TILE_SIZE = 512
 OVERLAP = 1
 SCORE_THRESHOLD = 0.5
 IOU_THRESHOLD = 0.5
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+COARSE_METHODS = ("cfar", "model")
 
-# Load model once globally
-model = DeformableDetrForObjectDetection.from_pretrained(SHIP_MODEL_PATH).to(DEVICE)
-processor = DeformableDetrImageProcessor.from_pretrained(SHIP_MODEL_PATH)
-model.eval()
-id2label = model.config.id2label if hasattr(model.config, 'id2label') else {0: "object"}
 
+def _load_fp32_network():
+    # transformers is only imported once the ship model is actually needed
+    from transformers import DeformableDetrConfig, DeformableDetrForObjectDetection
+
+    model = None
+    if MODEL_SHARE_MODE == "mmap" and DEVICE == "cpu":
+        model_config = DeformableDetrConfig.from_pretrained(SHIP_MODEL_PATH)
+        model = build_from_mmap(lambda: DeformableDetrForObjectDetection(model_config), SHIP_MMAP_CHECKPOINT)
+    if model is None:
+        model = DeformableDetrForObjectDetection.from_pretrained(SHIP_MODEL_PATH).to(DEVICE)
+    return model.eval()
+
+
+class ShipGraph(torch.nn.Module):
+    """Deformable DETR with plain tensor inputs and outputs, the form exported graphs take."""
+
+    def __init__(self, detr):
+        super().__init__()
+        self.detr = detr
+
+    def forward(self, pixel_values, pixel_mask):
+        outputs = self.detr(pixel_values=pixel_values, pixel_mask=pixel_mask)
+        return outputs.logits, outputs.pred_boxes
+
+
+def _bundle(model, device, backend):
+    from transformers import DeformableDetrImageProcessor
+
+    processor = DeformableDetrImageProcessor.from_pretrained(SHIP_MODEL_PATH)
+    id2label = model.config.id2label if hasattr(model.config, 'id2label') else {0: "object"}
+    run = load_backend("ship", backend, ShipGraph(model).eval(), device, SHIP_MODEL_PATH)
+    return {"model": model, "run": run, "processor": processor, "id2label": id2label}
+
+
+def _load_ship_model():
+    return _bundle(_load_fp32_network(), DEVICE, SHIP_BACKEND)
+
+
+def _load_ship_model_int8():
+    # the quantised modules only run eagerly
+    return _bundle(load_int8("ship", lambda: _load_fp32_network().cpu(), SHIP_MODEL_PATH), "cpu", "eager")
+
+
+# Loaded lazily on first use
+register("ship", _load_ship_model)
+register("ship:int8", _load_ship_model_int8)
 
-def detect_ships(tile_folder: str, zoom_level: str = "15") -> list:
-    zoom_path = os.path.join(tile_folder, zoom_level)
-    detections = []
-    for tile_file in os.listdir(zoom_path):
-        if not tile_file.endswith(".jpeg"):
-            continue
 
-        x_str, y_str = tile_file.replace(".jpeg", "").split("_")
-        x_idx, y_idx = int(x_str), int(y_str)
+def warmup(precision: str = None):
+    """Load the ship model and run one forward pass on a blank tile."""
+    tile = Image.new("RGB", (TILE_SIZE + 2 * OVERLAP, TILE_SIZE + 2 * OVERLAP))
+    detect_on_batch([tile], [(0, 0)], [(TILE_SIZE, TILE_SIZE)], precision=precision)
 
-        tile_path = os.path.join(zoom_path, tile_file)
-        tile_img = Image.open(tile_path).convert("RGB")
-        full_w, full_h = tile_img.size
 
-        content_w = full_w - 2 * OVERLAP
-        content_h = full_h - 2 * OVERLAP
+def coarse_settings(**overrides):
+    """Coarse-to-fine settings from config, with some replaced (e.g. while sweeping thresholds)."""
+    settings = {
+        "levels": SHIP_COARSE_LEVELS,
+        "method": SHIP_COARSE_METHOD,
+        "cfar_k": SHIP_COARSE_CFAR_K,
+        "cfar_window": SHIP_COARSE_CFAR_WINDOW,
+        "score_threshold": SHIP_COARSE_SCORE_THRESHOLD,
+        "margin": SHIP_COARSE_MARGIN,
+    }
+    unknown = set(overrides) - set(settings)
+    if unknown:
+        raise ValueError(f"Unknown coarse-to-fine settings: {', '.join(sorted(unknown))}")
+    settings.update(overrides)
+    if settings["method"] not in COARSE_METHODS:
+        raise ValueError(f"Unknown coarse method {settings['method']!r}, use one of {COARSE_METHODS}")
+    return settings
 
-        offset_x = x_idx * TILE_SIZE - (OVERLAP if x_idx > 0 else 0)
-        offset_y = y_idx * TILE_SIZE - (OVERLAP if y_idx > 0 else 0)
 
-        tile_detections = detect_on_tile(tile_img, (offset_x, offset_y), content_w, content_h)
-        detections.extend(tile_detections)
+def detect_ships(tile_folder: str, zoom_level: str = "15", batch_size: int = None, source=None,
+                 report: dict = None, precision: str = None, workers: int = None, coarse=None,
+                 as_columns: bool = False):
+    """
+    Detect ships on every tile of a DZI zoom level, or of `source` when given
+    (e.g. a TiffTileSource reading windows straight from the uploaded image).
+    Empty and uniform tiles are skipped by tile triage; if `report` is given,
+    report["triage"] receives the skip counts.
+    precision: "fp32" or "int8" (defaults to INFERENCE_PRECISION).
+    workers: shard the scene across this many processes (defaults to SCENE_WORKERS);
+    detections of all shards go through one global NMS.
+    coarse: coarse-to-fine settings (see coarse_settings), or False to run every tile;
+    defaults to coarse_settings() when SHIP_COARSE_TO_FINE is set. Only the deepest-level
+    tiles near candidates found on a lower pyramid level are then detected on, and
+    report["coarse"] receives the tile counts.
+    Returns a list of per-box dicts, or with as_columns=True the same detections as
+    named columns (see detection_merge.named_columns) for encoders that take arrays.
+    """
+    precision = precision or INFERENCE_PRECISION
+    source = source or open_level(tile_folder, zoom_level, TILE_SIZE, OVERLAP, exts=(".jpeg",))
+    batch_size = batch_size or SHIP_BATCH_SIZE
+    triage = TriageStats()
 
-    return apply_nms(detections)
+    if coarse is None:
+        coarse = coarse_settings() if SHIP_COARSE_TO_FINE else False
+    if coarse:
+        deep_level = getattr(source, "zoom_level", zoom_level)
+        with timed("ship_coarse"):
+            tiles, coarse_report = propose_tiles(source, tile_folder, deep_level, coarse, batch_size, precision)
+        if tiles is not None:
+            source = with_tiles(source, tiles)
+        if report is not None:
+            report["coarse"] = coarse_report
 
+    if should_shard(source, workers):
+        parts = []
+        for columns, shard_triage, id2label, timings in run_sharded(_detect_shard, source, batch_size, precision,
+                                                                    workers=workers):
+            parts.append(columns)
+            triage.merge(shard_triage)
+            merge_job_timings(timings)
+    else:
+        parts = [detect_columns(source, batch_size, precision, triage)]
+        id2label = get_model(model_name("ship", precision))["id2label"]
 
-def detect_on_tile(tile_img, offset, content_w, content_h):
-    inputs = processor(images=tile_img, return_tensors="pt").to(DEVICE)
-    with torch.no_grad():
-        outputs = model(**inputs)
+    if report is not None:
+        report["triage"] = triage.as_dict()
+    columns = concat_columns(parts)
+    with timed("nms", items=len(columns["score"])):
+        merged = grid_nms(columns, IOU_THRESHOLD, cell_size=NMS_CELL_SIZE, per_label=NMS_PER_LABEL)
+    if as_columns:
+        return named_columns(merged, id2label)
+    return columns_to_records(merged, id2label)
 
-    target_sizes = torch.tensor([[tile_img.size[1], tile_img.size[0]]]).to(DEVICE)
-    results = processor.post_process_object_detection(outputs, threshold=SCORE_THRESHOLD, target_sizes=target_sizes)[0]
 
-    detections = []
-    for box, label, score in zip(results["boxes"], results["labels"], results["scores"]):
-        x1, y1, x2, y2 = box.tolist()
+def propose_tiles(source, tile_folder, deep_level, settings, batch_size=None, precision=None):
+    """
+    Tiles of source (the deepest level) within settings["margin"] px of a candidate found
+    on the pyramid level settings["levels"] below it, in source order.
+    Returns (tiles, report); tiles is None when that level is not on disk, so every tile runs.
+    """
+    coarse, scale = coarse_level_source(tile_folder, deep_level, settings["levels"], TILE_SIZE, OVERLAP,
+                                        exts=(".jpeg",))
+    report = {"method": settings["method"], "level": int(deep_level) - settings["levels"],
+              "tiles_total": len(source.tiles)}
+    if coarse is None:
+        print(f"Coarse-to-fine: level {report['level']} not found under {tile_folder}, detecting on every tile")
+        report["skipped"] = True
+        return None, report
 
-        if x1 < OVERLAP or y1 < OVERLAP or x2 > OVERLAP + content_w or y2 > OVERLAP + content_h:
+    if settings["method"] == "model":
+        columns = detect_columns(coarse, batch_size or SHIP_BATCH_SIZE, precision or INFERENCE_PRECISION,
+                                 TriageStats(), threshold=settings["score_threshold"])
+        boxes = (columns["x"], columns["y"], columns["x"] + columns["w"], columns["y"] + columns["h"])
+    else:
+        boxes = scan_bright_targets(coarse, settings["cfar_k"], settings["cfar_window"])
+
+    tiles = touched_tiles(source.tiles, [np.asarray(b) * scale for b in boxes], TILE_SIZE, settings["margin"])
+    report.update(tiles_coarse=len(coarse.tiles), candidates=int(len(boxes[0])), tiles_selected=len(tiles))
+    return tiles, report
+
+
+def _detect_shard(source, batch_size, precision):
+    """Runs in a scene worker process: raw detections of one shard, before NMS."""
+    triage = TriageStats()
+    with job_timings() as timings:
+        columns = detect_columns(source, batch_size, precision, triage)
+    dump_metrics()
+    return columns, triage, get_model(model_name("ship", precision))["id2label"], timings.as_dict()
+
+
+def detect_columns(source, batch_size, precision, triage, threshold=None):
+    """Detections on every tile of source in global coordinates, as columns, before NMS."""
+    parts = []
+    # tiles of equal size share batches, so few batches hold more than one tile size
+    tiles = sorted(prefilter_tiles(source, triage), key=size_class(source.tiles))
+    for batch, tile_imgs in iter_tile_batches(tiles, batch_size, load_fn=source.load):
+        with timed("triage", items=len(batch)):
+            keep = select_tiles(tile_imgs)
+        triage.record_batch(keep)
+        batch = [tile for tile, k in zip(batch, keep) if k]
+        tile_imgs = [img for img, k in zip(tile_imgs, keep) if k]
+        if not batch:
             continue
 
-        global_x = offset[0] + (x1 - OVERLAP)
-        global_y = offset[1] + (y1 - OVERLAP)
+        offsets, content_sizes = zip(*(tile_geometry(tile, img) for tile, img in zip(batch, tile_imgs)))
+        start = time.perf_counter()
+        parts.append(detect_on_batch(tile_imgs, offsets, content_sizes, precision=precision, threshold=threshold))
+        triage.record_model(time.perf_counter() - start, len(batch))
+    return concat_columns(parts)
+
+
+def size_class(tiles):
+    """
+    Sort key for tiles of this set grouping those of equal size: dzsave's first column
+    and row lack the leading overlap and its last ones are cut to the image edge.
+    """
+    last_col = max((col for col, _, _ in tiles), default=0)
+    last_row = max((row for _, row, _ in tiles), default=0)
+    return lambda tile: (tile[0] == 0, tile[0] == last_col, tile[1] == 0, tile[1] == last_row)
+
+
+def tile_geometry(tile, tile_img):
+    """Global offset of a tile's top-left pixel and the (width, height) of its content inside the overlap."""
+    x_idx, y_idx, _ = tile
+    full_w, full_h = tile_img.size
+    offset = (x_idx * TILE_SIZE - (OVERLAP if x_idx > 0 else 0), y_idx * TILE_SIZE - (OVERLAP if y_idx > 0 else 0))
+    return offset, (full_w - 2 * OVERLAP, full_h - 2 * OVERLAP)
+
+
+def detect_on_batch(tile_imgs, offsets, content_sizes, precision: str = None, threshold: float = None):
+    """
+    Run a batch of tiles through the model, one forward pass per tile size.
+    The processor resizes every tile and pads a batch to its largest one, so an edge
+    tile batched with full tiles would pad them all and change their pixel mask and
+    normalised boxes. Tiles of one size resize to one shape and need no padding, so
+    every tile is detected on as it would be on its own.
+    threshold: minimum score, defaults to SCORE_THRESHOLD.
+    Returns detections in global coordinates as columns (see detection_merge).
+    """
+    groups = {}
+    for i, img in enumerate(tile_imgs):
+        groups.setdefault(img.size, []).append(i)
+    return concat_columns([
+        _detect_on_group([tile_imgs[i] for i in group], [offsets[i] for i in group],
+                         [content_sizes[i] for i in group], precision, threshold)
+        for group in groups.values()
+    ])
+
+
+def _detect_on_group(tile_imgs, offsets, content_sizes, precision, threshold):
+    """One forward pass over tiles of equal size."""
+    ship = get_model(model_name("ship", precision or INFERENCE_PRECISION))
+    processor = ship["processor"]
+    with timed("ship_preprocess", items=len(tile_imgs)):
+        inputs = processor(images=tile_imgs, return_tensors="pt")
+    with timed("ship_forward", items=len(tile_imgs)):
+        logits, pred_boxes = ship["run"](inputs["pixel_values"], inputs["pixel_mask"])
+    outputs = SimpleNamespace(logits=logits, pred_boxes=pred_boxes)
+
+    target_sizes = torch.tensor([[img.size[1], img.size[0]] for img in tile_imgs]).to(logits.device)
+    with timed("ship_postprocess", items=len(tile_imgs)):
+        batch_results = processor.post_process_object_detection(
+            outputs, threshold=SCORE_THRESHOLD if threshold is None else threshold, target_sizes=target_sizes)
+
+    return concat_columns([
+        _to_global(results, offset, content_w, content_h)
+        for results, offset, (content_w, content_h) in zip(batch_results, offsets, content_sizes)
+    ])
 
-        detections.append({
-            "x": global_x,
-            "y": global_y,
-            "w": x2 - x1,
-            "h": y2 - y1,
-            "label": id2label.get(int(label), str(label)),
-            "score": score.item()
-        })
 
-    return detections
+def _to_global(results, offset, content_w, content_h):
+    boxes = results["boxes"].cpu().numpy().astype(np.float64)
+    x1, y1, x2, y2 = boxes.T
 
+    # drop boxes reaching into the overlap border, the neighbouring tile owns them
+    inside = (x1 >= OVERLAP) & (y1 >= OVERLAP) & (x2 <= OVERLAP + content_w) & (y2 <= OVERLAP + content_h)
 
-def apply_nms(detections):
-    if not detections:
-        return []
+    return {
+        "x": (offset[0] + (x1 - OVERLAP))[inside],
+        "y": (offset[1] + (y1 - OVERLAP))[inside],
+        "w": (x2 - x1)[inside],
+        "h": (y2 - y1)[inside],
+        "score": results["scores"].cpu().numpy().astype(np.float64)[inside],
+        "label": results["labels"].cpu().numpy().astype(np.int64)[inside],
+    }
 
-    boxes = torch.tensor([[d["x"], d["y"], d["x"] + d["w"], d["y"] + d["h"]] for d in detections])
-    scores = torch.tensor([d["score"] for d in detections])
-    keep = ops.nms(boxes, scores, IOU_THRESHOLD)
-    return [detections[i] for i in keep]
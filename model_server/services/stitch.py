@@ -2,8 +2,14 @@
 import os
 import re
 import math
+import mmap
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pyvips
 from PIL import Image
 import xml.etree.ElementTree as ET
+from config import TILE_LOADER_WORKERS
 
 def read_size_from_vips_xml(xml_path):
     """Return (width, height) from a vips dzsave XML if present, else None."""
@@ -64,10 +70,13 @@ def parse_coords_from_name(fname):
     return None
 
 def stitch_predicted_folder(predicted_folder, out_path,
-                            xml_path=None, tiles_per_row=None, tile_exts=(".png", ".tif", ".tiff", ".jpg", ".jpeg", ".bmp")):
+                            xml_path=None, tiles_per_row=None, tile_exts=(".png", ".tif", ".tiff", ".jpg", ".jpeg", ".bmp"),
+                            manifest=None):
     """
     Stitch predicted tiles from predicted_folder and save to out_path.
     If xml_path given and contains width/height, final canvas will be that size and image will be cropped to it.
+    If manifest (the TileManifest of the pyramid the tiles were predicted from) is given, the size comes
+    from it and parsed coordinates are taken as (col, row) without guessing.
     If filenames contain coordinates, they will be used; otherwise tiles_per_row (int) is required for row-major layout.
     """
     # 1) collect tile files (recursive)
@@ -84,7 +93,9 @@ def stitch_predicted_folder(predicted_folder, out_path,
 
     # 2) try optional xml
     full_size = None
-    if xml_path and os.path.exists(xml_path):
+    if manifest is not None:
+        full_size = (manifest.width, manifest.height)
+    elif xml_path and os.path.exists(xml_path):
         full_size = read_size_from_vips_xml(xml_path)
 
     # 3) inspect tiles: sizes and parsed coords
@@ -113,7 +124,10 @@ def stitch_predicted_folder(predicted_folder, out_path,
         range_second = max(second_vals) - min(second_vals) + 1
 
         # compute which mapping better matches full_size if available else assume row_col
-        if full_size:
+        if manifest is not None:
+            # dzsave names tiles {col}_{row}
+            interpret_as = "col_row"
+        elif full_size:
             possible1 = (range_second * tile_w, range_first * tile_h)  # if parsed is row,col => width = range_second*tile_w
             possible2 = (range_first * tile_w, range_second * tile_h)  # if parsed is col,row
             score1 = abs(possible1[0] - full_size[0]) + abs(possible1[1] - full_size[1])
@@ -206,3 +220,157 @@ def stitch_predicted_folder(predicted_folder, out_path,
     stitched.save(out_path)
     print(f"[done] Stitched image saved to: {out_path}")
     return out_path
+
+class MaskCanvas:
+    """
+    Disk-backed single-band uint8 canvas for a full-size mask.
+    Pixels live in a memory-mapped file, so only the rows being written are resident;
+    release_rows() flushes finished strips and drops them from memory.
+    mode "w" creates (and zero-fills) the file, "r+" reopens an existing one.
+    """
+    def __init__(self, path, width, height, mode="w"):
+        self.path = str(path)
+        self.width = width
+        self.height = height
+        size = width * height
+        self._file = open(self.path, "w+b" if mode == "w" else "r+b")
+        if mode == "w":
+            self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+        self.array = np.frombuffer(self._mmap, dtype=np.uint8).reshape(height, width)
+
+    def put(self, col, row, mask, tile_size, overlap):
+        """Write a DZI tile mask (including its overlap border) at its grid position."""
+        left = overlap if col > 0 else 0
+        top = overlap if row > 0 else 0
+        x, y = col * tile_size, row * tile_size
+        if x >= self.width or y >= self.height:
+            return
+        content = mask[top:top + tile_size, left:left + tile_size]
+        h = min(content.shape[0], self.height - y)
+        w = min(content.shape[1], self.width - x)
+        self.array[y:y + h, x:x + w] = content[:h, :w]
+
+    def release_rows(self, y0, y1):
+        y1 = min(y1, self.height)
+        if y1 <= y0:
+            return
+        start = (y0 * self.width) // mmap.PAGESIZE * mmap.PAGESIZE
+        end = y1 * self.width
+        self._mmap.flush(start, end - start)
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self._mmap.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def flush(self):
+        self._mmap.flush()
+
+    def save(self, out_path):
+        """Encode the canvas to out_path, streamed by libvips straight from the raw file."""
+        self._mmap.flush()
+        out_dir = os.path.dirname(str(out_path))
+        if out_dir:
+            os.makedirs(out_dir, exist_ok=True)
+        image = pyvips.Image.rawload(self.path, self.width, self.height, 1)
+        image.write_to_file(str(out_path))
+        return out_path
+
+    def close(self, remove=False):
+        del self.array
+        self._mmap.close()
+        self._file.close()
+        if remove:
+            os.remove(self.path)
+
+
+def stitch_streaming(tiles, out_path, full_size, tile_size=256, overlap=1, load_fn=None, workers=None):
+    """
+    Stitch tiles row strip by row strip into a memory-mapped canvas and save to out_path.
+    tiles: {(col, row): source}; load_fn(source) must return the tile's uint8 mask
+    including its overlap border (identity when the sources are already arrays).
+    Tiles of a strip are decoded in parallel; at most one strip is held in memory.
+    """
+    if not tiles:
+        raise ValueError("No tile masks to stitch")
+    load_fn = load_fn or (lambda source: source)
+    full_w, full_h = full_size
+
+    strips = defaultdict(list)
+    for col, row in tiles:
+        strips[row].append(col)
+
+    canvas_path = f"{out_path}.canvas.raw"
+    canvas = MaskCanvas(canvas_path, full_w, full_h)
+    print(f"[info] Created memory-mapped canvas size={(full_w, full_h)} for {len(tiles)} tiles")
+    try:
+        with ThreadPoolExecutor(max_workers=workers or TILE_LOADER_WORKERS) as pool:
+            for row in sorted(strips):
+                cols = sorted(strips[row])
+                for col, mask in zip(cols, pool.map(lambda c: load_fn(tiles[(c, row)]), cols)):
+                    canvas.put(col, row, mask, tile_size, overlap)
+                canvas.release_rows(row * tile_size, (row + 1) * tile_size)
+        canvas.save(out_path)
+    finally:
+        canvas.close(remove=True)
+
+    print(f"[done] Stitched image saved to: {out_path}")
+    return out_path
+
+
+def stitch_tile_folder(predicted_folder, out_path, full_size=None, tile_size=256, overlap=1,
+                       tile_exts=(".png", ".tif", ".tiff", ".jpg", ".jpeg", ".bmp"), workers=None, manifest=None):
+    """
+    Streaming counterpart of stitch_predicted_folder for folders laid out like a DZI
+    zoom level: tiles are named "{col}_{row}[_suffix].ext", so the grid is read from
+    the names directly instead of being guessed.
+    If full_size is not given, it comes from manifest (the TileManifest of the source
+    pyramid, whose tiling must match) or from the last column/row tile headers.
+    """
+    tiles = {}
+    for f in os.listdir(predicted_folder):
+        if not f.lower().endswith(tile_exts):
+            continue
+        col, row = f.split("_")[:2]
+        tiles[(int(col), int(os.path.splitext(row)[0]))] = os.path.join(predicted_folder, f)
+    if not tiles:
+        raise FileNotFoundError(f"No tile images found in {predicted_folder}")
+
+    if not full_size and manifest is not None:
+        manifest.check(tile_size, overlap)
+        full_size = (manifest.width, manifest.height)
+    if not full_size:
+        full_size = grid_size_from_tiles(tiles, tile_size, overlap)
+
+    return stitch_streaming(tiles, out_path, full_size, tile_size=tile_size, overlap=overlap,
+                            load_fn=_load_mask, workers=workers)
+
+
+def edge_tiles(tiles):
+    """One last-column and one last-row entry of {(col, row): source}, all grid_size_from_tiles reads."""
+    last_col = max(c for c, _ in tiles)
+    last_row = max(r for _, r in tiles)
+    return {key: tiles[key] for key in (next(k for k in tiles if k[0] == last_col),
+                                        next(k for k in tiles if k[1] == last_row))}
+
+
+def grid_size_from_tiles(tiles, tile_size=256, overlap=1):
+    """
+    Full image (width, height) of a DZI level from {(col, row): path}.
+    Only the headers of one last-column and one last-row tile are read.
+    """
+    last_col = max(c for c, _ in tiles)
+    last_row = max(r for _, r in tiles)
+    with Image.open(next(p for (c, _), p in tiles.items() if c == last_col)) as im:
+        full_w = last_col * tile_size + _content_extent(im.size[0], last_col, tile_size, overlap)
+    with Image.open(next(p for (_, r), p in tiles.items() if r == last_row)) as im:
+        full_h = last_row * tile_size + _content_extent(im.size[1], last_row, tile_size, overlap)
+    return full_w, full_h
+
+
+def _content_extent(extent, index, tile_size, overlap):
+    """Pixels a tile contributes along one axis once its leading overlap is cropped."""
+    return min(tile_size, extent - (overlap if index > 0 else 0))
+
+
+def _load_mask(path):
+    with Image.open(path) as im:
+        return np.asarray(im.convert("L"))
@@ -0,0 +1,74 @@
+"""
+Single-file pyramid storage: dzsave's zip container ({prefix}.zip), written with stored
+(uncompressed) entries so every tile is a contiguous byte range of the file. Tiles are
+read by slicing a read-only memory map at the offsets recorded in the tile manifest,
+so a scene is one inode and one open file instead of a file per tile.
+"""
+import mmap
+import re
+import struct
+import zipfile
+from pathlib import Path
+from services.tile_manifest import pyramid_prefix
+
+CONTAINER_SUFFIX = ".zip"
+# member names dzsave writes: {name}_files/{level}/{col}_{row}.{ext}
+TILE_NAME = re.compile(r"_files/(\d+)/(\d+)_(\d+)\.\w+$")
+# fixed part of a zip local file header; name and extra field lengths sit at offset 26
+LOCAL_HEADER_SIZE = 30
+
+
+def container_path(prefix):
+    return Path(f"{prefix}{CONTAINER_SUFFIX}")
+
+
+def container_path_for_folder(tile_folder):
+    """Container of the pyramid whose tiles would live in tile_folder ({prefix}_files) in folder layout."""
+    return container_path(pyramid_prefix(tile_folder))
+
+
+def zip_tile_index(path):
+    """
+    {(level, col, row): (offset, length)} of the tile data in a zip container.
+    Offsets point past each member's local header, straight at the encoded tile.
+    """
+    index = {}
+    with open(path, "rb") as f, zipfile.ZipFile(f) as archive:
+        for info in archive.infolist():
+            match = TILE_NAME.search(info.filename)
+            if match is None:
+                continue
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Tile {info.filename} in {path} is compressed; write the container with compression=0")
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            offset = info.header_offset + LOCAL_HEADER_SIZE + name_len + extra_len
+            level, col, row = (int(v) for v in match.groups())
+            index[(level, col, row)] = (offset, info.file_size)
+    return index
+
+
+class TileContainer:
+    """Read-only memory map of a container file; read(offset, length) returns the tile's bytes."""
+    def __init__(self, path):
+        self.path = str(path)
+        self._open()
+
+    def _open(self):
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __getstate__(self):
+        # the map is reopened on the other side; pages are shared through the page cache
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._open()
+
+    def read(self, offset, length):
+        return self._mmap[offset:offset + length]
+
+    def close(self):
+        self._mmap.close()
+
@@ -0,0 +1,269 @@
+import os
+import math
+import threading
+from collections import deque
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pyvips
+from PIL import Image
+from config import TILE_LOADER_WORKERS, TILE_PREFETCH_DEPTH
+from services.stitch import grid_size_from_tiles, edge_tiles
+from services.metrics import timed, submit
+from services.tile_manifest import load_manifest, manifest_path_for_folder
+from services.tile_container import TileContainer, container_path_for_folder, zip_tile_index
+
+TILE_EXTS = (".jpeg", ".jpg", ".png", ".tiff", ".tif", ".bmp")
+
+
+def list_dzi_tiles(zoom_path, exts=TILE_EXTS):
+    """
+    Return [(col, row, path)] for every tile image in a DZI zoom-level folder.
+    dzsave names tiles "{col}_{row}.{ext}".
+    """
+    tiles = []
+    with timed("tile_listing"):
+        tile_names = os.listdir(zoom_path)
+    for tile_name in tile_names:
+        if not tile_name.lower().endswith(exts):
+            continue
+        name, _ = os.path.splitext(tile_name)
+        col, row = (int(v) for v in name.split("_"))
+        tiles.append((col, row, os.path.join(zoom_path, tile_name)))
+    return tiles
+
+
+def load_rgb(tile):
+    _, _, path = tile
+    with timed("tile_decode", items=1):
+        return Image.open(path).convert("RGB")
+
+
+class DziTileSource:
+    """
+    Tiles of one zoom level of a dzsave pyramid on disk.
+    tiles: [(col, row, path)]; load(tile) returns the decoded RGB tile.
+    When generate_dzi wrote a tile manifest, the tiles, the level size and the
+    deepest level's tile statistics come from it instead of listing the folder
+    and reading tile headers; a manifest with other tiling raises ValueError.
+    """
+    def __init__(self, tile_folder, zoom_level, tile_size, overlap=1, exts=TILE_EXTS):
+        self.zoom_path = Path(tile_folder) / str(zoom_level)
+        if not self.zoom_path.exists():
+            raise FileNotFoundError(f"Zoom-level folder not found: {self.zoom_path}")
+        self.zoom_level = str(zoom_level)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self._size = None
+        self.manifest = load_manifest(manifest_path_for_folder(tile_folder))
+        if self.manifest is not None and self.manifest.suffix.lower().endswith(exts):
+            self.manifest.check(tile_size, overlap)
+            self.tiles = self.manifest.tiles_at(zoom_level, self.zoom_path)
+            self._size = self.manifest.level_size(zoom_level)
+        else:
+            self.manifest = None
+            self.tiles = list_dzi_tiles(self.zoom_path, exts=exts)
+
+    @property
+    def size(self):
+        """Full (width, height) of the level, from the manifest or the last column/row tile headers."""
+        if self._size is None:
+            self._size = grid_size_from_tiles({(c, r): p for c, r, p in self.tiles}, self.tile_size, self.overlap)
+        return self._size
+
+    def tile_stats(self, tiles):
+        """(mean, var, nodata) of tiles from the manifest, or None when it has none for this level."""
+        if self.manifest is None:
+            return None
+        return self.manifest.tile_stats(self.zoom_level, tiles)
+
+    def load(self, tile):
+        return load_rgb(tile)
+
+
+class ContainerTileSource:
+    """
+    Tiles of one zoom level of a pyramid stored in a single-file container (see tile_container).
+    tiles: [(col, row, (offset, length))], from the tile manifest or, without one, the container's
+    zip directory; load(tile) decodes the tile straight from the container's memory map.
+    """
+    def __init__(self, container_path, tile_folder, zoom_level, tile_size, overlap=1):
+        self.container_path = str(container_path)
+        # where the folder layout would put the level; names the level for fingerprints and reports
+        self.zoom_path = Path(tile_folder) / str(zoom_level)
+        self.zoom_level = str(zoom_level)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.container = TileContainer(self.container_path)
+        self.manifest = load_manifest(manifest_path_for_folder(tile_folder))
+        if self.manifest is not None:
+            self.manifest.check(tile_size, overlap)
+            self.tiles = self.manifest.tile_locations(zoom_level)
+            self._size = self.manifest.level_size(zoom_level)
+        else:
+            level = int(zoom_level)
+            self.tiles = sorted(((col, row, location) for (lvl, col, row), location
+                                 in zip_tile_index(self.container_path).items() if lvl == level),
+                                key=lambda t: (t[1], t[0]))
+            if not self.tiles:
+                raise FileNotFoundError(f"Zoom level {zoom_level} not found in {self.container_path}")
+            self._size = None
+
+    @property
+    def size(self):
+        """Full (width, height) of the level, from the manifest or one last-column and one last-row tile."""
+        if self._size is None:
+            edge = edge_tiles({(c, r): location for c, r, location in self.tiles})
+            self._size = grid_size_from_tiles({k: BytesIO(self.container.read(*v)) for k, v in edge.items()},
+                                              self.tile_size, self.overlap)
+        return self._size
+
+    def tile_stats(self, tiles):
+        if self.manifest is None:
+            return None
+        return self.manifest.tile_stats(self.zoom_level, tiles)
+
+    def load(self, tile):
+        _, _, (offset, length) = tile
+        with timed("tile_decode", items=1):
+            return Image.open(BytesIO(self.container.read(offset, length))).convert("RGB")
+
+
+def pyramid_levels(tile_folder):
+    """
+    Sorted zoom levels of a pyramid in either layout: from its tile manifest when
+    generate_dzi wrote one, else the level folders, else the container's zip directory.
+    """
+    manifest = load_manifest(manifest_path_for_folder(tile_folder))
+    if manifest is not None:
+        return list(range(manifest.deepest + 1))
+    folder = Path(tile_folder)
+    if folder.is_dir():
+        return sorted(int(p.name) for p in folder.iterdir() if p.is_dir() and p.name.isdigit())
+    container = container_path_for_folder(tile_folder)
+    if container.is_file():
+        return sorted({level for level, _, _ in zip_tile_index(container)})
+    return []
+
+
+def open_level(tile_folder, zoom_level, tile_size, overlap=1, exts=TILE_EXTS):
+    """
+    Tile source for one level of a pyramid in either layout: the {prefix}_files folder
+    when it exists, else the {prefix}.zip container. FileNotFoundError when neither has the level.
+    """
+    if (Path(tile_folder) / str(zoom_level)).is_dir():
+        return DziTileSource(tile_folder, zoom_level, tile_size, overlap, exts=exts)
+    container = container_path_for_folder(tile_folder)
+    if container.is_file():
+        return ContainerTileSource(container, tile_folder, zoom_level, tile_size, overlap)
+    raise FileNotFoundError(f"Zoom level {zoom_level} not found in {tile_folder} or {container}")
+
+
+class TiffTileSource:
+    """
+    Tiles read as windows straight from a source image, laid out exactly like the
+    deepest level dzsave would write (same tile size and overlap), so detectors can
+    run without a pyramid on disk and without the JPEG round trip.
+    tiles: [(col, row, (left, top, width, height))]
+    """
+    def __init__(self, image_path, tile_size, overlap=1):
+        self.image_path = str(image_path)
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.image = as_rgb8(pyvips.Image.new_from_file(self.image_path, access="random"))
+        self.size = (self.image.width, self.image.height)
+        # number of the level dzsave would write at full resolution
+        self.zoom_level = str(math.ceil(math.log2(max(self.size)))) if max(self.size) > 1 else "0"
+        self.tiles = tiff_tile_grid(self.image.width, self.image.height, tile_size, overlap)
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # pyvips images and regions cannot be pickled; the image is reopened on the other side
+        state = self.__dict__.copy()
+        del state["image"], state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.image = as_rgb8(pyvips.Image.new_from_file(self.image_path, access="random"))
+        self._local = threading.local()
+
+    def load(self, tile):
+        # pyvips regions are not thread-safe, so each loader thread keeps its own
+        region = getattr(self._local, "region", None)
+        if region is None:
+            region = self._local.region = pyvips.Region.new(self.image)
+        _, _, (left, top, width, height) = tile
+        with timed("tile_decode", items=1):
+            data = region.fetch(left, top, width, height)
+        return Image.fromarray(np.frombuffer(data, dtype=np.uint8).reshape(height, width, 3))
+
+
+def with_tiles(source, tiles):
+    """Shallow copy of a tile source restricted to `tiles`."""
+    subset = object.__new__(type(source))
+    subset.__dict__.update(source.__dict__)
+    subset.tiles = tiles
+    return subset
+
+
+def tiff_tile_grid(width, height, tile_size, overlap=1):
+    """Windows of dzsave's deepest level: [(col, row, (left, top, width, height))]."""
+    tiles = []
+    for row in range(math.ceil(height / tile_size)):
+        top = row * tile_size - (overlap if row > 0 else 0)
+        bottom = min(height, (row + 1) * tile_size + overlap)
+        for col in range(math.ceil(width / tile_size)):
+            left = col * tile_size - (overlap if col > 0 else 0)
+            right = min(width, (col + 1) * tile_size + overlap)
+            tiles.append((col, row, (left, top, right - left, bottom - top)))
+    return tiles
+
+
+def as_rgb8(image):
+    """Convert to 3-band uchar the way the DZI JPEG tiles end up."""
+    if image.hasalpha():
+        image = image.flatten()
+    if image.interpretation in ("rgb16", "grey16"):
+        image = image.colourspace("srgb")
+    if image.bands == 1:
+        image = image.bandjoin([image, image])
+    elif image.bands > 3:
+        image = image.extract_band(0, n=3)
+    if image.format != "uchar":
+        image = image.cast("uchar")
+    return image
+
+
+def iter_tile_batches(tiles, batch_size, load_fn=load_rgb, workers=None, queue_depth=None):
+    """
+    Yield (batch, loaded) pairs in order, where loaded[i] = load_fn(batch[i]).
+    Up to queue_depth batches ahead of the one being consumed are decoded on a
+    bounded thread pool, so decode and preprocessing overlap with model compute.
+    """
+    workers = workers or TILE_LOADER_WORKERS
+    queue_depth = max(1, queue_depth or TILE_PREFETCH_DEPTH)
+    batches = iter([tiles[i:i + batch_size] for i in range(0, len(tiles), batch_size)])
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile-loader") as pool:
+        pending = deque()
+
+        def submit_next():
+            batch = next(batches, None)
+            if batch is not None:
+                pending.append((batch, [submit(pool, load_fn, tile) for tile in batch]))
+
+        for _ in range(queue_depth):
+            submit_next()
+
+        try:
+            while pending:
+                batch, futures = pending.popleft()
+                submit_next()
+                yield batch, [f.result() for f in futures]
+        finally:
+            # consumer stopped early or a load failed: drop queued work
+            for _, futures in pending:
+                for f in futures:
+                    f.cancel()
@@ -0,0 +1,185 @@
+"""
+Binary manifest written next to every pyramid generate_dzi creates, {prefix}.manifest:
+
+    header   magic, version, deepest level, full width/height, tile size, overlap, tile suffix
+    levels   per level 0..deepest: width, height, cols, rows, index of its first tile record
+    tiles    per level, row-major over its full grid: byte offset and length of the tile
+             (in the zip container, or offset 0 for one file per tile; length 0 = no tile)
+    stats    per deepest-level tile, row-major: grey mean, variance and no-data fraction
+             of the tile including its overlap, as tile triage computes them (before JPEG encoding)
+
+Everything a detector needs about a pyramid is read with one small file read, instead of
+listing zoom folders, parsing tile names and reading tile headers.
+"""
+import math
+import os
+import struct
+from pathlib import Path
+import numpy as np
+
+MAGIC = b"SARTILES"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIIII8s")
+LEVEL_DTYPE = np.dtype([("width", "<u4"), ("height", "<u4"), ("cols", "<u4"), ("rows", "<u4"), ("first", "<u8")])
+TILE_DTYPE = np.dtype([("offset", "<u8"), ("length", "<u4")])
+STATS_DTYPE = np.dtype([("mean", "<f4"), ("var", "<f4"), ("nodata", "<f4")])
+
+
+def manifest_path(prefix):
+    return Path(f"{prefix}.manifest")
+
+
+def pyramid_prefix(tile_folder):
+    """{prefix} of the pyramid whose tiles live (or would live, in folder layout) in {prefix}_files."""
+    folder = str(tile_folder).rstrip("/\\")
+    if folder.endswith("_files"):
+        folder = folder[:-len("_files")]
+    return folder
+
+
+def manifest_path_for_folder(tile_folder):
+    """Manifest of the pyramid whose tiles live in tile_folder ({prefix}_files)."""
+    return manifest_path(pyramid_prefix(tile_folder))
+
+
+def level_grid(width, height, deepest, tile_size):
+    """(width, height, cols, rows) of every level, level 0 first; each level is the next one halved, rounded up."""
+    grid = []
+    for level in range(deepest + 1):
+        w = max(1, math.ceil(width / 2 ** (deepest - level)))
+        h = max(1, math.ceil(height / 2 ** (deepest - level)))
+        grid.append((w, h, math.ceil(w / tile_size), math.ceil(h / tile_size)))
+    return grid
+
+
+def folder_tile_index(files_dir, suffix):
+    """{(level, col, row): (0, file size)} of the tiles in a dzsave {prefix}_files folder."""
+    index = {}
+    for level_dir in os.scandir(files_dir):
+        if not (level_dir.is_dir() and level_dir.name.isdigit()):
+            continue
+        for entry in os.scandir(level_dir.path):
+            name, ext = os.path.splitext(entry.name)
+            if ext == suffix:
+                col, row = (int(v) for v in name.split("_"))
+                index[(int(level_dir.name), col, row)] = (0, entry.stat().st_size)
+    return index
+
+
+def write_manifest(prefix, width, height, tile_size, overlap, suffix, stats, tile_index=None):
+    """
+    Save {prefix}.manifest for a pyramid dzsave wrote.
+    stats: (mean, var, nodata) float arrays of shape (rows, cols) for the deepest level.
+    tile_index: {(level, col, row): (offset, length)}, e.g. from tile_container.zip_tile_index;
+    defaults to the tiles under {prefix}_files.
+    """
+    if tile_index is None:
+        tile_index = folder_tile_index(f"{prefix}_files", suffix)
+    deepest = max(level for level, _, _ in tile_index)
+    grid = level_grid(width, height, deepest, tile_size)
+
+    levels = np.zeros(len(grid), dtype=LEVEL_DTYPE)
+    first = 0
+    for level, (w, h, cols, rows) in enumerate(grid):
+        levels[level] = (w, h, cols, rows, first)
+        first += cols * rows
+    tiles = np.zeros(first, dtype=TILE_DTYPE)
+
+    for (level, col, row), location in tile_index.items():
+        _, _, cols, rows = grid[level]
+        if col < cols and row < rows:
+            tiles[int(levels[level]["first"]) + row * cols + col] = location
+
+    _, _, cols, rows = grid[-1]
+    table = np.zeros(rows * cols, dtype=STATS_DTYPE)
+    for field, values in zip(("mean", "var", "nodata"), stats):
+        table[field] = np.asarray(values, dtype=np.float32).reshape(-1)
+
+    path = manifest_path(prefix)
+    tmp = path.with_suffix(".manifest.tmp")
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, deepest, width, height, tile_size, overlap, suffix.encode()))
+        f.write(levels.tobytes())
+        f.write(tiles.tobytes())
+        f.write(table.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def load_manifest(path):
+    """The TileManifest at path, or None when there is none."""
+    try:
+        data = Path(path).read_bytes()
+    except FileNotFoundError:
+        return None
+    return TileManifest(path, data)
+
+
+class TileManifest:
+    """Parsed {prefix}.manifest; the tables are numpy views into the file's bytes."""
+    def __init__(self, path, data):
+        self.path = str(path)
+        magic, version, deepest, width, height, tile_size, overlap, suffix = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a version {VERSION} tile manifest: {path}")
+        self.deepest = deepest
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.suffix = suffix.rstrip(b"\0").decode()
+
+        offset = HEADER.size
+        self.levels = np.frombuffer(data, dtype=LEVEL_DTYPE, count=deepest + 1, offset=offset)
+        offset += self.levels.nbytes
+        n_tiles = int((self.levels["cols"].astype(np.int64) * self.levels["rows"]).sum())
+        self.tiles = np.frombuffer(data, dtype=TILE_DTYPE, count=n_tiles, offset=offset)
+        offset += self.tiles.nbytes
+        cols, rows = self.grid(deepest)
+        self.stats = np.frombuffer(data, dtype=STATS_DTYPE, count=cols * rows, offset=offset)
+
+    def check(self, tile_size, overlap):
+        """Raise if the pyramid was not cut with the tiling a detector expects."""
+        if (tile_size, overlap) != (self.tile_size, self.overlap):
+            raise ValueError(
+                f"Pyramid {self.path} has tile size {self.tile_size} and overlap {self.overlap}, "
+                f"expected {tile_size} and {overlap}; regenerate it with /api/generate_dzi"
+            )
+
+    def level_size(self, level):
+        entry = self.levels[int(level)]
+        return int(entry["width"]), int(entry["height"])
+
+    def grid(self, level):
+        entry = self.levels[int(level)]
+        return int(entry["cols"]), int(entry["rows"])
+
+    def entries(self, level):
+        """Tile records of a level, row-major over its grid."""
+        cols, rows = self.grid(level)
+        first = int(self.levels[int(level)]["first"])
+        return self.tiles[first:first + cols * rows]
+
+    def tiles_at(self, level, zoom_path):
+        """[(col, row, path)] of the tiles present on a level, row-major."""
+        cols, _ = self.grid(level)
+        present = np.flatnonzero(self.entries(level)["length"])
+        return [(int(i % cols), int(i // cols), os.path.join(zoom_path, f"{i % cols}_{i // cols}{self.suffix}"))
+                for i in present]
+
+    def tile_locations(self, level):
+        """[(col, row, (offset, length))] of the tiles present on a level, row-major."""
+        cols, _ = self.grid(level)
+        entries = self.entries(level)
+        present = np.flatnonzero(entries["length"])
+        return [(int(i % cols), int(i // cols), (int(entries[i]["offset"]), int(entries[i]["length"])))
+                for i in present]
+
+    def tile_stats(self, level, tiles):
+        """(mean, var, nodata) arrays for tiles of the deepest level, None for any other level."""
+        if int(level) != self.deepest:
+            return None
+        cols, _ = self.grid(level)
+        index = np.array([row * cols + col for col, row, _ in tiles], dtype=np.int64)
+        picked = self.stats[index]
+        return picked["mean"], picked["var"], picked["nodata"]
@@ -0,0 +1,98 @@
+import numpy as np
+from config import (
+    TRIAGE_ENABLED, TRIAGE_NODATA_VALUE, TRIAGE_MAX_NODATA_FRACTION, TRIAGE_MIN_VARIANCE, TRIAGE_MIN_MEAN
+)
+
+
+def tile_stats(images):
+    """
+    Grey-level mean, variance and no-data fraction of each image, computed for the
+    whole batch at once on the concatenated pixels.
+    Returns three float arrays of len(images).
+    """
+    grey = [np.asarray(img.convert("L")).ravel() for img in images]
+    counts = np.array([g.size for g in grey], dtype=np.float64)
+    starts = np.concatenate(([0], np.cumsum(counts[:-1]))).astype(np.int64)
+    flat = np.concatenate(grey).astype(np.float64)
+
+    mean = np.add.reduceat(flat, starts) / counts
+    var = np.add.reduceat(flat * flat, starts) / counts - mean ** 2
+    nodata = np.add.reduceat(flat == TRIAGE_NODATA_VALUE, starts) / counts
+    return mean, var, nodata
+
+
+def triage_params():
+    """Settings that decide which tiles are skipped, for cache keys and checkpoints."""
+    return [TRIAGE_ENABLED, TRIAGE_NODATA_VALUE, TRIAGE_MAX_NODATA_FRACTION, TRIAGE_MIN_VARIANCE, TRIAGE_MIN_MEAN]
+
+
+def select_tiles(images, enabled=None):
+    """
+    Boolean keep-mask over images: False for tiles that are mostly no-data,
+    darker than TRIAGE_MIN_MEAN or flatter than TRIAGE_MIN_VARIANCE.
+    """
+    if enabled is None:
+        enabled = TRIAGE_ENABLED
+    if not enabled or not images:
+        return np.ones(len(images), dtype=bool)
+
+    return ~skip_from_stats(*tile_stats(images))
+
+
+def skip_from_stats(mean, var, nodata):
+    """Boolean mask of the tiles triage skips, given their grey mean, variance and no-data fraction."""
+    return (nodata >= TRIAGE_MAX_NODATA_FRACTION) | (var < TRIAGE_MIN_VARIANCE) | (mean < TRIAGE_MIN_MEAN)
+
+
+def prefilter_tiles(source, triage=None, enabled=None):
+    """
+    source.tiles without the ones its tile manifest's statistics already mark as
+    skipped, so they are never decoded. Sources without statistics (no manifest, a
+    lower pyramid level, a TIFF) are returned whole and triaged after decoding.
+    """
+    if enabled is None:
+        enabled = TRIAGE_ENABLED
+    stats = source.tile_stats(source.tiles) if enabled and hasattr(source, "tile_stats") and source.tiles else None
+    if stats is None:
+        return source.tiles
+    skip = skip_from_stats(*stats)
+    if triage is not None:
+        triage.record_skipped(int(np.count_nonzero(skip)))
+    return [tile for tile, s in zip(source.tiles, skip) if not s]
+
+
+class TriageStats:
+    """Tiles seen and skipped during a run, and the model time the skipped ones would have cost."""
+    def __init__(self):
+        self.tiles_total = 0
+        self.tiles_skipped = 0
+        self.model_seconds = 0.0
+        self.model_tiles = 0
+
+    def record_batch(self, keep):
+        self.tiles_total += len(keep)
+        self.tiles_skipped += int(len(keep) - np.count_nonzero(keep))
+
+    def record_skipped(self, n_tiles):
+        """Tiles skipped before decoding, from manifest statistics."""
+        self.tiles_total += n_tiles
+        self.tiles_skipped += n_tiles
+
+    def record_model(self, seconds, n_tiles):
+        self.model_seconds += seconds
+        self.model_tiles += n_tiles
+
+    def merge(self, other):
+        """Add the counts of another run, e.g. one shard of a parallel scene."""
+        self.tiles_total += other.tiles_total
+        self.tiles_skipped += other.tiles_skipped
+        self.model_seconds += other.model_seconds
+        self.model_tiles += other.model_tiles
+
+    def as_dict(self):
+        per_tile = self.model_seconds / self.model_tiles if self.model_tiles else 0.0
+        return {
+            "tiles_total": self.tiles_total,
+            "tiles_skipped": self.tiles_skipped,
+            "time_saved_s": round(per_tile * self.tiles_skipped, 3),
+        }
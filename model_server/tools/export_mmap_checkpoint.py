@@ -0,0 +1,22 @@
+"""
+Write the ship model's weights as a plain torch state dict (SHIP_MMAP_CHECKPOINT)
+so that MODEL_SHARE_MODE=mmap can memory-map them. The oil-spill checkpoint
+(OILSPILL_MODEL_PATH) is already a torch state dict and is mapped directly.
+
+Run from model_server/:
+    python -m tools.export_mmap_checkpoint
+"""
+import torch
+from config import SHIP_MODEL_PATH, SHIP_MMAP_CHECKPOINT
+
+
+def main():
+    from transformers import DeformableDetrForObjectDetection
+
+    model = DeformableDetrForObjectDetection.from_pretrained(SHIP_MODEL_PATH)
+    torch.save(model.state_dict(), str(SHIP_MMAP_CHECKPOINT))
+    print(f"Saved {SHIP_MMAP_CHECKPOINT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+Export the detectors as TorchScript and ONNX graphs and time every backend on this host.
+
+Graphs are written to EXPORTED_MODEL_DIR, where SHIP_BACKEND / OILSPILL_BACKEND
+(torchscript or onnx) pick them up. Each backend is then checked against eager
+PyTorch on the same input and timed; the fastest one per model is reported, with the
+full table saved as backend_report.json. Exports are tagged with the fingerprint of
+the weights they came from, so re-run this after updating a model.
+
+Before it is saved as usable, every export is also compared with eager on inputs of
+another shape: for the ship model a batch of edge tiles (which the processor resizes
+to a different shape) and a partial last batch. A graph that has the traced shape
+baked in fails this check and is refused by SHIP_BACKEND / OILSPILL_BACKEND.
+
+Run from model_server/:
+    python -m tools.export_models [--model ship|oilspill|all] [--batch 4] [--repeats 10]
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+import torch
+from PIL import Image
+from config import SHIP_MODEL_PATH, OILSPILL_MODEL_PATH, EXPORTED_MODEL_DIR
+from services import ship_detector, oilspill_detector
+from services.inference_backend import BACKENDS, load_backend, export_graph
+
+
+def _noise_tiles(width, height, count):
+    return [Image.effect_noise((width, height), 64).convert("RGB") for _ in range(count)]
+
+
+def _ship(batch):
+    from transformers import DeformableDetrImageProcessor
+
+    module = ship_detector.ShipGraph(ship_detector._load_fp32_network().cpu()).eval()
+    processor = DeformableDetrImageProcessor.from_pretrained(SHIP_MODEL_PATH)
+
+    def inputs(width, height, count):
+        encoded = processor(images=_noise_tiles(width, height, count), return_tensors="pt")
+        return encoded["pixel_values"], encoded["pixel_mask"]
+
+    size = ship_detector.TILE_SIZE + 2 * ship_detector.OVERLAP
+    partial = max(1, batch - 1)
+    return {
+        "module": module,
+        "inputs": inputs(size, size, batch),
+        # the first column's tiles lack one overlap, the last row's are cut to the image edge
+        "check_inputs": [inputs(size - ship_detector.OVERLAP, size, partial),
+                         inputs(size, ship_detector.TILE_SIZE // 3, partial)],
+        "source_path": SHIP_MODEL_PATH,
+        "input_names": ["pixel_values", "pixel_mask"],
+        "output_names": ["logits", "pred_boxes"],
+        "dynamic_axes": {
+            "pixel_values": {0: "batch", 2: "height", 3: "width"},
+            "pixel_mask": {0: "batch", 1: "height", 2: "width"},
+            "logits": {0: "batch"},
+            "pred_boxes": {0: "batch"},
+        },
+    }
+
+
+def _oilspill(batch):
+    return {
+        "module": oilspill_detector._load_fp32_network().cpu(),
+        "inputs": (torch.zeros(batch, 3, 224, 224),),
+        "check_inputs": [(torch.rand(max(1, batch - 1), 3, 224, 224),)],
+        "source_path": OILSPILL_MODEL_PATH,
+        "input_names": ["pixel_values"],
+        "output_names": ["logits"],
+        "dynamic_axes": {"pixel_values": {0: "batch"}, "logits": {0: "batch"}},
+    }
+
+
+def _as_tuple(outputs):
+    return outputs if isinstance(outputs, tuple) else (outputs,)
+
+
+def _time_backend(run, inputs, repeats):
+    run(*inputs)  # first call compiles / allocates
+    start = time.perf_counter()
+    for _ in range(repeats):
+        outputs = run(*inputs)
+    return (time.perf_counter() - start) / repeats, outputs
+
+
+def benchmark(name, spec, repeats, export):
+    cpu = torch.device("cpu")
+    if export:
+        for backend in ("torchscript", "onnx"):
+            try:
+                path = export_graph(name, backend, spec["module"], spec["inputs"], spec["source_path"],
+                                    spec["input_names"], spec["output_names"], spec["dynamic_axes"],
+                                    check_inputs=spec["check_inputs"])
+                print(f"[{name}] exported {backend}: {path}")
+            except Exception as e:
+                print(f"[{name}] {backend} export failed: {e}")
+
+    results = {}
+    reference = None
+    for backend in BACKENDS:
+        try:
+            run = load_backend(name, backend, spec["module"], cpu, spec["source_path"], fallback=False)
+            seconds, outputs = _time_backend(run, spec["inputs"], repeats)
+        except Exception as e:
+            results[backend] = {"available": False, "error": str(e)}
+            continue
+        outputs = _as_tuple(outputs)
+        if reference is None:
+            reference = outputs
+        max_abs_diff = max(float((a - b).abs().max()) for a, b in zip(reference, outputs))
+        results[backend] = {"available": True, "seconds_per_batch": seconds, "max_abs_diff_vs_eager": max_abs_diff}
+        print(f"[{name}] {backend:<12} {seconds * 1000:8.1f} ms/batch  max|diff| {max_abs_diff:.2e}")
+
+    timed = {b: r for b, r in results.items() if r.get("available")}
+    fastest = min(timed, key=lambda b: timed[b]["seconds_per_batch"])
+    print(f"[{name}] fastest backend: {fastest}")
+    return {"backends": results, "fastest": fastest}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", choices=("ship", "oilspill", "all"), default="all")
+    parser.add_argument("--batch", type=int, default=4, help="tiles per timed forward pass")
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--no-export", action="store_true", help="time existing exports only")
+    args = parser.parse_args()
+
+    specs = {"ship": _ship, "oilspill": _oilspill}
+    names = tuple(specs) if args.model == "all" else (args.model,)
+    report = {"threads": torch.get_num_threads(), "batch": args.batch}
+    for name in names:
+        report[name] = benchmark(name, specs[name](args.batch), args.repeats, export=not args.no_export)
+
+    report_path = Path(EXPORTED_MODEL_DIR) / "backend_report.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2))
+    print(f"Saved {report_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Export int8 versions of the detectors and compare them with fp32 on a reference scene.
+
+The int8 mode quantises every nn.Linear dynamically (int8 weights, activations
+quantised per batch), so there is no activation calibration to run: the reference
+scene is used to measure what int8 costs in accuracy and gains in speed before
+INFERENCE_PRECISION=int8 is switched on. Quantised models are saved to
+QUANTIZED_MODEL_DIR, where the "ship:int8" / "oilspill:int8" loaders pick them up,
+with the comparison report next to them as {model}_int8_report.json.
+
+The scene must already have a DZI pyramid (/api/generate_dzi/{type}/{image_id}), in either layout.
+
+Run from model_server/:
+    python -m tools.quantize_models --scene <image_id> [--model ship|oilspill|all] [--max-tiles 200]
+"""
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+import numpy as np
+import pyvips
+from config import TILES_DIR, SHIP_MODEL_PATH, OILSPILL_MODEL_PATH, QUANTIZED_MODEL_DIR
+from models.model_loader import get_model
+from services import ship_detector, oilspill_detector
+from services.tile_loader import open_level, pyramid_levels
+from services.quantization import model_name, export_int8, quantized_checkpoint_path
+
+MATCH_IOU = 0.5
+
+
+def _deepest_level(dzi_folder):
+    levels = pyramid_levels(dzi_folder)
+    if not levels:
+        raise FileNotFoundError(f"No pyramid found for {dzi_folder}")
+    return str(max(levels))
+
+
+def _subset(source, max_tiles):
+    if max_tiles:
+        source.tiles = source.tiles[:max_tiles]
+    return source
+
+
+def _timed(fn):
+    start = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - start
+
+
+def _match_detections(reference, candidate, iou_threshold=MATCH_IOU):
+    """Greedy one-to-one matching of candidate boxes to reference boxes of the same label."""
+    matched, score_diffs = 0, []
+    used = set()
+    for det in sorted(candidate, key=lambda d: -d["score"]):
+        x0, y0, x1, y1 = det["x"], det["y"], det["x"] + det["w"], det["y"] + det["h"]
+        best, best_iou = None, iou_threshold
+        for i, ref in enumerate(reference):
+            if i in used or ref["label"] != det["label"]:
+                continue
+            ix = max(0.0, min(x1, ref["x"] + ref["w"]) - max(x0, ref["x"]))
+            iy = max(0.0, min(y1, ref["y"] + ref["h"]) - max(y0, ref["y"]))
+            inter = ix * iy
+            union = det["w"] * det["h"] + ref["w"] * ref["h"] - inter
+            iou = inter / union if union > 0 else 0.0
+            if iou >= best_iou:
+                best, best_iou = i, iou
+        if best is not None:
+            used.add(best)
+            matched += 1
+            score_diffs.append(abs(det["score"] - reference[best]["score"]))
+    return {
+        "fp32_detections": len(reference),
+        "int8_detections": len(candidate),
+        "recall": matched / len(reference) if reference else 1.0,
+        "precision": matched / len(candidate) if candidate else 1.0,
+        "mean_abs_score_diff": float(np.mean(score_diffs)) if score_diffs else 0.0,
+    }
+
+
+def compare_ship(dzi_folder, zoom_level, max_tiles):
+    runs = {}
+    for precision in ("fp32", "int8"):
+        ship_detector.warmup(precision)
+        source = _subset(open_level(dzi_folder, zoom_level, ship_detector.TILE_SIZE, ship_detector.OVERLAP,
+                                    exts=(".jpeg",)), max_tiles)
+        report = {}
+        detections, seconds = _timed(lambda: ship_detector.detect_ships(
+            str(dzi_folder), zoom_level, source=source, report=report, precision=precision))
+        runs[precision] = {"detections": detections, "seconds": seconds, "tiles": len(source.tiles),
+                           "triage": report.get("triage")}
+    return runs, _match_detections(runs["fp32"]["detections"], runs["int8"]["detections"])
+
+
+def _mask_agreement(path_a, path_b):
+    a = pyvips.Image.new_from_file(str(path_a), access="sequential")[0] > 127
+    b = pyvips.Image.new_from_file(str(path_b), access="sequential")[0] > 127
+    # boolean vips images are 0/255, so avg() / 255 is the fraction of set pixels
+    inter = (a & b).avg() / 255
+    union = (a | b).avg() / 255
+    differ = (a ^ b).avg() / 255
+    return {
+        "pixel_agreement": 1.0 - differ,
+        "spill_iou": inter / union if union > 0 else 1.0,
+    }
+
+
+def compare_oilspill(dzi_folder, zoom_level, max_tiles):
+    runs, masks, outputs = {}, {}, []
+    for precision in ("fp32", "int8"):
+        oilspill_detector.warmup(precision)
+        source = _subset(open_level(dzi_folder, zoom_level, oilspill_detector.TILE_SIZE,
+                                    oilspill_detector.OVERLAP), max_tiles)
+        image_id = f"quantize_check_{precision}"
+        report = {}
+        result, seconds = _timed(lambda: oilspill_detector.detect_oilspill(
+            str(dzi_folder), zoom_level, image_id=image_id, source=source, report=report, precision=precision,
+            resumable=False, stitched_png=True))
+        masks[precision] = result["stitched_mask"]
+        outputs.append(result)
+        runs[precision] = {"seconds": seconds, "tiles": len(source.tiles), "triage": report.get("triage")}
+    accuracy = _mask_agreement(masks["fp32"], masks["int8"])
+    # the scratch runs must not show up among the served oil-spill results:
+    # {image_id}/ holds the PNG, {image_id}.dzi and {image_id}_files/ the mask pyramid
+    for result in outputs:
+        shutil.rmtree(result["dzi_path"], ignore_errors=True)
+        shutil.rmtree(result["dzi_folder"], ignore_errors=True)
+        Path(f"{result['dzi_path']}.dzi").unlink(missing_ok=True)
+    return runs, accuracy
+
+
+def _checkpoint_size(path):
+    path = Path(path)
+    if path.is_dir():
+        return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+    return path.stat().st_size
+
+
+def run(name, scene, max_tiles, export):
+    dzi_folder = TILES_DIR / name / f"{scene}_files"
+    zoom_level = _deepest_level(dzi_folder)
+    source_path = SHIP_MODEL_PATH if name == "ship" else OILSPILL_MODEL_PATH
+
+    if export:
+        # quantised from the current fp32 weights by the int8 loader
+        export_int8(name, get_model(model_name(name, "int8"))["model"], source_path)
+
+    if name == "ship":
+        runs, accuracy = compare_ship(dzi_folder, zoom_level, max_tiles)
+        for run_ in runs.values():
+            run_.pop("detections")
+    else:
+        runs, accuracy = compare_oilspill(dzi_folder, zoom_level, max_tiles)
+
+    for run_ in runs.values():
+        run_["tiles_per_s"] = run_["tiles"] / run_["seconds"] if run_["seconds"] else None
+    report = {
+        "model": name,
+        "scene": scene,
+        "zoom_level": zoom_level,
+        "runs": runs,
+        "speedup": runs["fp32"]["seconds"] / runs["int8"]["seconds"] if runs["int8"]["seconds"] else None,
+        "accuracy_vs_fp32": accuracy,
+    }
+    int8_path = quantized_checkpoint_path(name)
+    if int8_path.exists():
+        report["size_bytes"] = {"fp32": _checkpoint_size(source_path), "int8": _checkpoint_size(int8_path)}
+
+    report_path = Path(QUANTIZED_MODEL_DIR) / f"{name}_int8_report.json"
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    report_path.write_text(json.dumps(report, indent=2))
+    print(json.dumps(report, indent=2))
+    print(f"Saved {report_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scene", required=True, help="image_id of a scene with a generated DZI pyramid")
+    parser.add_argument("--model", choices=("ship", "oilspill", "all"), default="all")
+    parser.add_argument("--max-tiles", type=int, default=0, help="only use the first N tiles (0 = all)")
+    parser.add_argument("--no-export", action="store_true", help="compare only, do not write int8 checkpoints")
+    args = parser.parse_args()
+
+    names = ("ship", "oilspill") if args.model == "all" else (args.model,)
+    for name in names:
+        run(name, args.scene, args.max_tiles, export=not args.no_export)
+
+
+if __name__ == "__main__":
+    main()
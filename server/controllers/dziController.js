@@ -13,6 +13,11 @@ function dziExists(type, imageId) {
   return fs.existsSync(dziFile);
 }
 
+// Pyramid written with DZI_CONTAINER=zip: read by the detectors only, the viewer cannot open it
+function containerExists(type, imageId) {
+  return fs.existsSync(path.join(dziBaseDir, type, `${imageId}.zip`));
+}
+
 exports.generateDZI = async (req, res) => {
   const { type, imageId } = req.params;
 
@@ -28,6 +33,12 @@ exports.generateDZI = async (req, res) => {
         dziUrl: `/tiles/${type}/${imageId}.dzi`
       });
     }
+    if (containerExists(type, imageId)) {
+      return res.status(200).json({
+        message: 'DZI container already exists; it is for the detectors only and has no viewer URL',
+        container: `${type}/${imageId}.zip`
+      });
+    }
 
     // 🔁 Call Python backend with type and imageId
     const response = await axios.post(`http://localhost:8000/api/generate_dzi/${type}/${imageId}`);
@@ -49,6 +60,7 @@ exports.listDZIs = (req, res) => {
   if (!fs.existsSync(typeDir)) {
     return res.status(200).json({ dziFiles: [] });
   }
+  // zip containers are left out: the viewer cannot open them
   const dziFiles = fs.readdirSync(typeDir).filter(f => f.endsWith(".dzi")).map(f => ({
         label: f.replace(".dzi", ""),  // nice display name
         dzi: `/tiles/${type}/${f}`